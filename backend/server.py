@@ -1,15 +1,19 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, Query, BackgroundTasks, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import FileResponse as FastAPIFileResponse, StreamingResponse
-from starlette.background import BackgroundTask
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+from anyio import from_thread
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import List, Literal, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
 import jwt
@@ -17,9 +21,23 @@ import bcrypt
 import aiofiles
 import qrcode
 from io import BytesIO
-from PIL import Image
 import json
 import shutil
+import base64
+import hashlib
+import re
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from derivatives import (
+    FORMAT_MEDIA_TYPES, DerivativeEngine, DerivativeSpec, derivative_filename, encoder_available, read_capture_time,
+    render_derivatives
+)
+from httpfiles import accel_redirect_response, accepted_media_types, file_response, if_range_matches, parse_range
+from zipstream import ZipLayout, file_crc32, members_from_paths, unique_arcnames
+from cache import TTLCache
+from urllib.parse import quote
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -34,9 +52,14 @@ DATA_DIR = Path(os.environ.get('DATA_DIR', '/app/data'))
 FILES_DIR = Path(os.environ.get('FILES_DIR', '/app/files'))
 THUMBNAILS_DIR = DATA_DIR / 'thumbnails'
 PREVIEWS_DIR = DATA_DIR / 'previews'
+DISPLAY_DIR = DATA_DIR / 'display'
+SRCSET_DIR = DATA_DIR / 'srcset'  # one subdirectory per width
+
+# Widths every image is also rendered at, for <img srcset> (comma separated)
+SRCSET_WIDTHS = sorted({int(w) for w in os.environ.get('SRCSET_WIDTHS', '240,480,960,1600,2400').split(',') if w.strip()})
 
 # Create directories
-for d in [DATA_DIR, FILES_DIR, THUMBNAILS_DIR, PREVIEWS_DIR]:
+for d in [DATA_DIR, FILES_DIR, THUMBNAILS_DIR, PREVIEWS_DIR, DISPLAY_DIR, *(SRCSET_DIR / str(w) for w in SRCSET_WIDTHS)]:
     d.mkdir(parents=True, exist_ok=True)
 
 # JWT settings
@@ -47,9 +70,32 @@ JWT_EXPIRATION_HOURS = 24
 # Domain for share links
 SHARE_DOMAIN = os.environ.get('SHARE_DOMAIN', 'https://weddingsbymark.uk')
 
-# Activity logging helper
+# Activity logging - entries are buffered in memory and written in batches by
+# activity_log_writer(), so guest requests never wait on an insert
+ACTIVITY_LOG_BATCH_SIZE = int(os.environ.get('ACTIVITY_LOG_BATCH_SIZE', 100))
+ACTIVITY_LOG_FLUSH_MS = int(os.environ.get('ACTIVITY_LOG_FLUSH_MS', 1000))
+ACTIVITY_LOG_BUFFER_SIZE = int(os.environ.get('ACTIVITY_LOG_BUFFER_SIZE', 10000))
+# Searches stop counting matches past this many (the total is then reported as an estimate)
+ACTIVITY_SEARCH_COUNT_LIMIT = int(os.environ.get('ACTIVITY_SEARCH_COUNT_LIMIT', 1000))
+# Mongo's TTL monitor removes entries this long after their logged_at
+ACTIVITY_LOG_RETENTION_DAYS = int(os.environ.get('ACTIVITY_LOG_RETENTION_DAYS', 400))
+activity_buffer = []
+activity_flush_needed = asyncio.Event()
+activity_log_stats = {'written': 0, 'dropped': 0, 'failed': 0, 'batches': 0}
+
+def search_tokens(*values: Optional[str]) -> List[str]:
+    """Lowercased words (and whole values) of the searchable log fields, for prefix lookups"""
+    tokens = set()
+    for value in values:
+        if value:
+            value = value.casefold()
+            tokens.add(value)
+            tokens.update(re.findall(r'[^\W_]+', value))
+    return sorted(tokens)
+
 async def log_activity(action: str, share_token: str = None, folder_name: str = None, file_name: str = None, details: dict = None, ip_address: str = None):
-    """Log client activity for tracking"""
+    """Queue client activity for tracking (dropped and counted if the buffer is full)"""
+    now = datetime.now(timezone.utc)
     log_entry = {
         'id': str(uuid.uuid4()),
         'action': action,  # 'gallery_view', 'file_download', 'zip_download', 'file_upload'
@@ -58,9 +104,85 @@ async def log_activity(action: str, share_token: str = None, folder_name: str =
         'file_name': file_name,
         'details': details or {},
         'ip_address': ip_address,
-        'created_at': datetime.now(timezone.utc).isoformat()
+        'created_at': now.isoformat(),
+        'logged_at': now,  # real date for the TTL index; created_at stays the ISO string the API returns
+        'search_tokens': search_tokens(folder_name, share_token, file_name)
     }
-    await db.activity_logs.insert_one(log_entry)
+    if len(activity_buffer) >= ACTIVITY_LOG_BUFFER_SIZE:
+        activity_log_stats['dropped'] += 1
+        return
+    activity_buffer.append(log_entry)
+    if len(activity_buffer) >= ACTIVITY_LOG_BATCH_SIZE:
+        activity_flush_needed.set()
+
+async def flush_activity_logs():
+    """Write everything buffered so far with insert_many, a batch at a time"""
+    while activity_buffer:
+        batch = activity_buffer[:ACTIVITY_LOG_BATCH_SIZE]
+        del activity_buffer[:ACTIVITY_LOG_BATCH_SIZE]
+        try:
+            await db.activity_logs.insert_many(batch, ordered=False)
+        except asyncio.CancelledError:
+            # Shutting down mid-write: keep the batch for the final flush (its _ids stop
+            # entries that did land from being written twice)
+            activity_buffer[:0] = batch
+            raise
+        except BulkWriteError as e:
+            # Duplicate _ids are entries of a re-queued batch that landed before the cancel: they're
+            # written, and since that write never got as far as its rollups, they're folded in below
+            errors = [error for error in e.details['writeErrors'] if error['code'] != 11000]
+            if errors:
+                activity_log_stats['failed'] += len(errors)
+                logger.error(f"Failed to write {len(errors)} activity log entries: {errors[0]['errmsg']}")
+            failed = {error['index'] for error in errors}
+            batch = [entry for i, entry in enumerate(batch) if i not in failed]
+        except Exception as e:
+            activity_log_stats['failed'] += len(batch)
+            logger.error(f"Failed to write {len(batch)} activity log entries: {e}")
+            continue
+        if not batch:
+            continue
+        activity_log_stats['written'] += len(batch)
+        activity_log_stats['batches'] += 1
+        try:
+            await fold_activity_rollups(batch)
+        except Exception as e:
+            logger.error(f"Failed to update activity rollups for {len(batch)} entries: {e}")
+
+async def fold_activity_rollups(entries: List[dict]):
+    """Add entries to the activity_daily counts, one $inc upsert per (share_token, day, action)"""
+    counts = {}
+    folder_names = {}
+    for entry in entries:
+        key = (entry['share_token'], entry['logged_at'].date().isoformat(), entry['action'])
+        counts[key] = counts.get(key, 0) + 1
+        if entry.get('folder_name'):
+            folder_names[key] = entry['folder_name']
+    updates = []
+    for (share_token, day, action), count in counts.items():
+        update = {'$inc': {'count': count}}
+        if (share_token, day, action) in folder_names:
+            update['$set'] = {'folder_name': folder_names[(share_token, day, action)]}
+        updates.append(UpdateOne({'share_token': share_token, 'day': day, 'action': action}, update, upsert=True))
+    if updates:
+        await db.activity_daily.bulk_write(updates, ordered=False)
+
+async def activity_log_writer():
+    """Flush the activity buffer every ACTIVITY_LOG_FLUSH_MS, or sooner when a batch fills up"""
+    try:
+        # Seed the rollups from existing logs before anything new is folded in
+        if not await db.activity_daily.find_one({}, {'_id': 1}) and await db.activity_logs.find_one({}, {'_id': 1}):
+            rows = await rebuild_activity_rollups()
+            logger.info(f"Built {rows} activity rollup rows from existing logs")
+    except Exception as e:
+        logger.error(f"Activity rollup rebuild failed: {e}")
+    while True:
+        try:
+            await asyncio.wait_for(activity_flush_needed.wait(), timeout=ACTIVITY_LOG_FLUSH_MS / 1000)
+        except asyncio.TimeoutError:
+            pass
+        activity_flush_needed.clear()
+        await flush_activity_logs()
 
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
@@ -103,6 +225,16 @@ class FolderResponse(BaseModel):
     created_at: str
     file_count: int = 0
     subfolder_count: int = 0
+    total_bytes: int = 0
+    recursive_file_count: int = 0
+    recursive_total_bytes: int = 0
+    ancestors: List[str] = []
+    ancestor_names: List[str] = []
+
+class SrcsetEntry(BaseModel):
+    url: str
+    width: int
+    height: int
 
 class FileResponseModel(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -114,6 +246,14 @@ class FileResponseModel(BaseModel):
     created_at: str
     thumbnail_url: Optional[str] = None
     preview_url: Optional[str] = None
+    derivative_status: Optional[str] = None  # pending, ready, failed (None for older files)
+    captured_at: Optional[str] = None  # EXIF capture time, or upload time when there isn't one
+    display_url: Optional[str] = None
+    srcset: List[SrcsetEntry] = []  # narrowest first; empty until rendered
+
+class FilePage(BaseModel):
+    files: List[FileResponseModel]
+    next_cursor: Optional[str] = None  # pass back as ?cursor= for the next page; None on the last
 
 class ShareResponse(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -175,6 +315,48 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode(), hashed.encode())
 
+# bcrypt burns ~250ms of CPU per call, so it gets a few threads of its own (it releases the GIL)
+# and refuses new work once they and a short queue are busy
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 8))
+password_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='bcrypt')
+password_hash_pending = 0
+
+async def run_password_hash(fn, *args):
+    """Run hash_password/verify_password in the bcrypt pool; 429 when it's saturated"""
+    global password_hash_pending
+    if password_hash_pending >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE:
+        raise HTTPException(status_code=429, detail="Too many login attempts, try again shortly", headers={'Retry-After': '1'})
+    password_hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_hash_executor, fn, *args)
+    finally:
+        password_hash_pending -= 1
+
+# Per-IP sliding window of login attempts (in memory, per process). Bounded: an IP
+# drops out a window after its last attempt, or earlier when LOGIN_TRACKED_IPS are tracked.
+LOGIN_MAX_ATTEMPTS = int(os.environ.get('LOGIN_MAX_ATTEMPTS', 10))
+LOGIN_WINDOW_SECONDS = int(os.environ.get('LOGIN_WINDOW_SECONDS', 300))
+LOGIN_TRACKED_IPS = int(os.environ.get('LOGIN_TRACKED_IPS', 10000))
+login_attempts = TTLCache(LOGIN_TRACKED_IPS, LOGIN_WINDOW_SECONDS)  # ip -> deque of attempt times
+
+def client_ip(request: Request) -> str:
+    """The client address nginx saw. X-Forwarded-For isn't used: its start is whatever the client sent."""
+    return request.headers.get('X-Real-IP') or (request.client.host if request.client else 'unknown')
+
+def check_login_rate(ip: str):
+    """Record a login attempt from ip; 429 if it has used up its attempts for the window"""
+    now = time.monotonic()
+    cutoff = now - LOGIN_WINDOW_SECONDS
+    attempts = login_attempts.get(ip) or deque()
+    while attempts and attempts[0] <= cutoff:
+        attempts.popleft()
+    if len(attempts) >= LOGIN_MAX_ATTEMPTS:
+        retry_after = int(attempts[0] - cutoff) + 1
+        raise HTTPException(status_code=429, detail="Too many login attempts, try again later", headers={'Retry-After': str(retry_after)})
+    attempts.append(now)
+    login_attempts.set(ip, attempts)
+
 def create_token(username: str) -> str:
     payload = {
         'sub': username,
@@ -182,51 +364,649 @@ def create_token(username: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-async def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    if not credentials:
-        raise HTTPException(status_code=401, detail="Not authenticated")
+# Verified tokens skip the signature check and admin lookup until they expire (or the TTL runs out).
+# There's no way to remove an admin or change a password through the API; if one is done in the
+# database by hand, that admin's tokens keep working for up to ADMIN_TOKEN_CACHE_TTL seconds.
+ADMIN_TOKEN_CACHE_SIZE = int(os.environ.get('ADMIN_TOKEN_CACHE_SIZE', 256))
+ADMIN_TOKEN_CACHE_TTL = float(os.environ.get('ADMIN_TOKEN_CACHE_TTL', 300))
+admin_token_cache = TTLCache(ADMIN_TOKEN_CACHE_SIZE, ADMIN_TOKEN_CACHE_TTL)
+
+async def verify_admin_token(token: str) -> dict:
+    """The admin a JWT belongs to; raises 401 if it's invalid, expired or the admin is gone"""
+    key = hashlib.sha256(token.encode()).hexdigest()
+    admin = admin_token_cache.get(key)
+    if admin is not None:
+        return dict(admin)
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        username = payload.get('sub')
-        admin = await db.admins.find_one({'username': username}, {'_id': 0})
-        if not admin:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return admin
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    admin = await db.admins.find_one({'username': payload.get('sub')}, {'_id': 0, 'password_hash': 0})
+    if not admin:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    expires_at = None
+    if payload.get('exp') is not None:
+        expires_at = time.monotonic() + (payload['exp'] - time.time())
+    admin_token_cache.set(key, admin, expires_at=expires_at)
+    return dict(admin)
+
+async def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    if not credentials:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return await verify_admin_token(credentials.credentials)
 
 # ==================== IMAGE PROCESSING ====================
 
-async def generate_thumbnail(file_path: Path, file_id: str) -> Optional[str]:
+# Decode/resize runs in a process pool so uploads don't stall the event loop
+derivative_engine = DerivativeEngine()
+
+# Besides JPEG, each size is also written in these formats (comma separated: webp, avif)
+# and browsers that accept one get the smallest. Formats this Pillow can't write are dropped.
+DERIVATIVE_FORMATS = ['jpeg']
+for fmt in os.environ.get('DERIVATIVE_FORMATS', 'webp').lower().split(','):
+    fmt = fmt.strip()
+    if not fmt or fmt in DERIVATIVE_FORMATS:
+        continue
+    if fmt in FORMAT_MEDIA_TYPES and encoder_available(fmt):
+        DERIVATIVE_FORMATS.append(fmt)
+    else:
+        logger.warning(f"Derivative format {fmt} is not available, skipping it")
+# Smallest first - the order formats are offered in
+FORMAT_PREFERENCE = [fmt for fmt in ('avif', 'webp', 'jpeg') if fmt in DERIVATIVE_FORMATS]
+
+# Every image gets each of these sizes, generated from a single decode of the original
+DERIVATIVE_SPECS = [
+    DerivativeSpec('thumbnail', str(THUMBNAILS_DIR), int(os.environ.get('THUMBNAIL_SIZE', 300)), 85, formats=tuple(DERIVATIVE_FORMATS)),
+    DerivativeSpec('preview', str(PREVIEWS_DIR), int(os.environ.get('PREVIEW_SIZE', 400)), 75, formats=tuple(DERIVATIVE_FORMATS)),
+    # What the lightbox shows, instead of the full original
+    DerivativeSpec('display', str(DISPLAY_DIR), int(os.environ.get('DISPLAY_SIZE', 2048)), 82, progressive=True, formats=tuple(DERIVATIVE_FORMATS)),
+] + [
+    # srcset rungs; ones wider than the original are skipped rather than upscaled
+    DerivativeSpec(f'w{width}', str(SRCSET_DIR / str(width)), width, 80, progressive=width >= 960,
+                   formats=tuple(DERIVATIVE_FORMATS), exact_width=True)
+    for width in SRCSET_WIDTHS
+]
+SRCSET_SPEC_NAMES = {f'w{width}' for width in SRCSET_WIDTHS}
+
+def derivative_paths(file_id: str) -> dict:
+    """Every file DERIVATIVE_SPECS writes for a file, keyed by (spec name, format)"""
+    return {
+        (spec.name, fmt): Path(spec.directory) / derivative_filename(file_id, fmt)
+        for spec in DERIVATIVE_SPECS for fmt in spec.formats
+    }
+
+async def generate_derivatives(file_path: Path, file_id: str) -> List[dict]:
+    """Write every size in DERIVATIVE_SPECS for an image and return the srcset rungs written.
+    Raises if decoding fails."""
+    result = await derivative_engine.run(render_derivatives, str(file_path), file_id, DERIVATIVE_SPECS)
+    return [
+        {'width': width, 'height': result.sizes[f'w{width}'][1]}
+        for width in SRCSET_WIDTHS if f'w{width}' in result.sizes
+    ]
+
+# ==================== BACKGROUND JOBS ====================
+
+# Jobs live in db.jobs so work queued by an upload survives a restart. The API
+# runs a worker loop in-process unless RUN_JOB_WORKER=false, in which case run
+# `python -m worker` separately.
+RUN_JOB_WORKER = os.environ.get('RUN_JOB_WORKER', 'true').lower() == 'true'
+JOB_CONCURRENCY = int(os.environ.get('JOB_CONCURRENCY', derivative_engine.queue_size))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 5))
+JOB_LEASE_SECONDS = 300  # a running job not finished by then is assumed dead and re-claimed
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BASE_SECONDS = 10  # backoff: 10s, 20s, 40s, 80s
+# Finished jobs are deleted; failed ones are kept this long (TTL on finished_at) for inspection
+JOB_FAILED_RETENTION_DAYS = int(os.environ.get('JOB_FAILED_RETENTION_DAYS', 14))
+
+job_wakeup = asyncio.Event()
+
+def new_job(job_type: str, payload: dict, key: Optional[str] = None) -> dict:
+    now = datetime.now(timezone.utc)
+    job = {
+        'id': str(uuid.uuid4()),
+        'type': job_type,
+        'payload': payload,
+        'status': 'queued',  # queued, running, done, failed
+        'attempts': 0,
+        'max_attempts': JOB_MAX_ATTEMPTS,
+        'run_after': now,
+        'locked_until': None,
+        'last_error': None,
+        'created_at': now.isoformat(),
+        'updated_at': now.isoformat()
+    }
+    if key:
+        # Unique among queued/running jobs (removed once a job ends), so the same work isn't queued twice
+        job['key'] = key
+    return job
+
+async def enqueue_job(job_type: str, payload: dict, key: Optional[str] = None) -> Optional[str]:
+    """Queue a job; returns its id, or None if a job with the same key is already queued or running"""
+    job = new_job(job_type, payload, key)
     try:
-        with Image.open(file_path) as img:
-            img.thumbnail((300, 300), Image.Resampling.LANCZOS)
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-            thumb_path = THUMBNAILS_DIR / f"{file_id}.jpg"
-            img.save(thumb_path, 'JPEG', quality=85)
-            return str(thumb_path)
-    except Exception as e:
-        logger.error(f"Thumbnail generation failed: {e}")
+        await db.jobs.insert_one(job)
+    except DuplicateKeyError:
         return None
+    job_wakeup.set()
+    return job['id']
+
+def derivatives_job_key(file_id: str) -> str:
+    return f"derivatives:{file_id}"
+
+async def enqueue_derivatives(file_id: str) -> Optional[str]:
+    return await enqueue_job('derivatives', {'file_id': file_id}, key=derivatives_job_key(file_id))
+
+async def claim_job() -> Optional[dict]:
+    """Atomically take the oldest runnable job (or one whose worker died)"""
+    now = datetime.now(timezone.utc)
+    return await db.jobs.find_one_and_update(
+        {'$or': [
+            {'status': 'queued', 'run_after': {'$lte': now}},
+            {'status': 'running', 'locked_until': {'$lt': now}}
+        ]},
+        {
+            '$set': {
+                'status': 'running',
+                'locked_until': now + timedelta(seconds=JOB_LEASE_SECONDS),
+                'updated_at': now.isoformat()
+            },
+            '$inc': {'attempts': 1}
+        },
+        projection={'_id': 0},
+        sort=[('run_after', 1)],
+        return_document=ReturnDocument.AFTER
+    )
 
-async def generate_preview(file_path: Path, file_id: str, max_size: int = 400) -> Optional[str]:
+async def run_derivatives_job(job: dict):
+    file_id = job['payload']['file_id']
+    file_doc = await db.files.find_one({'id': file_id}, {'_id': 0})
+    if not file_doc:
+        return  # deleted before we got to it
     try:
-        with Image.open(file_path) as img:
-            ratio = min(max_size / img.width, max_size / img.height)
-            if ratio < 1:
-                new_size = (int(img.width * ratio), int(img.height * ratio))
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-            preview_path = PREVIEWS_DIR / f"{file_id}.jpg"
-            img.save(preview_path, 'JPEG', quality=75)
-            return str(preview_path)
+        srcset = await generate_derivatives(FILES_DIR / file_doc['stored_name'], file_id)
+    except Exception:
+        if job['attempts'] >= job['max_attempts']:
+            await db.files.update_one({'id': file_id}, {'$set': {'derivative_status': 'failed'}})
+        raise
+    # A new version changes the derivative URLs, so browsers drop their cached copies
+    await db.files.update_one(
+        {'id': file_id},
+        {'$set': {
+            'derivative_status': 'ready',
+            'derivative_sizes': [spec.name for spec in DERIVATIVE_SPECS],
+            'derivative_formats': DERIVATIVE_FORMATS,
+            'srcset': srcset,
+            'derivatives_version': int(time.time() * 1000)
+        }}
+    )
+
+JOB_HANDLERS = {
+    'derivatives': run_derivatives_job,
+}
+
+async def run_job(job: dict):
+    try:
+        await JOB_HANDLERS[job['type']](job)
+    except asyncio.CancelledError:
+        # Shutting down mid-job: hand it back without using up an attempt
+        await db.jobs.update_one(
+            {'id': job['id']},
+            {'$set': {'status': 'queued', 'locked_until': None}, '$inc': {'attempts': -1}}
+        )
+        raise
     except Exception as e:
-        logger.error(f"Preview generation failed: {e}")
-        return None
+        now = datetime.now(timezone.utc)
+        update = {'last_error': str(e), 'locked_until': None, 'updated_at': now.isoformat()}
+        if job['attempts'] >= job['max_attempts']:
+            update['status'] = 'failed'
+            update['finished_at'] = now
+            logger.error(f"Job {job['id']} ({job['type']}) failed permanently: {e}")
+            await db.jobs.update_one({'id': job['id']}, {'$set': update, '$unset': {'key': ''}})
+        else:
+            update['status'] = 'queued'
+            update['run_after'] = now + timedelta(seconds=JOB_RETRY_BASE_SECONDS * 2 ** (job['attempts'] - 1))
+            logger.warning(f"Job {job['id']} ({job['type']}) attempt {job['attempts']} failed, will retry: {e}")
+            await db.jobs.update_one({'id': job['id']}, {'$set': update})
+        return
+    await db.jobs.delete_one({'id': job['id']})
+
+async def job_worker_loop():
+    """Claim and run jobs until cancelled, at most JOB_CONCURRENCY at a time"""
+    slots = asyncio.Semaphore(JOB_CONCURRENCY)
+    running = set()
+
+    def finished(task):
+        running.discard(task)
+        slots.release()
+
+    try:
+        while True:
+            await slots.acquire()
+            try:
+                job_wakeup.clear()
+                job = await claim_job()
+            except Exception as e:
+                logger.error(f"Job claim failed: {e}")
+                job = None
+            if not job:
+                slots.release()
+                try:
+                    await asyncio.wait_for(job_wakeup.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(run_job(job))
+            running.add(task)
+            task.add_done_callback(finished)
+    finally:
+        for task in list(running):
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+# ==================== INDEXES ====================
+
+# Every hot query filters on one of these; without them gallery listings are collection scans.
+# Missing indexes are created at startup; `python manage.py ensure-indexes` does the same by hand.
+INDEXES = {
+    'admins': [
+        IndexModel([('username', ASCENDING)], name='username_unique', unique=True),
+    ],
+    'folders': [
+        IndexModel([('id', ASCENDING)], name='id_unique', unique=True),
+        IndexModel([('parent_id', ASCENDING)], name='parent_id'),
+        IndexModel([('ancestors', ASCENDING)], name='ancestors'),
+    ],
+    'files': [
+        IndexModel([('id', ASCENDING)], name='id_unique', unique=True),
+        IndexModel([('folder_id', ASCENDING)], name='folder_id'),
+        # One per listing sort order; id breaks ties so cursors are stable
+        IndexModel([('folder_id', ASCENDING), ('name', ASCENDING), ('id', ASCENDING)], name='folder_id_name_id'),
+        IndexModel([('folder_id', ASCENDING), ('captured_at', ASCENDING), ('id', ASCENDING)], name='folder_id_captured_at_id'),
+        IndexModel([('folder_id', ASCENDING), ('created_at', ASCENDING), ('id', ASCENDING)], name='folder_id_created_at_id'),
+    ],
+    'shares': [
+        IndexModel([('id', ASCENDING)], name='id_unique', unique=True),
+        IndexModel([('token', ASCENDING)], name='token_unique', unique=True),
+        IndexModel([('folder_id', ASCENDING)], name='folder_id'),
+    ],
+    'activity_logs': [
+        IndexModel([('created_at', DESCENDING)], name='created_at'),
+        IndexModel([('logged_at', ASCENDING)], name='logged_at_ttl', expireAfterSeconds=ACTIVITY_LOG_RETENTION_DAYS * 86400),
+        IndexModel([('search_tokens', ASCENDING), ('created_at', DESCENDING)], name='search_tokens_created_at'),
+    ],
+    'activity_daily': [
+        IndexModel([('share_token', ASCENDING), ('day', ASCENDING), ('action', ASCENDING)], name='share_token_day_action', unique=True),
+        IndexModel([('day', ASCENDING)], name='day'),
+    ],
+    'orders': [
+        IndexModel([('id', ASCENDING)], name='id_unique', unique=True),
+        IndexModel([('created_at', DESCENDING)], name='created_at'),
+        IndexModel([('status', ASCENDING), ('created_at', DESCENDING)], name='status_created_at'),
+    ],
+    'print_products': [
+        IndexModel([('id', ASCENDING)], name='id_unique', unique=True),
+    ],
+    'jobs': [
+        IndexModel([('id', ASCENDING)], name='id_unique', unique=True),
+        IndexModel([('status', ASCENDING), ('run_after', ASCENDING)], name='status_run_after'),
+        IndexModel([('key', ASCENDING)], name='key_unique', unique=True, partialFilterExpression={'key': {'$exists': True}}),
+        IndexModel([('finished_at', ASCENDING)], name='finished_at_ttl', expireAfterSeconds=JOB_FAILED_RETENTION_DAYS * 86400),
+    ],
+}
+
+# Representative hot-path queries checked by explain() in diagnostics mode
+DIAGNOSTIC_QUERIES = [
+    ('folders', {'id': 'x'}, None),
+    ('folders', {'parent_id': 'x'}, None),
+    ('folders', {'ancestors': 'x'}, None),
+    ('files', {'id': 'x'}, None),
+    ('files', {'folder_id': 'x'}, None),
+    ('files', {'folder_id': 'x'}, {'captured_at': 1, 'id': 1}),
+    ('files', {'folder_id': 'x', '$or': [{'name': {'$gt': 'x'}}, {'name': 'x', 'id': {'$gt': 'x'}}]}, {'name': 1, 'id': 1}),
+    ('shares', {'token': 'x'}, None),
+    ('shares', {'folder_id': 'x'}, None),
+    ('activity_logs', {}, {'created_at': -1}),
+    ('activity_logs', {'search_tokens': {'$regex': '^x'}}, {'created_at': -1}),
+    ('activity_daily', {'day': {'$gte': '2000-01-01'}}, None),
+    ('activity_daily', {'share_token': 'x', 'day': {'$gte': '2000-01-01'}}, None),
+    ('orders', {'status': 'pending'}, {'created_at': -1}),
+    ('orders', {}, {'created_at': -1}),
+    ('jobs', {'status': 'queued', 'run_after': {'$lte': datetime(2000, 1, 1)}}, {'run_after': 1}),
+]
+
+QUERY_DIAGNOSTICS = os.environ.get('QUERY_DIAGNOSTICS', 'false').lower() == 'true'
+
+async def ensure_indexes() -> List[str]:
+    """Create any declared index that doesn't exist yet. Returns the names created."""
+    created = []
+    for collection, models in INDEXES.items():
+        existing = await db[collection].index_information()
+        for model in models:
+            name = model.document['name']
+            if name in existing:
+                ttl = model.document.get('expireAfterSeconds')
+                if ttl is not None and existing[name].get('expireAfterSeconds') != ttl:
+                    # Retention changed - TTL indexes can be updated in place
+                    await db.command('collMod', collection, index={'name': name, 'expireAfterSeconds': ttl})
+                    logger.info(f"Updated TTL of index {collection}.{name} to {ttl}s")
+                continue
+            options = dict(model.document)
+            keys = list(options.pop('key').items())
+            try:
+                # Index build runs server-side without blocking reads/writes on the collection
+                await db[collection].create_index(keys, background=True, **options)
+                created.append(f"{collection}.{name}")
+                logger.info(f"Created index {collection}.{name}")
+            except Exception as e:
+                # e.g. duplicate values blocking a unique index - keep serving, but say so
+                logger.error(f"Could not create index {collection}.{name}: {e}")
+    return created
+
+def plan_stages(plan: dict):
+    yield plan.get('stage')
+    if 'inputStage' in plan:
+        yield from plan_stages(plan['inputStage'])
+    for child in plan.get('inputStages', []):
+        yield from plan_stages(child)
+
+async def find_collection_scans() -> List[str]:
+    """Explain each diagnostic query and return those whose winning plan is a COLLSCAN"""
+    scans = []
+    for collection, query, sort in DIAGNOSTIC_QUERIES:
+        command = {'find': collection, 'filter': query}
+        if sort:
+            command['sort'] = sort
+        explained = await db.command('explain', command, verbosity='queryPlanner')
+        if 'COLLSCAN' in plan_stages(explained['queryPlanner']['winningPlan']):
+            description = f"{collection} filter={query} sort={sort}"
+            scans.append(description)
+            logger.warning(f"Collection scan: {description}")
+    return scans
+
+async def backfill_activity_logs(missing_field: str, compute, batch_size: int = 1000) -> int:
+    """Set ``missing_field`` to ``compute(entry)`` on every activity entry that lacks it, in bulk batches"""
+    updated = 0
+    batch = []
+    async for entry in db.activity_logs.find({missing_field: {'$exists': False}}):
+        batch.append(UpdateOne({'_id': entry['_id']}, {'$set': {missing_field: compute(entry)}}))
+        if len(batch) >= batch_size:
+            await db.activity_logs.bulk_write(batch, ordered=False)
+            updated += len(batch)
+            batch = []
+    if batch:
+        await db.activity_logs.bulk_write(batch, ordered=False)
+        updated += len(batch)
+    return updated
+
+def parse_logged_at(entry: dict) -> datetime:
+    try:
+        logged_at = datetime.fromisoformat(entry['created_at'])
+    except (KeyError, TypeError, ValueError):
+        return datetime.now(timezone.utc)  # unparseable - expire a full retention period from now
+    return logged_at if logged_at.tzinfo else logged_at.replace(tzinfo=timezone.utc)
+
+async def backfill_activity_log_dates() -> int:
+    """Give entries written before logged_at existed one, parsed from created_at, so the TTL index covers them"""
+    return await backfill_activity_logs('logged_at', parse_logged_at)
+
+async def backfill_activity_log_tokens() -> int:
+    """Give entries written before search_tokens existed their tokens, so search can find them"""
+    return await backfill_activity_logs(
+        'search_tokens', lambda entry: search_tokens(entry.get('folder_name'), entry.get('share_token'), entry.get('file_name'))
+    )
+
+async def rebuild_activity_rollups() -> int:
+    """Recompute activity_daily from the raw logs still retained. Returns the number of rows.
+
+    Days whose logs have already expired keep the counts they had.
+    """
+    pipeline = [
+        {'$group': {
+            '_id': {'share_token': '$share_token', 'day': {'$substr': ['$created_at', 0, 10]}, 'action': '$action'},
+            'count': {'$sum': 1},
+            'folder_name': {'$last': '$folder_name'}
+        }}
+    ]
+    groups = await db.activity_logs.aggregate(pipeline).to_list(None)
+    updates = [
+        UpdateOne(dict(g['_id']), {'$set': {'count': g['count'], 'folder_name': g['folder_name']}}, upsert=True)
+        for g in groups
+    ]
+    if updates:
+        await db.activity_daily.bulk_write(updates, ordered=False)
+    return len(updates)
+
+def file_capture_time(f: dict) -> str:
+    """EXIF capture time of a stored image, falling back to its upload time"""
+    captured_at = None
+    if f.get('file_type') == 'image' and f.get('stored_name'):
+        captured_at = read_capture_time(str(FILES_DIR / f['stored_name']))
+    return captured_at or f['created_at']
+
+async def backfill_capture_times(batch_size: int = 500, folder_id: Optional[str] = None) -> int:
+    """Give files uploaded before captured_at existed one (all of them, or one folder's), so every file sorts by capture time"""
+    updated = 0
+    batch = []
+    query = {'captured_at': None}  # missing (or null)
+    if folder_id:
+        query['folder_id'] = folder_id
+    cursor = db.files.find(query, {'_id': 1, 'file_type': 1, 'stored_name': 1, 'created_at': 1})
+    async for f in cursor:
+        captured_at = await run_in_threadpool(file_capture_time, f)
+        batch.append(UpdateOne({'_id': f['_id']}, {'$set': {'captured_at': captured_at}}))
+        if len(batch) >= batch_size:
+            await db.files.bulk_write(batch, ordered=False)
+            updated += len(batch)
+            batch = []
+    if batch:
+        await db.files.bulk_write(batch, ordered=False)
+        updated += len(batch)
+    return updated
+
+async def backfill_file_crcs(batch_size: int = 100) -> int:
+    """Store crc32 on files uploaded before it was recorded, so ZIP downloads (and resumes)
+    never have to read a file in full just to learn its CRC. Reads every such file once."""
+    updated = 0
+    batch = []
+    cursor = db.files.find({'crc32': None}, {'_id': 1, 'stored_name': 1})
+    async for f in cursor:
+        try:
+            crc = await run_in_threadpool(file_crc32, str(FILES_DIR / f['stored_name']))
+        except FileNotFoundError:
+            continue
+        batch.append(UpdateOne({'_id': f['_id']}, {'$set': {'crc32': crc}}))
+        if len(batch) >= batch_size:
+            await db.files.bulk_write(batch, ordered=False)
+            updated += len(batch)
+            batch = []
+    if batch:
+        await db.files.bulk_write(batch, ordered=False)
+        updated += len(batch)
+    return updated
+
+async def queue_derivatives_batch(file_ids: List[str]) -> int:
+    """Mark images pending and queue their jobs in one insert. Returns how many jobs were new."""
+    await db.files.update_many({'id': {'$in': file_ids}}, {'$set': {'derivative_status': 'pending'}})
+    jobs = [new_job('derivatives', {'file_id': file_id}, key=derivatives_job_key(file_id)) for file_id in file_ids]
+    try:
+        result = await db.jobs.insert_many(jobs, ordered=False)
+        inserted = len(result.inserted_ids)
+    except BulkWriteError as e:
+        # Images that already have a job queued are expected; anything else isn't
+        if any(error['code'] != 11000 for error in e.details['writeErrors']):
+            raise
+        inserted = e.details['nInserted']
+    if inserted:
+        job_wakeup.set()
+    return inserted
+
+async def queue_missing_derivatives(batch_size: int = 1000) -> int:
+    """Queue a derivatives job for every image lacking a size or format (e.g. one enabled since it was rendered)"""
+    query = {
+        'file_type': 'image',
+        'derivative_status': {'$nin': ['pending', 'failed']},
+        '$or': [{'derivative_sizes': {'$ne': spec.name}} for spec in DERIVATIVE_SPECS]
+             + [{'derivative_formats': {'$ne': fmt}} for fmt in DERIVATIVE_FORMATS]
+    }
+    queued = 0
+    batch = []
+    async for f in db.files.find(query, {'_id': 0, 'id': 1}).batch_size(batch_size):
+        batch.append(f['id'])
+        if len(batch) >= batch_size:
+            queued += await queue_derivatives_batch(batch)
+            batch = []
+    if batch:
+        queued += await queue_derivatives_batch(batch)
+    return queued
+
+async def bootstrap_indexes():
+    try:
+        await ensure_indexes()
+        if await db.activity_logs.find_one({'logged_at': {'$exists': False}}, {'_id': 1}):
+            updated = await backfill_activity_log_dates()
+            logger.info(f"Backfilled logged_at on {updated} activity log entries")
+        if await db.activity_logs.find_one({'search_tokens': {'$exists': False}}, {'_id': 1}):
+            updated = await backfill_activity_log_tokens()
+            logger.info(f"Backfilled search_tokens on {updated} activity log entries")
+        if await db.files.find_one({'captured_at': {'$exists': False}}, {'_id': 1}):
+            updated = await backfill_capture_times()
+            logger.info(f"Backfilled captured_at on {updated} files")
+        queued = await queue_missing_derivatives()
+        if queued:
+            logger.info(f"Queued derivatives for {queued} images missing a size or format")
+        if QUERY_DIAGNOSTICS:
+            await find_collection_scans()
+    except Exception as e:
+        logger.error(f"Index bootstrap failed: {e}")
+
+# ==================== FOLDER TREE ====================
+
+# Every folder document carries its lineage so hierarchy checks never walk parent pointers:
+#   ancestors, ancestor_names                       - ids/names from the root down to the parent
+# and its own counters so listings never count files:
+#   file_count, subfolder_count, total_bytes        - direct contents
+#   recursive_file_count, recursive_total_bytes     - the folder and everything below it
+FOLDER_COUNTER_FIELDS = ('file_count', 'subfolder_count', 'total_bytes', 'recursive_file_count', 'recursive_total_bytes')
+
+def empty_folder_counters() -> dict:
+    return {field: 0 for field in FOLDER_COUNTER_FIELDS}
+
+async def folder_lineage(parent_id: Optional[str]) -> dict:
+    """The ancestors/ancestor_names fields for a new child of parent_id"""
+    parent = None
+    if parent_id:
+        parent = await db.folders.find_one(
+            {'id': parent_id}, {'_id': 0, 'id': 1, 'name': 1, 'ancestors': 1, 'ancestor_names': 1}
+        )
+    if not parent:
+        return {'ancestors': [], 'ancestor_names': []}
+    return {
+        'ancestors': parent.get('ancestors', []) + [parent['id']],
+        'ancestor_names': parent.get('ancestor_names', []) + [parent['name']]
+    }
+
+def folder_display_path(folder: dict) -> str:
+    return ' / '.join(folder.get('ancestor_names', []) + [folder['name']])
+
+async def get_ancestor_ids(folder_id: str) -> List[str]:
+    """Ids of the folder's ancestors, from the root down to its parent"""
+    folder = await db.folders.find_one({'id': folder_id}, {'_id': 0, 'ancestors': 1})
+    return folder.get('ancestors', []) if folder else []
+
+async def inc_recursive_totals(folder_ids: List[str], files: int, size: int):
+    if folder_ids and (files or size):
+        await db.folders.update_many(
+            {'id': {'$in': folder_ids}},
+            {'$inc': {'recursive_file_count': files, 'recursive_total_bytes': size}}
+        )
+
+async def adjust_folder_counters(folder_id: str, files: int = 0, size: int = 0, subfolders: int = 0):
+    """Apply file/byte/subfolder deltas to a folder's direct contents, plus its ancestors' recursive totals"""
+    if not (files or size or subfolders):
+        return
+    await db.folders.update_one(
+        {'id': folder_id},
+        {'$inc': {'file_count': files, 'total_bytes': size, 'subfolder_count': subfolders,
+                  'recursive_file_count': files, 'recursive_total_bytes': size}}
+    )
+    if files or size:
+        await inc_recursive_totals(await get_ancestor_ids(folder_id), files, size)
+
+async def reconcile_folder_counters() -> int:
+    """Recompute every folder's counters from the files collection. Returns how many changed."""
+    folders, file_groups = await asyncio.gather(
+        db.folders.find({}, {'_id': 0, 'id': 1, 'parent_id': 1, **{field: 1 for field in FOLDER_COUNTER_FIELDS}}).to_list(None),
+        db.files.aggregate([
+            {'$group': {'_id': '$folder_id', 'count': {'$sum': 1}, 'bytes': {'$sum': '$size'}}}
+        ]).to_list(None)
+    )
+    by_id = {f['id']: f for f in folders}
+    direct = {g['_id']: g for g in file_groups}
+    counters = {}
+    for f in folders:
+        group = direct.get(f['id'], {})
+        counters[f['id']] = {
+            'file_count': group.get('count', 0),
+            'subfolder_count': 0,
+            'total_bytes': group.get('bytes', 0),
+            'recursive_file_count': group.get('count', 0),
+            'recursive_total_bytes': group.get('bytes', 0),
+        }
+    for f in folders:
+        if f.get('parent_id') in counters:
+            counters[f['parent_id']]['subfolder_count'] += 1
+        # Add this folder's own files to every ancestor's recursive totals
+        seen = {f['id']}
+        parent_id = f.get('parent_id')
+        while parent_id in by_id and parent_id not in seen:
+            seen.add(parent_id)
+            counters[parent_id]['recursive_file_count'] += counters[f['id']]['file_count']
+            counters[parent_id]['recursive_total_bytes'] += counters[f['id']]['total_bytes']
+            parent_id = by_id[parent_id].get('parent_id')
+    updates = [
+        UpdateOne({'id': folder_id}, {'$set': values})
+        for folder_id, values in counters.items()
+        if any(by_id[folder_id].get(field) != value for field, value in values.items())
+    ]
+    if updates:
+        await db.folders.bulk_write(updates, ordered=False)
+    return len(updates)
+
+async def reconcile_folder_paths() -> int:
+    """Recompute every folder's ancestors/ancestor_names from parent_id. Returns how many changed."""
+    folders = await db.folders.find(
+        {}, {'_id': 0, 'id': 1, 'name': 1, 'parent_id': 1, 'ancestors': 1, 'ancestor_names': 1}
+    ).to_list(None)
+    by_id = {f['id']: f for f in folders}
+    updates = []
+    for f in folders:
+        ancestors, names = [], []
+        seen = {f['id']}
+        parent_id = f.get('parent_id')
+        while parent_id in by_id and parent_id not in seen:
+            seen.add(parent_id)
+            ancestors.insert(0, parent_id)
+            names.insert(0, by_id[parent_id]['name'])
+            parent_id = by_id[parent_id].get('parent_id')
+        if f.get('ancestors') != ancestors or f.get('ancestor_names') != names:
+            updates.append(UpdateOne({'id': f['id']}, {'$set': {'ancestors': ancestors, 'ancestor_names': names}}))
+    if updates:
+        await db.folders.bulk_write(updates, ordered=False)
+    return len(updates)
+
+async def bootstrap_folder_tree():
+    """Fill in lineage and counters for folders created before they existed (or by the migration script)"""
+    try:
+        if await db.folders.find_one({'ancestors': {'$exists': False}}, {'_id': 0, 'id': 1}):
+            updated = await reconcile_folder_paths()
+            logger.info(f"Folder ancestors reconciled for {updated} folder(s)")
+        if await db.folders.find_one({'recursive_total_bytes': {'$exists': False}}, {'_id': 0, 'id': 1}):
+            updated = await reconcile_folder_counters()
+            logger.info(f"Folder counters reconciled for {updated} folder(s)")
+    except Exception as e:
+        logger.error(f"Folder tree reconciliation failed: {e}")
 
 # ==================== SETUP ROUTES ====================
 
@@ -244,7 +1024,7 @@ async def setup_admin(admin: AdminCreate):
     admin_doc = {
         'id': str(uuid.uuid4()),
         'username': admin.username,
-        'password_hash': hash_password(admin.password),
+        'password_hash': await run_password_hash(hash_password, admin.password),
         'created_at': datetime.now(timezone.utc).isoformat()
     }
     await db.admins.insert_one(admin_doc)
@@ -254,10 +1034,13 @@ async def setup_admin(admin: AdminCreate):
 # ==================== AUTH ROUTES ====================
 
 @api_router.post("/auth/login")
-async def login(credentials: AdminLogin):
+async def login(credentials: AdminLogin, request: Request):
+    ip = client_ip(request)
+    check_login_rate(ip)
     admin = await db.admins.find_one({'username': credentials.username})
-    if not admin or not verify_password(credentials.password, admin['password_hash']):
+    if not admin or not await run_password_hash(verify_password, credentials.password, admin['password_hash']):
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    login_attempts.pop(ip)
     token = create_token(credentials.username)
     return {"token": token, "username": credentials.username}
 
@@ -273,9 +1056,13 @@ async def create_folder(folder: FolderCreate, admin = Depends(get_current_admin)
         'id': str(uuid.uuid4()),
         'name': folder.name,
         'parent_id': folder.parent_id,
-        'created_at': datetime.now(timezone.utc).isoformat()
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        **await folder_lineage(folder.parent_id),
+        **empty_folder_counters()
     }
     await db.folders.insert_one(folder_doc)
+    if folder.parent_id:
+        await adjust_folder_counters(folder.parent_id, subfolders=1)
     return FolderResponse(**folder_doc)
 
 @api_router.get("/folders", response_model=List[FolderResponse])
@@ -285,49 +1072,20 @@ async def get_folders(parent_id: Optional[str] = None, admin = Depends(get_curre
         parent_id = None
     query = {'parent_id': parent_id}
     folders = await db.folders.find(query, {'_id': 0}).to_list(1000)
-    
-    result = []
-    for f in folders:
-        file_count = await db.files.count_documents({'folder_id': f['id']})
-        subfolder_count = await db.folders.count_documents({'parent_id': f['id']})
-        result.append(FolderResponse(**f, file_count=file_count, subfolder_count=subfolder_count))
-    return result
+    return [FolderResponse(**f) for f in folders]
 
 @api_router.get("/folders/all", response_model=List[FolderResponse])
 async def get_all_folders(admin = Depends(get_current_admin)):
     """Get all folders including subfolders with full path names"""
-    all_folders = await db.folders.find({}, {'_id': 0}).to_list(1000)
-    
-    # Build path names for each folder
-    async def get_path_name(folder):
-        path_parts = [folder['name']]
-        current = folder
-        while current.get('parent_id'):
-            parent = await db.folders.find_one({'id': current['parent_id']}, {'_id': 0})
-            if parent:
-                path_parts.insert(0, parent['name'])
-                current = parent
-            else:
-                break
-        return ' / '.join(path_parts)
-    
-    result = []
-    for f in all_folders:
-        file_count = await db.files.count_documents({'folder_id': f['id']})
-        subfolder_count = await db.folders.count_documents({'parent_id': f['id']})
-        path_name = await get_path_name(f)
-        folder_with_path = {**f, 'name': path_name}
-        result.append(FolderResponse(**folder_with_path, file_count=file_count, subfolder_count=subfolder_count))
-    return result
+    all_folders = await db.folders.find({}, {'_id': 0}).to_list(None)
+    return [FolderResponse(**{**f, 'name': folder_display_path(f)}) for f in all_folders]
 
 @api_router.get("/folders/{folder_id}", response_model=FolderResponse)
 async def get_folder(folder_id: str, admin = Depends(get_current_admin)):
     folder = await db.folders.find_one({'id': folder_id}, {'_id': 0})
     if not folder:
         raise HTTPException(status_code=404, detail="Folder not found")
-    file_count = await db.files.count_documents({'folder_id': folder_id})
-    subfolder_count = await db.folders.count_documents({'parent_id': folder_id})
-    return FolderResponse(**folder, file_count=file_count, subfolder_count=subfolder_count)
+    return FolderResponse(**folder)
 
 @api_router.post("/folders/{folder_id}/duplicate", response_model=FolderResponse)
 async def duplicate_folder(folder_id: str, admin = Depends(get_current_admin)):
@@ -336,77 +1094,101 @@ async def duplicate_folder(folder_id: str, admin = Depends(get_current_admin)):
     if not original:
         raise HTTPException(status_code=404, detail="Folder not found")
     
-    async def copy_folder(src_folder, new_parent_id):
+    async def copy_folder(src_folder, new_parent_id, lineage):
         """Recursively copy folder structure"""
+        subfolders = await db.folders.find({'parent_id': src_folder['id']}, {'_id': 0}).to_list(1000)
         new_folder = {
             'id': str(uuid.uuid4()),
             'name': src_folder['name'] + ' (Copy)' if new_parent_id == src_folder.get('parent_id') else src_folder['name'],
             'parent_id': new_parent_id,
-            'created_at': datetime.now(timezone.utc).isoformat()
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            **lineage,
+            # Files aren't copied, so only the subfolder count is non-zero
+            **empty_folder_counters(),
+            'subfolder_count': len(subfolders)
         }
         await db.folders.insert_one(new_folder)
         
         # Copy subfolders recursively
-        subfolders = await db.folders.find({'parent_id': src_folder['id']}, {'_id': 0}).to_list(1000)
+        child_lineage = {
+            'ancestors': lineage['ancestors'] + [new_folder['id']],
+            'ancestor_names': lineage['ancestor_names'] + [new_folder['name']]
+        }
         for sf in subfolders:
-            await copy_folder(sf, new_folder['id'])
+            await copy_folder(sf, new_folder['id'], child_lineage)
         
         return new_folder
     
-    # Create the duplicate
-    new_folder = await copy_folder(original, original.get('parent_id'))
+    # Create the duplicate alongside the original
+    new_folder = await copy_folder(original, original.get('parent_id'), await folder_lineage(original.get('parent_id')))
+    if new_folder['parent_id']:
+        await adjust_folder_counters(new_folder['parent_id'], subfolders=1)
     
-    file_count = 0
-    subfolder_count = await db.folders.count_documents({'parent_id': new_folder['id']})
-    return FolderResponse(**new_folder, file_count=file_count, subfolder_count=subfolder_count)
+    return FolderResponse(**new_folder)
 
 @api_router.put("/folders/{folder_id}", response_model=FolderResponse)
 async def update_folder(folder_id: str, folder: FolderUpdate, admin = Depends(get_current_admin)):
-    result = await db.folders.update_one({'id': folder_id}, {'$set': {'name': folder.name}})
-    if result.matched_count == 0:
+    updated = await db.folders.find_one_and_update(
+        {'id': folder_id}, {'$set': {'name': folder.name}},
+        projection={'_id': 0}, return_document=ReturnDocument.AFTER
+    )
+    if not updated:
         raise HTTPException(status_code=404, detail="Folder not found")
-    updated = await db.folders.find_one({'id': folder_id}, {'_id': 0})
+    # Descendants hold this folder's name at the same depth in their ancestor_names
+    depth = len(updated.get('ancestors', []))
+    await db.folders.update_many({'ancestors': folder_id}, {'$set': {f'ancestor_names.{depth}': folder.name}})
     return FolderResponse(**updated)
 
 @api_router.delete("/folders/{folder_id}")
 async def delete_folder(folder_id: str, admin = Depends(get_current_admin)):
+    folder = await db.folders.find_one({'id': folder_id}, {'_id': 0})
+    if folder and folder.get('parent_id'):
+        # The whole subtree goes, so its recursive totals come off every ancestor
+        await db.folders.update_one({'id': folder['parent_id']}, {'$inc': {'subfolder_count': -1}})
+        await inc_recursive_totals(
+            await get_ancestor_ids(folder_id),
+            -folder.get('recursive_file_count', 0),
+            -folder.get('recursive_total_bytes', 0)
+        )
+    await delete_folder_tree(folder_id)
+    return {"message": "Folder deleted"}
+
+def remove_stored_files(file_docs: List[dict]):
+    """Delete the originals and every derivative of file_docs. Blocking, so run it in a thread."""
+    for f in file_docs:
+        for path in [FILES_DIR / f['stored_name'], *derivative_paths(f['id']).values()]:
+            path.unlink(missing_ok=True)
+
+async def delete_folder_tree(folder_id: str):
+    """Delete a folder, its files, subfolders and shares (counters are the caller's job)"""
     # Delete all files in folder
-    files = await db.files.find({'folder_id': folder_id}, {'_id': 0}).to_list(1000)
-    for f in files:
-        file_path = FILES_DIR / f['stored_name']
-        if file_path.exists():
-            file_path.unlink()
-        thumb_path = THUMBNAILS_DIR / f"{f['id']}.jpg"
-        if thumb_path.exists():
-            thumb_path.unlink()
-        preview_path = PREVIEWS_DIR / f"{f['id']}.jpg"
-        if preview_path.exists():
-            preview_path.unlink()
+    files = await db.files.find({'folder_id': folder_id}, {'_id': 0, 'id': 1, 'stored_name': 1}).to_list(1000)
+    await run_in_threadpool(remove_stored_files, files)
     await db.files.delete_many({'folder_id': folder_id})
     
     # Recursively delete subfolders
     subfolders = await db.folders.find({'parent_id': folder_id}, {'_id': 0}).to_list(1000)
     for sf in subfolders:
-        await delete_folder(sf['id'], admin)
+        await delete_folder_tree(sf['id'])
     
     # Delete shares
+    shares = await db.shares.find({'folder_id': folder_id}, {'_id': 0, 'token': 1}).to_list(None)
     await db.shares.delete_many({'folder_id': folder_id})
+    for share in shares:
+        share_cache.pop(share['token'])
     
     # Delete folder
     await db.folders.delete_one({'id': folder_id})
-    return {"message": "Folder deleted"}
 
 @api_router.get("/folders/{folder_id}/path")
 async def get_folder_path(folder_id: str, admin = Depends(get_current_admin)):
-    path = []
-    current_id = folder_id
-    while current_id:
-        folder = await db.folders.find_one({'id': current_id}, {'_id': 0})
-        if not folder:
-            break
-        path.insert(0, {'id': folder['id'], 'name': folder['name']})
-        current_id = folder.get('parent_id')
-    return path
+    folder = await db.folders.find_one({'id': folder_id}, {'_id': 0})
+    if not folder:
+        return []
+    return [
+        {'id': ancestor_id, 'name': name}
+        for ancestor_id, name in zip(folder.get('ancestors', []), folder.get('ancestor_names', []))
+    ] + [{'id': folder['id'], 'name': folder['name']}]
 
 # ==================== FILE ROUTES ====================
 
@@ -439,21 +1221,26 @@ async def upload_file(
     
     # Stream file to disk in chunks (memory efficient for large files)
     file_size = 0
+    crc = 0  # kept so ZIP downloads know every member's CRC up front
     chunk_size = 1024 * 1024  # 1MB chunks
     async with aiofiles.open(file_path, 'wb') as f:
         while chunk := await file.read(chunk_size):
             await f.write(chunk)
             file_size += len(chunk)
+            crc = zlib.crc32(chunk, crc)
     
-    # Generate thumbnails for images
     thumbnail_url = None
     preview_url = None
+    display_url = None
+    derivative_status = None
     if file_type == 'image':
-        await generate_thumbnail(file_path, file_id)
-        await generate_preview(file_path, file_id)
         thumbnail_url = f"/api/files/{file_id}/thumbnail"
         preview_url = f"/api/files/{file_id}/preview"
+        display_url = f"/api/files/{file_id}/display"
+        derivative_status = 'pending'
     
+    created_at = datetime.now(timezone.utc).isoformat()
+    captured_at = await run_in_threadpool(read_capture_time, str(file_path)) if file_type == 'image' else None
     file_doc = {
         'id': file_id,
         'name': file.filename,
@@ -461,9 +1248,18 @@ async def upload_file(
         'stored_name': stored_name,
         'file_type': file_type,
         'size': file_size,
-        'created_at': datetime.now(timezone.utc).isoformat()
+        'crc32': crc,
+        'created_at': created_at,
+        'captured_at': captured_at or created_at
     }
+    if derivative_status:
+        file_doc['derivative_status'] = derivative_status
     await db.files.insert_one(file_doc)
+    await adjust_folder_counters(folder_id, files=1, size=file_size)
+    
+    # Thumbnails/previews are generated by the job worker
+    if file_type == 'image':
+        await enqueue_derivatives(file_id)
     
     return FileResponseModel(
         id=file_id,
@@ -473,59 +1269,273 @@ async def upload_file(
         size=file_size,
         created_at=file_doc['created_at'],
         thumbnail_url=thumbnail_url,
-        preview_url=preview_url
+        preview_url=preview_url,
+        derivative_status=derivative_status,
+        captured_at=file_doc['captured_at'],
+        display_url=display_url
     )
 
-@api_router.get("/files", response_model=List[FileResponseModel])
-async def get_files(folder_id: str, admin = Depends(get_current_admin)):
-    files = await db.files.find({'folder_id': folder_id}, {'_id': 0}).to_list(1000)
-    result = []
-    for f in files:
-        thumbnail_url = None
-        preview_url = None
-        if f['file_type'] == 'image':
-            thumbnail_url = f"/api/files/{f['id']}/thumbnail"
-            preview_url = f"/api/files/{f['id']}/preview"
-        result.append(FileResponseModel(
-            id=f['id'],
-            name=f['name'],
-            folder_id=f['folder_id'],
-            file_type=f['file_type'],
-            size=f['size'],
-            created_at=f['created_at'],
-            thumbnail_url=thumbnail_url,
-            preview_url=preview_url
-        ))
-    return result
+# Listings are paged by keyset: the cursor carries the last row's (sort value, id)
+FILE_PAGE_SIZE = int(os.environ.get('FILE_PAGE_SIZE', 100))
+FILE_PAGE_MAX = 1000
+FILE_SORT_FIELDS = {'name': 'name', 'captured': 'captured_at', 'uploaded': 'created_at'}
+FileSort = Literal['name', 'captured', 'uploaded']
+SortOrder = Literal['asc', 'desc']
+
+def encode_cursor(value, file_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, file_id]).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str):
+    try:
+        value, file_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return value, str(file_id)
+
+def derivative_url(f: dict, kind: str) -> str:
+    url = f"/api/files/{f['id']}/{kind}"
+    if f.get('derivatives_version'):
+        url += f"?v={f['derivatives_version']}"
+    return url
+
+def srcset_entries(f: dict) -> List[dict]:
+    return [
+        {'url': derivative_url(f, f"srcset/{rung['width']}"), 'width': rung['width'], 'height': rung['height']}
+        for rung in f.get('srcset', []) if rung['width'] in SRCSET_WIDTHS
+    ]
+
+def file_listing_entry(f: dict) -> dict:
+    is_image = f['file_type'] == 'image'
+    return {
+        'id': f['id'],
+        'name': f['name'],
+        'folder_id': f['folder_id'],
+        'file_type': f['file_type'],
+        'size': f['size'],
+        'created_at': f['created_at'],
+        'thumbnail_url': derivative_url(f, 'thumbnail') if is_image else None,
+        'preview_url': derivative_url(f, 'preview') if is_image else None,
+        'display_url': derivative_url(f, 'display') if is_image else None,
+        'derivative_status': f.get('derivative_status'),
+        'captured_at': f.get('captured_at'),
+        'srcset': srcset_entries(f) if is_image else []
+    }
+
+async def list_folder_files(folder_id: str, sort: str, order: str, limit: int, cursor: Optional[str]) -> dict:
+    """One page of a folder's files in a stable order, plus the cursor for the next page"""
+    field = FILE_SORT_FIELDS[sort]
+    direction = ASCENDING if order == 'asc' else DESCENDING
+    if field == 'captured_at' and await db.files.find_one({'folder_id': folder_id, 'captured_at': None}, {'_id': 1}):
+        # Not backfilled yet (startup does it in the background). Missing values would sort first and
+        # can't be resumed from, so fill this folder's in now: EXIF time, else upload time.
+        await backfill_capture_times(folder_id=folder_id)
+    query = {'folder_id': folder_id}
+    if cursor:
+        value, last_id = decode_cursor(cursor)
+        op = '$gt' if direction == ASCENDING else '$lt'
+        query['$or'] = [{field: {op: value}}, {field: value, 'id': {op: last_id}}]
+    limit = max(1, min(limit, FILE_PAGE_MAX))
+    # Fetch one extra row to learn whether another page follows
+    files = await db.files.find(query, {'_id': 0}).sort([(field, direction), ('id', direction)]).to_list(limit + 1)
+    next_cursor = None
+    if len(files) > limit:
+        files = files[:limit]
+        next_cursor = encode_cursor(files[-1].get(field), files[-1]['id'])
+    return {'files': [file_listing_entry(f) for f in files], 'next_cursor': next_cursor}
+
+async def files_by_id(folder_id: str, ids: str) -> dict:
+    """Current listing entries for some of a folder's files (comma-separated ``ids``),
+    so a page can pick up derivatives that were still pending when it loaded"""
+    file_ids = [i for i in ids.split(',') if i][:FILE_PAGE_MAX]
+    files = await db.files.find({'folder_id': folder_id, 'id': {'$in': file_ids}}, {'_id': 0}).to_list(len(file_ids))
+    return {'files': [file_listing_entry(f) for f in files]}
+
+@api_router.get("/files", response_model=FilePage)
+async def get_files(
+    folder_id: str,
+    sort: FileSort = 'uploaded',
+    order: SortOrder = 'asc',
+    limit: int = FILE_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    admin = Depends(get_current_admin)
+):
+    return await list_folder_files(folder_id, sort, order, limit, cursor)
+
+@api_router.get("/files/status", response_model=FilePage)
+async def get_files_status(folder_id: str, ids: str, admin = Depends(get_current_admin)):
+    return await files_by_id(folder_id, ids)
+
+# With ACCEL_REDIRECT on, file bytes are sent by nginx: routes do their checks and
+# logging, then answer with an X-Accel-Redirect to an internal location aliased to
+# FILES_DIR or DATA_DIR (see docker/nginx/nginx.conf). Off, Python streams them.
+ACCEL_REDIRECT = os.environ.get('ACCEL_REDIRECT', 'false').lower() == 'true'
+ACCEL_FILES_LOCATION = os.environ.get('ACCEL_FILES_LOCATION', '/_protected/files/')
+ACCEL_DATA_LOCATION = os.environ.get('ACCEL_DATA_LOCATION', '/_protected/data/')
+
+def accel_uri(path: Path) -> Optional[str]:
+    for root, location in ((FILES_DIR, ACCEL_FILES_LOCATION), (DATA_DIR, ACCEL_DATA_LOCATION)):
+        try:
+            relative = path.relative_to(root)
+        except ValueError:
+            continue
+        return location + quote(relative.as_posix())
+    return None
+
+def send_file(request: Request, path: Path, stat_result: Optional[os.stat_result] = None, **kwargs) -> Response:
+    """Serve a stored file, through nginx when ACCEL_REDIRECT is on"""
+    uri = accel_uri(path) if ACCEL_REDIRECT else None
+    if uri:
+        return accel_redirect_response(uri, **kwargs)
+    return file_response(request.headers, path, stat_result=stat_result, **kwargs)
+
+# Derivatives live at a URL per file id and version (?v=), so a URL's bytes never change
+DERIVATIVE_MAX_AGE = int(os.environ.get('DERIVATIVE_MAX_AGE', 365 * 24 * 3600))
+
+def find_derivative(request: Request, directory: Path, file_id: str):
+    """The smallest rendered format the client accepts, as (path, format, stat), or None if there's none at all"""
+    accepted = accepted_media_types(request.headers.get('accept'))
+    for fmt in FORMAT_PREFERENCE:
+        if fmt != 'jpeg' and FORMAT_MEDIA_TYPES[fmt] not in accepted:
+            continue
+        path = directory / derivative_filename(file_id, fmt)
+        try:
+            return path, fmt, path.stat()
+        except FileNotFoundError:
+            continue  # rendered before this format was enabled
+    return None
+
+def derivative_response(request: Request, directory: Path, file_id: str, not_found: str) -> Response:
+    """Serve a derivative image in the best format the client accepts, with long-lived caching.
+    Revalidation is answered from a stat alone."""
+    found = find_derivative(request, directory, file_id)
+    if not found:
+        raise HTTPException(status_code=404, detail=not_found)
+    return derivative_file_response(request, *found)
+
+def derivative_file_response(request: Request, path: Path, fmt: str, st: os.stat_result) -> Response:
+    headers = {'Cache-Control': f'public, max-age={DERIVATIVE_MAX_AGE}, immutable'}
+    if len(FORMAT_PREFERENCE) > 1:
+        headers['Vary'] = 'Accept'
+    return send_file(request, path, media_type=FORMAT_MEDIA_TYPES[fmt], stat_result=st, extra_headers=headers)
 
 @api_router.get("/files/{file_id}/thumbnail")
-async def get_thumbnail(file_id: str):
-    thumb_path = THUMBNAILS_DIR / f"{file_id}.jpg"
-    if not thumb_path.exists():
-        raise HTTPException(status_code=404, detail="Thumbnail not found")
-    return FastAPIFileResponse(thumb_path, media_type="image/jpeg")
+async def get_thumbnail(file_id: str, request: Request):
+    return derivative_response(request, THUMBNAILS_DIR, file_id, "Thumbnail not found")
 
 @api_router.get("/files/{file_id}/preview")
-async def get_preview(file_id: str):
-    preview_path = PREVIEWS_DIR / f"{file_id}.jpg"
-    if not preview_path.exists():
-        raise HTTPException(status_code=404, detail="Preview not found")
-    return FastAPIFileResponse(preview_path, media_type="image/jpeg")
+async def get_preview(file_id: str, request: Request):
+    return derivative_response(request, PREVIEWS_DIR, file_id, "Preview not found")
+
+@api_router.get("/files/{file_id}/srcset/{width}")
+async def get_srcset_image(file_id: str, width: int, request: Request):
+    if width not in SRCSET_WIDTHS:
+        raise HTTPException(status_code=404, detail="Image size not found")
+    return derivative_response(request, SRCSET_DIR / str(width), file_id, "Image size not found")
+
+@api_router.get("/files/{file_id}/display")
+async def get_display(file_id: str, request: Request):
+    """Large image for the lightbox. Until it is rendered the original stands in (not logged as a download)."""
+    found = find_derivative(request, DISPLAY_DIR, file_id)
+    if found:
+        return derivative_file_response(request, *found)
+    file_doc = await db.files.find_one({'id': file_id, 'file_type': 'image'}, {'_id': 0, 'stored_name': 1})
+    if not file_doc:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return send_file(request, FILES_DIR / file_doc['stored_name'])
+
+def attachment_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+async def zip_response(file_docs: List[dict], zip_filename: str, request: Request = None) -> StreamingResponse:
+    """Stream file_docs as a stored ZIP with an exact Content-Length.
+
+    Members are named by each doc's 'arcname' (relative path) or 'name';
+    colliding names get a ' (n)' suffix.
+
+    The layout is computed before sending, so Range requests (download
+    resume) seek straight into the right member file. CRCs come from the
+    file docs; any computed while serving are saved back as soon as they're
+    known, so a dropped download doesn't have to compute them again.
+    """
+    arcnames = unique_arcnames(f.get('arcname', f['name']) for f in file_docs)
+    entries = [(FILES_DIR / f['stored_name'], arcname, f.get('crc32')) for f, arcname in zip(file_docs, arcnames)]
+    members = await run_in_threadpool(members_from_paths, entries)
+    stored_names = {str(FILES_DIR / f['stored_name']): f['id'] for f in file_docs}
+    
+    async def save_crc(path: str, crc: int):
+        try:
+            await db.files.update_one({'id': stored_names[path]}, {'$set': {'crc32': crc}})
+        except Exception as e:
+            logger.warning(f"Failed to save CRC of {path}: {e}")
+    
+    # The layout is iterated in a worker thread, which hands each save back to the event loop
+    layout = ZipLayout(members, on_crc=lambda path, crc: from_thread.run(save_crc, path, crc))
+    
+    fingerprint = hashlib.sha1()
+    for m in members:
+        fingerprint.update(f"{m.arcname}\0{m.size}\0{m.mtime}\0".encode())
+    etag = f'"{fingerprint.hexdigest()}"'
+    
+    headers = {
+        'Content-Disposition': attachment_disposition(zip_filename),
+        'Accept-Ranges': 'bytes',
+        'ETag': etag
+    }
+    byte_range = None
+    if request is not None:
+        if if_range_matches(request.headers, etag):
+            byte_range = parse_range(request.headers.get('Range'), layout.size)
+    start, stop = byte_range or (0, layout.size)
+    headers['Content-Length'] = str(stop - start)
+    if byte_range:
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{layout.size}'
+    
+    return StreamingResponse(
+        iterate_in_threadpool(layout.iter_range(start, stop)),
+        status_code=206 if byte_range else 200,
+        media_type='application/zip',
+        headers=headers
+    )
+
+async def get_subtree_files(root_folder_id: str) -> List[dict]:
+    """All files under a folder, each with an 'arcname' of its path relative to that folder.
+
+    The subtree comes from a single query on the ancestors index and the
+    files from a single $in query, however deep the folders go.
+    """
+    subtree = await db.folders.find(
+        {'ancestors': root_folder_id}, {'_id': 0, 'id': 1, 'name': 1, 'parent_id': 1}
+    ).to_list(None)
+    descendants = {f['id']: f for f in subtree}
+    
+    prefixes = {root_folder_id: ''}
+    def prefix(folder_id):
+        if folder_id not in prefixes:
+            folder = descendants[folder_id]
+            safe_name = folder['name'].replace('/', '_').replace('\\', '_')
+            prefixes[folder_id] = f"{prefix(folder['parent_id'])}{safe_name}/"
+        return prefixes[folder_id]
+    
+    files = await db.files.find(
+        {'folder_id': {'$in': [root_folder_id, *descendants]}}, {'_id': 0}
+    ).to_list(None)
+    for f in files:
+        f['arcname'] = prefix(f['folder_id']) + f['name']
+    files.sort(key=lambda f: (f['arcname'].count('/'), f['arcname'].casefold()))
+    return files
 
 @api_router.get("/folders/{folder_id}/download-zip")
-async def download_folder_as_zip(folder_id: str, token: Optional[str] = None):
-    """Download all files in a folder as a ZIP archive"""
-    import zipfile
-    import tempfile
-    
+async def download_folder_as_zip(folder_id: str, request: Request, token: Optional[str] = None, recursive: bool = False):
+    """Download all files in a folder as a ZIP archive (recursive=true includes subfolders)"""
     # Authenticate via URL token
     admin = None
     if token:
         try:
-            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-            username = payload.get('sub')
-            admin = await db.admins.find_one({'username': username}, {'_id': 0})
-        except:
+            admin = await verify_admin_token(token)
+        except HTTPException:
             pass
     
     if not admin:
@@ -535,65 +1545,26 @@ async def download_folder_as_zip(folder_id: str, token: Optional[str] = None):
     if not folder:
         raise HTTPException(status_code=404, detail="Folder not found")
     
-    files = await db.files.find({'folder_id': folder_id}, {'_id': 0}).to_list(10000)
+    if recursive:
+        files = await get_subtree_files(folder_id)
+    else:
+        files = await db.files.find({'folder_id': folder_id}, {'_id': 0}).to_list(10000)
     if not files:
         raise HTTPException(status_code=404, detail="No files in folder")
     
-    # Create temporary zip file
-    temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
-    
-    try:
-        with zipfile.ZipFile(temp_zip.name, 'w', zipfile.ZIP_STORED) as zf:
-            for file_doc in files:
-                file_path = FILES_DIR / file_doc['stored_name']
-                if file_path.exists():
-                    # Add file to zip with original name (no compression for speed)
-                    zf.write(file_path, file_doc['name'])
-        
-        # Return the zip file
-        zip_filename = f"{folder['name']}.zip"
-        return FastAPIFileResponse(
-            temp_zip.name, 
-            filename=zip_filename,
-            media_type='application/zip',
-            background=BackgroundTask(lambda: Path(temp_zip.name).unlink(missing_ok=True))
-        )
-    except Exception as e:
-        Path(temp_zip.name).unlink(missing_ok=True)
-        logger.error(f"ZIP creation failed: {e}")
-        raise HTTPException(status_code=500, detail="Failed to create ZIP file")
+    return await zip_response(files, f"{folder['name']}.zip", request)
 
 @api_router.post("/files/download-zip")
 async def download_files_as_zip(file_ids: List[str], admin = Depends(get_current_admin)):
     """Download selected files as a ZIP archive"""
-    import zipfile
-    import tempfile
-    
     if not file_ids:
         raise HTTPException(status_code=400, detail="No files selected")
     
-    # Create temporary zip file
-    temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
+    found = await db.files.find({'id': {'$in': file_ids}}, {'_id': 0}).to_list(len(file_ids))
+    by_id = {f['id']: f for f in found}
+    files = [by_id[file_id] for file_id in file_ids if file_id in by_id]
     
-    try:
-        with zipfile.ZipFile(temp_zip.name, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for file_id in file_ids:
-                file_doc = await db.files.find_one({'id': file_id}, {'_id': 0})
-                if file_doc:
-                    file_path = FILES_DIR / file_doc['stored_name']
-                    if file_path.exists():
-                        zf.write(file_path, file_doc['name'])
-        
-        return FastAPIFileResponse(
-            temp_zip.name, 
-            filename='selected_files.zip',
-            media_type='application/zip',
-            background=BackgroundTask(lambda: Path(temp_zip.name).unlink(missing_ok=True))
-        )
-    except Exception as e:
-        Path(temp_zip.name).unlink(missing_ok=True)
-        logger.error(f"ZIP creation failed: {e}")
-        raise HTTPException(status_code=500, detail="Failed to create ZIP file")
+    return await zip_response(files, 'selected_files.zip')
 
 @api_router.get("/files/{file_id}/download")
 async def download_file(file_id: str, request: Request):
@@ -615,10 +1586,10 @@ async def download_file(file_id: str, request: Request):
     ip = request.headers.get('X-Forwarded-For', request.client.host if request.client else 'unknown')
     await log_activity('file_download', share_token=share_token, folder_name=folder_name, file_name=file_doc['name'], ip_address=ip)
     
-    return FastAPIFileResponse(file_path, filename=file_doc['name'])
+    return send_file(request, file_path, filename=file_doc['name'], content_disposition=attachment_disposition(file_doc['name']))
 
 @api_router.get("/files/{file_id}/stream")
-async def stream_file(file_id: str):
+async def stream_file(file_id: str, request: Request):
     file_doc = await db.files.find_one({'id': file_id}, {'_id': 0})
     if not file_doc:
         raise HTTPException(status_code=404, detail="File not found")
@@ -635,7 +1606,7 @@ async def stream_file(file_id: str):
         '.mkv': 'video/x-matroska'
     }
     media_type = media_types.get(ext, 'application/octet-stream')
-    return FastAPIFileResponse(file_path, media_type=media_type)
+    return send_file(request, file_path, media_type=media_type)
 
 @api_router.delete("/files/{file_id}")
 async def delete_file(file_id: str, admin = Depends(get_current_admin)):
@@ -644,19 +1615,37 @@ async def delete_file(file_id: str, admin = Depends(get_current_admin)):
         raise HTTPException(status_code=404, detail="File not found")
     
     # Delete physical files
-    file_path = FILES_DIR / file_doc['stored_name']
-    if file_path.exists():
-        file_path.unlink()
-    thumb_path = THUMBNAILS_DIR / f"{file_id}.jpg"
-    if thumb_path.exists():
-        thumb_path.unlink()
-    preview_path = PREVIEWS_DIR / f"{file_id}.jpg"
-    if preview_path.exists():
-        preview_path.unlink()
-    
-    await db.files.delete_one({'id': file_id})
+    await run_in_threadpool(remove_stored_files, [file_doc])
+    
+    result = await db.files.delete_one({'id': file_id})
+    if result.deleted_count:
+        await adjust_folder_counters(file_doc['folder_id'], files=-1, size=-file_doc.get('size', 0))
     return {"message": "File deleted"}
 
+# ==================== SHARE RESOLUTION ====================
+
+# Guest pages hit several token-scoped routes per second; cache share lookups briefly
+SHARE_CACHE_SIZE = int(os.environ.get('SHARE_CACHE_SIZE', 1024))
+SHARE_CACHE_TTL = float(os.environ.get('SHARE_CACHE_TTL', 30))
+share_cache = TTLCache(SHARE_CACHE_SIZE, SHARE_CACHE_TTL)
+
+async def resolve_share(token: str) -> Optional[dict]:
+    """The share for a token (cached), or None if there isn't one"""
+    share = share_cache.get(token)
+    if share is None:
+        share = await db.shares.find_one({'token': token}, {'_id': 0})
+        if not share:
+            return None
+        share_cache.set(token, share)
+    return dict(share)
+
+async def get_share(token: str) -> dict:
+    """Dependency for /gallery/{token}/... routes"""
+    share = await resolve_share(token)
+    if not share:
+        raise HTTPException(status_code=404, detail="Gallery not found")
+    return share
+
 # ==================== SHARE ROUTES ====================
 
 @api_router.post("/shares", response_model=ShareResponse)
@@ -679,6 +1668,7 @@ async def create_share(share: ShareCreate, admin = Depends(get_current_admin)):
         'created_at': datetime.now(timezone.utc).isoformat()
     }
     await db.shares.insert_one(share_doc)
+    share_cache.pop(share.token)
     
     return ShareResponse(
         id=share_doc['id'],
@@ -714,6 +1704,7 @@ async def update_share(share_id: str, share: ShareUpdate, admin = Depends(get_cu
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Share not found")
     updated = await db.shares.find_one({'id': share_id}, {'_id': 0})
+    share_cache.pop(updated['token'])
     folder = await db.folders.find_one({'id': updated['folder_id']}, {'_id': 0})
     return ShareResponse(
         id=updated['id'],
@@ -727,9 +1718,10 @@ async def update_share(share_id: str, share: ShareUpdate, admin = Depends(get_cu
 
 @api_router.delete("/shares/{share_id}")
 async def delete_share(share_id: str, admin = Depends(get_current_admin)):
-    result = await db.shares.delete_one({'id': share_id})
-    if result.deleted_count == 0:
+    deleted = await db.shares.find_one_and_delete({'id': share_id}, projection={'_id': 0, 'token': 1})
+    if not deleted:
         raise HTTPException(status_code=404, detail="Share not found")
+    share_cache.pop(deleted['token'])
     return {"message": "Share deleted"}
 
 @api_router.get("/shares/{share_id}/qrcode")
@@ -753,11 +1745,7 @@ async def get_share_qrcode(share_id: str, admin = Depends(get_current_admin)):
 # ==================== PUBLIC GALLERY ROUTES ====================
 
 @api_router.get("/gallery/{token}")
-async def get_gallery_by_token(token: str, request: Request):
-    share = await db.shares.find_one({'token': token}, {'_id': 0})
-    if not share:
-        raise HTTPException(status_code=404, detail="Gallery not found")
-    
+async def get_gallery_by_token(token: str, request: Request, share: dict = Depends(get_share)):
     folder = await db.folders.find_one({'id': share['folder_id']}, {'_id': 0})
     if not folder:
         raise HTTPException(status_code=404, detail="Gallery not found")
@@ -773,11 +1761,7 @@ async def get_gallery_by_token(token: str, request: Request):
     }
 
 @api_router.get("/gallery/{token}/folders")
-async def get_gallery_folders(token: str, parent_id: Optional[str] = None):
-    share = await db.shares.find_one({'token': token}, {'_id': 0})
-    if not share:
-        raise HTTPException(status_code=404, detail="Gallery not found")
-    
+async def get_gallery_folders(parent_id: Optional[str] = None, share: dict = Depends(get_share)):
     # If no parent_id, use the share's folder as root
     if parent_id is None:
         parent_id = share['folder_id']
@@ -789,98 +1773,127 @@ async def get_gallery_folders(token: str, parent_id: Optional[str] = None):
             raise HTTPException(status_code=403, detail="Access denied")
         folders = await db.folders.find({'parent_id': parent_id}, {'_id': 0}).to_list(1000)
     
-    result = []
-    for f in folders:
-        file_count = await db.files.count_documents({'folder_id': f['id']})
-        subfolder_count = await db.folders.count_documents({'parent_id': f['id']})
-        result.append({
-            'id': f['id'],
-            'name': f['name'],
-            'parent_id': f['parent_id'],
-            'created_at': f['created_at'],
-            'file_count': file_count,
-            'subfolder_count': subfolder_count
-        })
-    return result
+    return [gallery_folder_entry(f) for f in folders]
+
+def gallery_folder_entry(f: dict) -> dict:
+    return {
+        'id': f['id'],
+        'name': f['name'],
+        'parent_id': f['parent_id'],
+        'created_at': f['created_at'],
+        'file_count': f.get('file_count', 0),
+        'subfolder_count': f.get('subfolder_count', 0)
+    }
 
 async def is_folder_in_share(folder_id: str, root_folder_id: str) -> bool:
     if folder_id == root_folder_id:
         return True
-    current_id = folder_id
-    while current_id:
-        folder = await db.folders.find_one({'id': current_id}, {'_id': 0})
-        if not folder:
-            return False
-        if folder.get('parent_id') == root_folder_id:
-            return True
-        current_id = folder.get('parent_id')
-    return False
+    return await db.folders.find_one({'id': folder_id, 'ancestors': root_folder_id}, {'_id': 0, 'id': 1}) is not None
 
 @api_router.get("/gallery/{token}/files")
-async def get_gallery_files(token: str, folder_id: Optional[str] = None):
-    share = await db.shares.find_one({'token': token}, {'_id': 0})
-    if not share:
-        raise HTTPException(status_code=404, detail="Gallery not found")
-    
+async def get_gallery_files(
+    folder_id: Optional[str] = None,
+    sort: FileSort = 'uploaded',
+    order: SortOrder = 'asc',
+    limit: int = FILE_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    share: dict = Depends(get_share)
+):
     target_folder = folder_id or share['folder_id']
     
     # Verify access
     if folder_id and not await is_folder_in_share(folder_id, share['folder_id']):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    files = await db.files.find({'folder_id': target_folder}, {'_id': 0}).to_list(1000)
-    result = []
-    for f in files:
-        thumbnail_url = None
-        preview_url = None
-        if f['file_type'] == 'image':
-            thumbnail_url = f"/api/files/{f['id']}/thumbnail"
-            preview_url = f"/api/files/{f['id']}/preview"
-        result.append({
-            'id': f['id'],
-            'name': f['name'],
-            'folder_id': f['folder_id'],
-            'file_type': f['file_type'],
-            'size': f['size'],
-            'created_at': f['created_at'],
-            'thumbnail_url': thumbnail_url,
-            'preview_url': preview_url
-        })
-    return result
+    return await list_folder_files(target_folder, sort, order, limit, cursor)
+
+@api_router.get("/gallery/{token}/files/status")
+async def get_gallery_files_status(ids: str, folder_id: Optional[str] = None, share: dict = Depends(get_share)):
+    target_folder = folder_id or share['folder_id']
+    if folder_id and not await is_folder_in_share(folder_id, share['folder_id']):
+        raise HTTPException(status_code=403, detail="Access denied")
+    return await files_by_id(target_folder, ids)
 
 @api_router.get("/gallery/{token}/path")
-async def get_gallery_path(token: str, folder_id: str):
-    share = await db.shares.find_one({'token': token}, {'_id': 0})
-    if not share:
-        raise HTTPException(status_code=404, detail="Gallery not found")
-    
-    path = []
-    current_id = folder_id
-    while current_id and current_id != share['folder_id']:
-        folder = await db.folders.find_one({'id': current_id}, {'_id': 0})
+async def get_gallery_path(folder_id: str, share: dict = Depends(get_share)):
+    root_id = share['folder_id']
+    folder = await db.folders.find_one({'id': folder_id}, {'_id': 0})
+    if not folder:
+        # Unknown folder - the share root is all there is to show
+        folder, folder_id = await db.folders.find_one({'id': root_id}, {'_id': 0}), root_id
         if not folder:
-            break
-        path.insert(0, {'id': folder['id'], 'name': folder['name']})
-        current_id = folder.get('parent_id')
+            return []
+    return share_breadcrumbs(folder, root_id)
+
+def share_breadcrumbs(folder: dict, root_id: str) -> List[dict]:
+    """Path from the share's root folder down to ``folder``; 403 if it lies outside the share"""
+    ids = folder.get('ancestors', []) + [folder['id']]
+    names = folder.get('ancestor_names', []) + [folder['name']]
+    if root_id not in ids:
+        raise HTTPException(status_code=403, detail="Access denied")
+    start = ids.index(root_id)
+    return [{'id': i, 'name': n} for i, n in zip(ids[start:], names[start:])]
+
+@api_router.get("/gallery/{token}/view")
+async def get_gallery_view(
+    token: str,
+    request: Request,
+    folder_id: Optional[str] = None,
+    log_view: bool = False,
+    share: dict = Depends(get_share)
+):
+    """Everything the gallery page shows for one folder, in a single response.
+
+    The queries are independent, so they all go out at once; access is checked
+    on the results before anything is returned. ``log_view`` records a gallery
+    visit (the page sets it on its first load only).
+    """
+    root_id = share['folder_id']
+    target_id = folder_id or root_id
+    folder_projection = {'_id': 0, 'id': 1, 'name': 1, 'parent_id': 1, 'created_at': 1, 'ancestors': 1, 'ancestor_names': 1,
+                         'file_count': 1, 'subfolder_count': 1}
+    type_counts = [{'$match': {'folder_id': target_id}}, {'$group': {'_id': '$file_type', 'count': {'$sum': 1}}}]
+    root, folder, subfolders, page, counts, products = await asyncio.gather(
+        db.folders.find_one({'id': root_id}, folder_projection),
+        db.folders.find_one({'id': target_id}, folder_projection),
+        db.folders.find({'parent_id': target_id}, folder_projection).to_list(1000),
+        list_folder_files(target_id, 'uploaded', 'asc', FILE_PAGE_SIZE, None),
+        db.files.aggregate(type_counts).to_list(None),
+        db.print_products.find({'active': True}, {'_id': 0}).to_list(100)
+    )
+    if not root:
+        raise HTTPException(status_code=404, detail="Gallery not found")
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not found")
+    path = share_breadcrumbs(folder, root_id)
+    by_type = {c['_id']: c['count'] for c in counts}
     
-    # Add root folder
-    root_folder = await db.folders.find_one({'id': share['folder_id']}, {'_id': 0})
-    if root_folder:
-        path.insert(0, {'id': root_folder['id'], 'name': root_folder['name']})
+    if log_view:
+        ip = request.headers.get('X-Forwarded-For', request.client.host if request.client else 'unknown')
+        await log_activity('gallery_view', share_token=token, folder_name=root['name'], ip_address=ip)
     
-    return path
+    return {
+        'gallery': {
+            'folder_id': root['id'],
+            'folder_name': root['name'],
+            'permission': share['permission']
+        },
+        # Totals for the whole folder; 'files' is only its first page
+        'folder': {**gallery_folder_entry(folder), 'image_count': by_type.get('image', 0), 'video_count': by_type.get('video', 0)},
+        'path': path if folder_id else [],
+        'folders': [gallery_folder_entry(f) for f in subfolders],
+        'files': page['files'],
+        'next_cursor': page['next_cursor'],
+        'print_products': products
+    }
 
 # ==================== PUBLIC UPLOAD ====================
 
 MAX_PUBLIC_UPLOAD_SIZE = 500 * 1024 * 1024  # 500MB limit for public uploads
 
 @api_router.post("/gallery/{token}/upload")
-async def public_upload(token: str, folder_id: str = Form(...), file: UploadFile = File(...), request: Request = None):
+async def public_upload(token: str, folder_id: str = Form(...), file: UploadFile = File(...), request: Request = None, share: dict = Depends(get_share)):
     """Allow guests to upload files via share link (edit/full permission) - max 500MB"""
-    share = await db.shares.find_one({'token': token}, {'_id': 0})
-    if not share:
-        raise HTTPException(status_code=404, detail="Gallery not found")
-    
     if share['permission'] not in ['edit', 'full']:
         raise HTTPException(status_code=403, detail="Upload not allowed")
     
@@ -893,13 +1906,17 @@ async def public_upload(token: str, folder_id: str = Form(...), file: UploadFile
     stored_name = f"{uuid.uuid4()}{file_ext}"
     file_path = FILES_DIR / stored_name
     
+    crc = 0
     async with aiofiles.open(file_path, 'wb') as f:
         while chunk := await file.read(1024 * 1024):
             await f.write(chunk)
+            crc = zlib.crc32(chunk, crc)
     
     file_size = file_path.stat().st_size
     file_type = 'image' if file_ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp'] else 'video' if file_ext in ['.mp4', '.mov', '.avi', '.mkv'] else 'other'
     
+    created_at = datetime.now(timezone.utc).isoformat()
+    captured_at = await run_in_threadpool(read_capture_time, str(file_path)) if file_type == 'image' else None
     file_doc = {
         'id': str(uuid.uuid4()),
         'name': file.filename,
@@ -907,17 +1924,18 @@ async def public_upload(token: str, folder_id: str = Form(...), file: UploadFile
         'stored_name': stored_name,
         'file_type': file_type,
         'size': file_size,
-        'created_at': datetime.now(timezone.utc).isoformat()
+        'crc32': crc,
+        'created_at': created_at,
+        'captured_at': captured_at or created_at
     }
+    if file_type == 'image':
+        file_doc['derivative_status'] = 'pending'
     await db.files.insert_one(file_doc)
+    await adjust_folder_counters(folder_id, files=1, size=file_size)
     
-    # Generate thumbnail for images
+    # Thumbnails/previews are generated by the job worker
     if file_type == 'image':
-        try:
-            await generate_thumbnail(file_path, file_doc['id'])
-            await generate_preview(file_path, file_doc['id'])
-        except Exception as e:
-            logger.error(f"Thumbnail generation failed: {e}")
+        await enqueue_derivatives(file_doc['id'])
     
     # Log upload activity
     folder = await db.folders.find_one({'id': folder_id}, {'_id': 0})
@@ -930,15 +1948,8 @@ async def public_upload(token: str, folder_id: str = Form(...), file: UploadFile
 # ==================== PUBLIC ZIP DOWNLOAD ====================
 
 @api_router.get("/gallery/{token}/download-zip")
-async def download_gallery_zip(token: str, folder_id: Optional[str] = None, request: Request = None):
-    """Download all files in gallery folder as ZIP (for clients)"""
-    import zipfile
-    import tempfile
-    
-    share = await db.shares.find_one({'token': token}, {'_id': 0})
-    if not share:
-        raise HTTPException(status_code=404, detail="Gallery not found")
-    
+async def download_gallery_zip(token: str, folder_id: Optional[str] = None, recursive: bool = False, request: Request = None, share: dict = Depends(get_share)):
+    """Download all files in gallery folder as ZIP (for clients); recursive=true keeps the subfolder structure"""
     # Use share's root folder if no folder_id specified
     target_folder_id = folder_id if folder_id else share['folder_id']
     
@@ -946,7 +1957,10 @@ async def download_gallery_zip(token: str, folder_id: Optional[str] = None, requ
     if folder_id and not await is_folder_in_share(folder_id, share['folder_id']):
         raise HTTPException(status_code=403, detail="Access denied")
     
-    files = await db.files.find({'folder_id': target_folder_id}, {'_id': 0}).to_list(10000)
+    if recursive:
+        files = await get_subtree_files(target_folder_id)
+    else:
+        files = await db.files.find({'folder_id': target_folder_id}, {'_id': 0}).to_list(10000)
     if not files:
         raise HTTPException(status_code=404, detail="No files in folder")
     
@@ -958,51 +1972,67 @@ async def download_gallery_zip(token: str, folder_id: Optional[str] = None, requ
     ip = request.client.host if request else None
     file_count = len(files)
     await log_activity('zip_download', share_token=token, folder_name=folder_name, 
-                       details={'file_count': file_count}, ip_address=ip)
+                       details={'file_count': file_count, 'recursive': recursive}, ip_address=ip)
     
-    # Create temporary zip file
-    temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
-    
-    try:
-        with zipfile.ZipFile(temp_zip.name, 'w', zipfile.ZIP_STORED) as zf:
-            for file_doc in files:
-                file_path = FILES_DIR / file_doc['stored_name']
-                if file_path.exists():
-                    zf.write(file_path, file_doc['name'])
-        
-        zip_filename = f"{folder_name}.zip"
-        return FastAPIFileResponse(
-            temp_zip.name, 
-            filename=zip_filename,
-            media_type='application/zip',
-            background=BackgroundTask(lambda: Path(temp_zip.name).unlink(missing_ok=True))
-        )
-    except Exception as e:
-        Path(temp_zip.name).unlink(missing_ok=True)
-        logger.error(f"ZIP creation failed: {e}")
-        raise HTTPException(status_code=500, detail="Failed to create ZIP file")
+    return await zip_response(files, f"{folder_name}.zip", request)
 
 # ==================== ACTIVITY LOGS ====================
 
 @api_router.get("/activity-logs")
 async def get_activity_logs(admin = Depends(get_current_admin), limit: int = 100, skip: int = 0, search: str = None):
-    """Get activity logs for admin with optional search"""
-    # Auto-cleanup: Delete logs older than 400 days
-    cutoff_date = (datetime.now(timezone.utc) - timedelta(days=400)).isoformat()
-    await db.activity_logs.delete_many({'created_at': {'$lt': cutoff_date}})
-    
-    # Build query with optional search
-    query = {}
-    if search:
-        query['$or'] = [
-            {'folder_name': {'$regex': search, '$options': 'i'}},
-            {'share_token': {'$regex': search, '$options': 'i'}},
-            {'file_name': {'$regex': search, '$options': 'i'}}
-        ]
-    
-    logs = await db.activity_logs.find(query, {'_id': 0}).sort('created_at', -1).skip(skip).limit(limit).to_list(limit)
-    total = await db.activity_logs.count_documents(query)
-    return {'logs': logs, 'total': total}
+    """Get activity logs for admin with optional search (retention is handled by the logged_at TTL index)
+
+    Search matches words of the folder name, share token and file name by
+    prefix, using the search_tokens index. Counting a broad search is capped,
+    so 'total' is a lower bound when 'total_is_estimate' is set.
+    """
+    # Every search word must prefix-match a token; anchored regexes use the index
+    terms = search_tokens(search)
+    words = [t for t in terms if re.fullmatch(r'[^\W_]+', t)] or terms
+    query = {'$and': [{'search_tokens': {'$regex': f'^{re.escape(word)}'}} for word in words]} if words else {}
+    
+    logs = await db.activity_logs.find(
+        query, {'_id': 0, 'logged_at': 0, 'search_tokens': 0}
+    ).sort('created_at', -1).skip(skip).limit(limit).to_list(limit)
+    if not query:
+        return {'logs': logs, 'total': await db.activity_logs.estimated_document_count(), 'total_is_estimate': False}
+    count_limit = max(ACTIVITY_SEARCH_COUNT_LIMIT, skip + limit + 1)
+    total = await db.activity_logs.count_documents(query, limit=count_limit)
+    return {'logs': logs, 'total': total, 'total_is_estimate': total >= count_limit}
+
+async def activity_summary(match: dict, days: int, group_by: str) -> dict:
+    """Rollup counts since ``days`` ago, one row per ``group_by`` value with a count per action"""
+    start = (datetime.now(timezone.utc) - timedelta(days=days - 1)).date().isoformat()
+    pipeline = [
+        {'$match': {**match, 'day': {'$gte': start}}},
+        {'$group': {
+            '_id': {'key': f'${group_by}', 'action': '$action'},
+            'count': {'$sum': '$count'},
+            'folder_name': {'$last': '$folder_name'}
+        }}
+    ]
+    rows = {}
+    for g in await db.activity_daily.aggregate(pipeline).to_list(None):
+        row = rows.setdefault(g['_id']['key'], {group_by: g['_id']['key']})
+        row[g['_id']['action']] = g['count']
+        if group_by == 'share_token' and g.get('folder_name'):
+            row['folder_name'] = g['folder_name']
+    return {'start': start, 'rows': [rows[key] for key in sorted(rows, key=lambda k: (k is None, k))]}
+
+@api_router.get("/activity-logs/summary")
+async def get_activity_summary(days: int = Query(30, ge=1, le=366), admin = Depends(get_current_admin)):
+    """Views, downloads, uploads and orders per day across all galleries"""
+    return await activity_summary({}, days, 'day')
+
+@api_router.get("/activity-logs/summary/galleries")
+async def get_activity_summary_by_gallery(days: int = Query(30, ge=1, le=366), admin = Depends(get_current_admin)):
+    """Activity totals per gallery over the last ``days`` days"""
+    return await activity_summary({}, days, 'share_token')
+
+@api_router.get("/activity-logs/summary/galleries/{share_token}")
+async def get_gallery_activity_summary(share_token: str, days: int = Query(30, ge=1, le=366), admin = Depends(get_current_admin)):
+    """One gallery's activity per day"""
+    return await activity_summary({'share_token': share_token}, days, 'day')
 
 @api_router.delete("/activity-logs")
 async def clear_activity_logs(admin = Depends(get_current_admin)):
@@ -1015,15 +2045,28 @@ async def clear_activity_logs(admin = Depends(get_current_admin)):
 class FavouritesRequest(BaseModel):
     file_ids: List[str]
 
+def copy_stored_files(original_file: dict, new_file: dict) -> bool:
+    """Copy a file's original and its derivatives to new_file's paths. Blocking, so run it in a thread.
+    Returns False if some derivative isn't rendered yet."""
+    shutil.copy2(FILES_DIR / original_file['stored_name'], FILES_DIR / new_file['stored_name'])
+    if original_file['file_type'] != 'image':
+        return True
+    copies = derivative_paths(new_file['id'])
+    # Rungs wider than the original are never written; any other gap means it's not rendered yet
+    complete = 'srcset' in original_file
+    rendered = {f"w{rung['width']}" for rung in original_file.get('srcset', [])}
+    for (name, fmt), orig_path in derivative_paths(original_file['id']).items():
+        if name in SRCSET_SPEC_NAMES and name not in rendered:
+            continue
+        if orig_path.exists():
+            shutil.copy2(orig_path, copies[(name, fmt)])
+        else:
+            complete = False
+    return complete
+
 @api_router.post("/gallery/{token}/favourites")
-async def save_favourites(token: str, request: FavouritesRequest):
+async def save_favourites(request: FavouritesRequest, share: dict = Depends(get_share)):
     """Save selected photos to Album Favourites folder"""
-    import shutil
-    
-    share = await db.shares.find_one({'token': token}, {'_id': 0})
-    if not share:
-        raise HTTPException(status_code=404, detail="Gallery not found")
-    
     # Check permission - need edit or full
     if share['permission'] not in ['edit', 'full']:
         raise HTTPException(status_code=403, detail="Permission denied")
@@ -1045,13 +2088,17 @@ async def save_favourites(token: str, request: FavouritesRequest):
             'id': str(uuid.uuid4()),
             'name': 'Album Favourites',
             'parent_id': root_folder_id,
-            'created_at': datetime.now(timezone.utc).isoformat()
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            **await folder_lineage(root_folder_id),
+            **empty_folder_counters()
         }
         await db.folders.insert_one(favourites_folder)
+        await adjust_folder_counters(root_folder_id, subfolders=1)
         logger.info(f"Created Album Favourites folder: {favourites_folder['id']}")
     
     favourites_folder_id = favourites_folder['id']
     copied_count = 0
+    copied_bytes = 0
     
     for file_id in request.file_ids:
         # Get original file
@@ -1076,11 +2123,8 @@ async def save_favourites(token: str, request: FavouritesRequest):
         
         # Generate new stored name for the copy
         new_stored_name = f"{uuid.uuid4()}{Path(original_file['name']).suffix}"
-        new_path = FILES_DIR / new_stored_name
         
         try:
-            shutil.copy2(original_path, new_path)
-            
             # Create new file record
             new_file = {
                 'id': str(uuid.uuid4()),
@@ -1091,24 +2135,32 @@ async def save_favourites(token: str, request: FavouritesRequest):
                 'size': original_file['size'],
                 'created_at': datetime.now(timezone.utc).isoformat()
             }
-            await db.files.insert_one(new_file)
+            new_file['captured_at'] = original_file.get('captured_at') or new_file['created_at']
+            if original_file.get('crc32') is not None:
+                new_file['crc32'] = original_file['crc32']
             
-            # Also copy thumbnail and preview if they exist
+            # Copy the original and whichever derivatives exist
+            missing_derivatives = not await run_in_threadpool(copy_stored_files, original_file, new_file)
             if original_file['file_type'] == 'image':
-                orig_thumb = THUMBNAILS_DIR / f"{original_file['id']}.jpg"
-                orig_preview = PREVIEWS_DIR / f"{original_file['id']}.jpg"
-                
-                if orig_thumb.exists():
-                    shutil.copy2(orig_thumb, THUMBNAILS_DIR / f"{new_file['id']}.jpg")
-                if orig_preview.exists():
-                    shutil.copy2(orig_preview, PREVIEWS_DIR / f"{new_file['id']}.jpg")
+                new_file['derivative_status'] = 'pending' if missing_derivatives else 'ready'
+                if not missing_derivatives:
+                    new_file['derivative_sizes'] = [spec.name for spec in DERIVATIVE_SPECS]
+                    new_file['derivative_formats'] = DERIVATIVE_FORMATS
+                    new_file['srcset'] = original_file['srcset']
+            await db.files.insert_one(new_file)
+            if missing_derivatives:
+                # Original's derivatives aren't all there yet - make the copy its own
+                await enqueue_derivatives(new_file['id'])
             
             copied_count += 1
+            copied_bytes += new_file['size']
             
         except Exception as e:
             logger.error(f"Failed to copy file {file_id}: {e}")
             continue
     
+    await adjust_folder_counters(favourites_folder_id, files=copied_count, size=copied_bytes)
+    
     return {
         'success': True,
         'copied_count': copied_count,
@@ -1120,14 +2172,17 @@ async def save_favourites(token: str, request: FavouritesRequest):
 
 @api_router.get("/stats")
 async def get_stats(admin = Depends(get_current_admin)):
-    folder_count = await db.folders.count_documents({})
-    file_count = await db.files.count_documents({})
-    share_count = await db.shares.count_documents({})
+    folder_count = await db.folders.estimated_document_count()
+    share_count = await db.shares.estimated_document_count()
     
-    # Calculate total size
-    pipeline = [{'$group': {'_id': None, 'total': {'$sum': '$size'}}}]
-    result = await db.files.aggregate(pipeline).to_list(1)
-    total_size = result[0]['total'] if result else 0
+    # Root folders' recursive totals cover the whole library
+    pipeline = [
+        {'$match': {'parent_id': None}},
+        {'$group': {'_id': None, 'files': {'$sum': '$recursive_file_count'}, 'bytes': {'$sum': '$recursive_total_bytes'}}}
+    ]
+    result = await db.folders.aggregate(pipeline).to_list(1)
+    file_count = result[0]['files'] if result else 0
+    total_size = result[0]['bytes'] if result else 0
     
     return {
         'folder_count': folder_count,
@@ -1136,6 +2191,35 @@ async def get_stats(admin = Depends(get_current_admin)):
         'total_size': total_size
     }
 
+@api_router.get("/stats/derivatives")
+async def get_derivative_stats(admin = Depends(get_current_admin)):
+    """Thumbnail/preview worker pool queue depth, job timings and background job counts"""
+    pipeline = [{'$group': {'_id': '$status', 'count': {'$sum': 1}}}]
+    job_counts = await db.jobs.aggregate(pipeline).to_list(10)
+    return {
+        **derivative_engine.stats(),
+        'jobs': {c['_id']: c['count'] for c in job_counts}
+    }
+
+@api_router.get("/stats/activity-log")
+async def get_activity_log_stats(admin = Depends(get_current_admin)):
+    """Activity log buffer depth and write/drop counters for this process"""
+    return {
+        **activity_log_stats,
+        'buffered': len(activity_buffer),
+        'buffer_size': ACTIVITY_LOG_BUFFER_SIZE,
+        'batch_size': ACTIVITY_LOG_BATCH_SIZE,
+        'flush_ms': ACTIVITY_LOG_FLUSH_MS
+    }
+
+@api_router.get("/stats/caches")
+async def get_cache_stats(admin = Depends(get_current_admin)):
+    """Size and hit/miss counters of this process's in-memory caches"""
+    return {
+        'shares': share_cache.stats(),
+        'admin_tokens': admin_token_cache.stats()
+    }
+
 # ==================== PRINT PRODUCTS ROUTES ====================
 
 @api_router.get("/print-products")
@@ -1231,7 +2315,7 @@ async def init_print_products(admin = Depends(get_current_admin)):
 async def create_order(order: OrderCreate, request: Request):
     """Create a new print order (public endpoint)"""
     # Verify share token exists
-    share = await db.shares.find_one({'token': order.share_token}, {'_id': 0})
+    share = await resolve_share(order.share_token)
     if not share:
         raise HTTPException(status_code=404, detail="Invalid gallery token")
     
@@ -1297,7 +2381,7 @@ async def get_order(order_id: str, admin = Depends(get_current_admin)):
     for item in order.get('items', []):
         file_doc = await db.files.find_one({'id': item['file_id']}, {'_id': 0})
         if file_doc:
-            item['thumbnail_url'] = f"/api/thumbnails/{item['file_id']}.jpg"
+            item['thumbnail_url'] = derivative_url(file_doc, 'thumbnail')
             item['original_filename'] = file_doc.get('name', item['file_name'])
     
     return order
@@ -1363,6 +2447,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+job_worker_task: Optional[asyncio.Task] = None
+index_bootstrap_task: Optional[asyncio.Task] = None
+folder_bootstrap_task: Optional[asyncio.Task] = None
+activity_log_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_background_workers():
+    global job_worker_task, index_bootstrap_task, folder_bootstrap_task, activity_log_task
+    # Index builds can take a while on big collections; don't hold up startup
+    index_bootstrap_task = asyncio.create_task(bootstrap_indexes())
+    folder_bootstrap_task = asyncio.create_task(bootstrap_folder_tree())
+    activity_log_task = asyncio.create_task(activity_log_writer())
+    if RUN_JOB_WORKER:
+        # Only the job worker renders images; API-only replicas never need the process pool
+        derivative_engine.start()
+        job_worker_task = asyncio.create_task(job_worker_loop())
+
+@app.on_event("shutdown")
+async def shutdown_background_workers():
+    if job_worker_task:
+        job_worker_task.cancel()
+        await asyncio.gather(job_worker_task, return_exceptions=True)
+    derivative_engine.shutdown()
+    if activity_log_task:
+        activity_log_task.cancel()
+        await asyncio.gather(activity_log_task, return_exceptions=True)
+    await flush_activity_logs()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
@@ -0,0 +1,187 @@
+"""
+Tests for activity logging: the buffered writer, retention and search.
+
+The buffer and token tests need nothing else; the rest need a real MongoDB
+(MONGO_URL, default localhost) and are skipped without one. They use their
+own throwaway database, never DB_NAME's.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'gallery_unit_tests')
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp())
+os.environ.setdefault('FILES_DIR', tempfile.mkdtemp())
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import server
+
+
+@pytest.fixture(autouse=True)
+def fresh_buffer(monkeypatch):
+    monkeypatch.setattr(server, 'activity_buffer', [])
+    monkeypatch.setattr(server, 'activity_log_stats', {'written': 0, 'dropped': 0, 'failed': 0, 'batches': 0})
+    monkeypatch.setattr(server, 'activity_flush_needed', asyncio.Event())
+
+
+@pytest.fixture
+def activity_db(monkeypatch):
+    """Run each test on a fresh database, on its own event loop"""
+    loop = asyncio.new_event_loop()
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], serverSelectionTimeoutMS=1000)
+    try:
+        loop.run_until_complete(client.admin.command('ping'))
+    except Exception:
+        client.close()
+        loop.close()
+        pytest.skip("MongoDB not reachable")
+    db = client[f"gallery_test_activity_{uuid.uuid4().hex[:8]}"]
+    monkeypatch.setattr(server, 'db', db)
+    loop.run_until_complete(server.ensure_indexes())
+    yield loop.run_until_complete
+    loop.run_until_complete(client.drop_database(db.name))
+    client.close()
+    loop.close()
+
+
+def log(action='gallery_view', share_token='lisa-tara', folder_name='Lisa & Tara 21.01.26', file_name=None):
+    asyncio.run(server.log_activity(action, share_token=share_token, folder_name=folder_name, file_name=file_name))
+
+
+class TestSearchTokens:
+    """Test the words stored for prefix search"""
+
+    def test_words_and_whole_values(self):
+        """Test each value gives its casefolded words plus itself"""
+        assert server.search_tokens('Lisa & Tara', None, 'IMG_0042.JPG') == [
+            '0042', 'img', 'img_0042.jpg', 'jpg', 'lisa', 'lisa & tara', 'tara'
+        ]
+
+    def test_nothing_searchable(self):
+        """Test missing values give no tokens"""
+        assert server.search_tokens(None, '') == []
+
+
+class TestActivityBuffer:
+    """Test requests only ever append to the buffer"""
+
+    def test_entries_buffered(self):
+        """Test entries wait in the buffer with their TTL date and search tokens"""
+        log()
+        assert len(server.activity_buffer) == 1
+        entry = server.activity_buffer[0]
+        assert isinstance(entry['logged_at'], datetime)
+        assert 'lisa' in entry['search_tokens']
+        assert not server.activity_flush_needed.is_set()
+
+    def test_full_batch_wakes_writer(self, monkeypatch):
+        """Test a full batch asks for a flush without waiting for the timer"""
+        monkeypatch.setattr(server, 'ACTIVITY_LOG_BATCH_SIZE', 3)
+        for _ in range(3):
+            log()
+        assert server.activity_flush_needed.is_set()
+
+    def test_full_buffer_drops(self, monkeypatch):
+        """Test entries past the buffer size are dropped and counted"""
+        monkeypatch.setattr(server, 'ACTIVITY_LOG_BUFFER_SIZE', 2)
+        for _ in range(5):
+            log()
+        assert len(server.activity_buffer) == 2
+        assert server.activity_log_stats['dropped'] == 3
+
+
+class TestFlush:
+    """Test batched writes and their daily rollups"""
+
+    def rollup_count(self, activity_db, action='gallery_view'):
+        rows = activity_db(server.db.activity_daily.find({'share_token': 'lisa-tara', 'action': action}).to_list(None))
+        return sum(row['count'] for row in rows)
+
+    def test_batches_written_and_rolled_up(self, activity_db, monkeypatch):
+        """Test everything buffered is written in batches and counted per day"""
+        monkeypatch.setattr(server, 'ACTIVITY_LOG_BATCH_SIZE', 2)
+        for _ in range(5):
+            log()
+        log(action='file_download', file_name='a.jpg')
+        activity_db(server.flush_activity_logs())
+        assert server.activity_buffer == []
+        assert server.activity_log_stats['written'] == 6
+        assert server.activity_log_stats['batches'] == 3
+        assert activity_db(server.db.activity_logs.count_documents({})) == 6
+        assert self.rollup_count(activity_db) == 5
+        assert self.rollup_count(activity_db, 'file_download') == 1
+
+    def test_requeued_batch_written_once(self, activity_db):
+        """Test a batch re-queued after a cancelled write isn't duplicated, failed or under-counted"""
+        for _ in range(4):
+            log()
+        # Half of it landed before the cancel; those entries already carry their _ids
+        activity_db(server.db.activity_logs.insert_many(server.activity_buffer[:2]))
+        activity_db(server.flush_activity_logs())
+        assert server.activity_log_stats['written'] == 4
+        assert server.activity_log_stats['failed'] == 0
+        assert activity_db(server.db.activity_logs.count_documents({})) == 4
+        assert self.rollup_count(activity_db) == 4
+
+
+class TestRetention:
+    """Test logs expire through the TTL index"""
+
+    def test_ttl_index(self, activity_db):
+        """Test logged_at carries the retention period"""
+        indexes = activity_db(server.db.activity_logs.index_information())
+        assert indexes['logged_at_ttl']['expireAfterSeconds'] == server.ACTIVITY_LOG_RETENTION_DAYS * 86400
+
+    def test_backfill_dates(self, activity_db):
+        """Test old entries get logged_at from their created_at string"""
+        # Within the retention period, or the TTL monitor could remove it mid-test
+        yesterday = (datetime.now(timezone.utc) - timedelta(days=1)).replace(microsecond=0)
+        activity_db(server.db.activity_logs.insert_many([
+            {'id': 'old', 'created_at': yesterday.isoformat()},
+            {'id': 'broken', 'created_at': 'yesterday'},
+        ]))
+        assert activity_db(server.backfill_activity_log_dates()) == 2
+        old = activity_db(server.db.activity_logs.find_one({'id': 'old'}))
+        assert old['logged_at'] == yesterday.replace(tzinfo=None)  # Motor hands back naive UTC
+        assert activity_db(server.db.activity_logs.find_one({'id': 'broken'}))['logged_at']
+        assert activity_db(server.backfill_activity_log_dates()) == 0
+
+
+class TestSearch:
+    """Test search goes through the token index"""
+
+    @pytest.fixture
+    def logs(self, activity_db):
+        log(file_name='IMG_0042.jpg')
+        log(share_token='sam-alex', folder_name='Sam & Alex')
+        log(share_token='sam-alex', folder_name='Sam & Alex', file_name='first-dance.mp4')
+        activity_db(server.flush_activity_logs())
+        return activity_db
+
+    def search(self, activity_db, search, limit=100):
+        return activity_db(server.get_activity_logs(admin={}, limit=limit, skip=0, search=search))
+
+    def test_prefix_of_any_word(self, logs):
+        """Test every search word must prefix-match a word of the entry"""
+        assert [entry['file_name'] for entry in self.search(logs, 'img_00')['logs']] == ['IMG_0042.jpg']
+        result = self.search(logs, 'SAM')
+        assert {entry['share_token'] for entry in result['logs']} == {'sam-alex'}
+        assert result['total'] == 2
+        assert self.search(logs, 'sam dance')['total'] == 1
+        assert self.search(logs, 'nobody')['logs'] == []
+
+    def test_count_capped(self, logs, monkeypatch):
+        """Test big result sets report a lower-bound total instead of counting everything"""
+        monkeypatch.setattr(server, 'ACTIVITY_SEARCH_COUNT_LIMIT', 1)
+        result = self.search(logs, 'sam', limit=1)
+        assert result['total'] == 2
+        assert result['total_is_estimate']
+        assert 'search_tokens' not in result['logs'][0]
@@ -10,6 +10,7 @@ import time
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
 if not BASE_URL:
     BASE_URL = "https://clientgallery-1.preview.emergentagent.com"
+DERIVATIVE_TIMEOUT = 30  # seconds; the first job also waits for the worker pool to spawn
 
 # Test credentials
 TEST_USERNAME = "testadmin"
@@ -135,6 +136,59 @@ class TestFolderCRUD:
         print(f"Created nested folder: {data}")
         return data["id"]
 
+    def test_nested_folder_path(self, auth_token, test_folder_id):
+        """Test breadcrumbs of a nested folder follow a parent rename"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        parent = requests.post(f"{BASE_URL}/api/folders",
+            headers=headers,
+            json={"name": "TEST_Parent", "parent_id": test_folder_id}
+        ).json()
+        child = requests.post(f"{BASE_URL}/api/folders",
+            headers=headers,
+            json={"name": "TEST_Child", "parent_id": parent["id"]}
+        ).json()
+        assert child["ancestors"][-2:] == [test_folder_id, parent["id"]]
+
+        requests.put(f"{BASE_URL}/api/folders/{parent['id']}", headers=headers, json={"name": "TEST_Renamed"})
+        response = requests.get(f"{BASE_URL}/api/folders/{child['id']}/path", headers=headers)
+        assert response.status_code == 200
+        assert [p["name"] for p in response.json()[-2:]] == ["TEST_Renamed", "TEST_Child"]
+        requests.delete(f"{BASE_URL}/api/folders/{parent['id']}", headers=headers)
+
+    def test_folder_counters(self, auth_token, test_folder_id):
+        """Test folder counters follow uploads and deletes in a subfolder"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        import io
+        from PIL import Image
+
+        before = requests.get(f"{BASE_URL}/api/folders/{test_folder_id}", headers=headers).json()
+        subfolder = requests.post(f"{BASE_URL}/api/folders",
+            headers=headers,
+            json={"name": f"TEST_Counters_{int(time.time())}", "parent_id": test_folder_id}
+        ).json()
+
+        img_bytes = io.BytesIO()
+        Image.new('RGB', (50, 50), color='green').save(img_bytes, format='JPEG')
+        img_bytes.seek(0)
+        upload = requests.post(f"{BASE_URL}/api/files/upload",
+            headers=headers,
+            files={'file': ('counter.jpg', img_bytes, 'image/jpeg')},
+            data={'folder_id': subfolder["id"]}
+        ).json()
+
+        folder = requests.get(f"{BASE_URL}/api/folders/{subfolder['id']}", headers=headers).json()
+        assert folder["file_count"] == 1
+        assert folder["total_bytes"] == upload["size"]
+        parent = requests.get(f"{BASE_URL}/api/folders/{test_folder_id}", headers=headers).json()
+        assert parent["subfolder_count"] == before["subfolder_count"] + 1
+        assert parent["recursive_file_count"] == before["recursive_file_count"] + 1
+
+        requests.delete(f"{BASE_URL}/api/folders/{subfolder['id']}", headers=headers)
+        parent = requests.get(f"{BASE_URL}/api/folders/{test_folder_id}", headers=headers).json()
+        assert parent["subfolder_count"] == before["subfolder_count"]
+        assert parent["recursive_total_bytes"] == before["recursive_total_bytes"]
+        print(f"Folder counters: {parent}")
+
 
 class TestFileOperations:
     """Test file upload and operations"""
@@ -173,10 +227,46 @@ class TestFileOperations:
         response = requests.get(f"{BASE_URL}/api/files?folder_id={test_folder_id}", headers=headers)
         assert response.status_code == 200
         data = response.json()
-        assert isinstance(data, list)
-        print(f"Found {len(data)} files in folder")
+        assert isinstance(data["files"], list)
+        assert "next_cursor" in data
+        print(f"Found {len(data['files'])} files in folder")
         return data
     
+    def test_files_paginate_by_cursor(self, auth_token, test_folder_id, test_file_id):
+        """Test walking a folder one file per page visits every file once"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        seen = []
+        params = {"folder_id": test_folder_id, "sort": "name", "limit": 1}
+        while True:
+            response = requests.get(f"{BASE_URL}/api/files", params=params, headers=headers)
+            assert response.status_code == 200
+            data = response.json()
+            assert len(data["files"]) <= 1
+            seen += [f["id"] for f in data["files"]]
+            if not data["next_cursor"]:
+                break
+            params["cursor"] = data["next_cursor"]
+        assert test_file_id in seen
+        assert len(seen) == len(set(seen))
+        
+        response = requests.get(f"{BASE_URL}/api/files", params={"folder_id": test_folder_id, "cursor": "not-a-cursor"}, headers=headers)
+        assert response.status_code == 400
+    
+    def test_files_status(self, auth_token, test_folder_id, test_file_id):
+        """Test pending files can be re-fetched by id, limited to their folder"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        params = {"folder_id": test_folder_id, "ids": f"{test_file_id},nonexistent"}
+        response = requests.get(f"{BASE_URL}/api/files/status", params=params, headers=headers)
+        assert response.status_code == 200
+        files = response.json()["files"]
+        assert [f["id"] for f in files] == [test_file_id]
+        assert files[0]["derivative_status"] == "ready"
+        assert "?v=" in files[0]["thumbnail_url"]
+        
+        params["folder_id"] = "nonexistent"
+        response = requests.get(f"{BASE_URL}/api/files/status", params=params, headers=headers)
+        assert response.json()["files"] == []
+    
     def test_get_thumbnail(self, test_file_id):
         """Test getting file thumbnail"""
         response = requests.get(f"{BASE_URL}/api/files/{test_file_id}/thumbnail")
@@ -184,6 +274,31 @@ class TestFileOperations:
         assert response.headers.get('content-type') == 'image/jpeg'
         print("Thumbnail retrieved successfully")
     
+    def test_thumbnail_caching(self, test_file_id):
+        """Test thumbnails are cacheable and revalidate to 304"""
+        response = requests.get(f"{BASE_URL}/api/files/{test_file_id}/thumbnail")
+        assert response.status_code == 200
+        assert "immutable" in response.headers.get("cache-control", "")
+        etag = response.headers["etag"]
+        
+        response = requests.get(f"{BASE_URL}/api/files/{test_file_id}/thumbnail", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers.get("etag") == etag
+        assert not response.content
+    
+    def test_thumbnail_format_negotiation(self, test_file_id):
+        """Test browsers accepting WebP get it, others get JPEG"""
+        response = requests.get(f"{BASE_URL}/api/files/{test_file_id}/thumbnail", headers={"Accept": "image/webp,*/*"})
+        assert response.status_code == 200
+        assert response.headers.get('content-type') in ('image/webp', 'image/jpeg')
+        response = requests.get(f"{BASE_URL}/api/files/{test_file_id}/thumbnail", headers={"Accept": "*/*"})
+        assert response.headers.get('content-type') == 'image/jpeg'
+    
+    def test_srcset_unknown_width(self, test_file_id):
+        """Test widths outside the configured ladder are not served"""
+        response = requests.get(f"{BASE_URL}/api/files/{test_file_id}/srcset/123")
+        assert response.status_code == 404
+    
     def test_get_preview(self, test_file_id):
         """Test getting file preview"""
         response = requests.get(f"{BASE_URL}/api/files/{test_file_id}/preview")
@@ -271,6 +386,23 @@ class TestShareOperations:
         assert "permission" in data
         print(f"Public gallery access: {data}")
     
+    def test_public_gallery_view(self, test_share_token):
+        """Test the one-request gallery view bundles everything the page needs"""
+        response = requests.get(f"{BASE_URL}/api/gallery/{test_share_token}/view")
+        assert response.status_code == 200
+        data = response.json()
+        for key in ("gallery", "folder", "path", "folders", "files", "next_cursor", "print_products"):
+            assert key in data
+        assert data["folder"]["id"] == data["gallery"]["folder_id"]
+        assert data["folder"]["image_count"] + data["folder"]["video_count"] <= data["folder"]["file_count"]
+        
+        response = requests.get(f"{BASE_URL}/api/gallery/{test_share_token}/view", params={"folder_id": "nonexistent"})
+        assert response.status_code == 404
+        
+        response = requests.get(f"{BASE_URL}/api/gallery/{test_share_token}/files/status", params={"ids": "nonexistent"})
+        assert response.status_code == 200
+        assert response.json()["files"] == []
+    
     def test_delete_share(self, auth_token, test_share_id):
         """Test deleting a share"""
         headers = {"Authorization": f"Bearer {auth_token}"}
@@ -279,6 +411,25 @@ class TestShareOperations:
         print("Share deleted successfully")
 
 
+class TestZipDownloads:
+    """Test streamed ZIP downloads"""
+    
+    def test_gallery_zip_length_and_resume(self, test_file_id, test_share_token):
+        """Test gallery ZIP has exact Content-Length and resumes with Range"""
+        response = requests.get(f"{BASE_URL}/api/gallery/{test_share_token}/download-zip")
+        assert response.status_code == 200
+        assert response.headers.get('accept-ranges') == 'bytes'
+        assert int(response.headers['content-length']) == len(response.content)
+        full = response.content
+        
+        response = requests.get(f"{BASE_URL}/api/gallery/{test_share_token}/download-zip",
+            headers={"Range": "bytes=100-", "If-Range": response.headers['etag']}
+        )
+        assert response.status_code == 206
+        assert response.content == full[100:]
+        print(f"ZIP resumed from byte 100 of {len(full)}")
+
+
 class TestStats:
     """Test stats endpoint"""
     
@@ -294,6 +445,16 @@ class TestStats:
         assert "total_size" in data
         print(f"Stats: {data}")
 
+    def test_activity_summary(self, auth_token):
+        """Test daily activity rollups are served"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        response = requests.get(f"{BASE_URL}/api/activity-logs/summary?days=7", headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert "start" in data
+        assert all("day" in row for row in data["rows"])
+        print(f"Activity summary: {data}")
+
 
 class TestCleanup:
     """Cleanup test data"""
@@ -388,12 +549,22 @@ def test_file_id(auth_token, test_folder_id):
         data=data
     )
     
-    if response.status_code == 200:
-        file_id = response.json()["id"]
-        yield file_id
-        # File will be deleted with folder
-    else:
+    if response.status_code != 200:
         pytest.skip("Could not upload test file")
+    file_id = response.json()["id"]
+    
+    # Thumbnails etc. are rendered by the job worker after the upload returns
+    deadline = time.time() + DERIVATIVE_TIMEOUT
+    status = None
+    while time.time() < deadline:
+        listing = requests.get(f"{BASE_URL}/api/files", headers=headers, params={"folder_id": test_folder_id, "limit": 1000})
+        status = next((f["derivative_status"] for f in listing.json()["files"] if f["id"] == file_id), None)
+        if status in ("ready", "failed"):
+            break
+        time.sleep(0.25)
+    assert status == "ready", f"Derivatives not ready after {DERIVATIVE_TIMEOUT}s (status {status})"
+    yield file_id
+    # File will be deleted with folder
 
 
 @pytest.fixture(scope="session")
@@ -0,0 +1,115 @@
+"""
+Unit tests for login throttling (no server or database required)
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from starlette.requests import Request
+
+# server connects to Mongo lazily, so importing it only needs these set
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'gallery_unit_tests')
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp())
+os.environ.setdefault('FILES_DIR', tempfile.mkdtemp())
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import server
+from cache import TTLCache
+from fastapi import HTTPException
+
+
+def make_request(headers: dict, host: str = '10.0.0.2') -> Request:
+    return Request({
+        'type': 'http',
+        'headers': [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        'client': (host, 1234),
+    })
+
+
+class TestLoginRate:
+    """Test the per-IP login window"""
+
+    @pytest.fixture(autouse=True)
+    def fresh_attempts(self, monkeypatch):
+        monkeypatch.setattr(server, 'login_attempts', TTLCache(3, server.LOGIN_WINDOW_SECONDS))
+
+    def test_window_exhausted(self):
+        """Test an IP gets a 429 with Retry-After once its attempts are used up"""
+        for _ in range(server.LOGIN_MAX_ATTEMPTS):
+            server.check_login_rate('203.0.113.1')
+        with pytest.raises(HTTPException) as excinfo:
+            server.check_login_rate('203.0.113.1')
+        assert excinfo.value.status_code == 429
+        assert int(excinfo.value.headers['Retry-After']) > 0
+        server.check_login_rate('203.0.113.2')
+
+    def test_tracked_ips_are_bounded(self):
+        """Test many distinct IPs can't grow the table past its size"""
+        for i in range(50):
+            server.check_login_rate(f'198.51.100.{i}')
+        assert len(server.login_attempts) == 3
+
+    def test_success_clears_attempts(self, monkeypatch):
+        """Test a good password logs in and wipes the IP's earlier failures"""
+        admin = {'username': 'admin', 'password_hash': server.hash_password('secret')}
+
+        class Admins:
+            async def find_one(self, query):
+                return admin if query == {'username': 'admin'} else None
+
+        monkeypatch.setattr(server, 'db', type('DB', (), {'admins': Admins()})())
+        request = make_request({'X-Real-IP': '203.0.113.5'})
+
+        async def run():
+            with pytest.raises(HTTPException) as excinfo:
+                await server.login(server.AdminLogin(username='admin', password='wrong'), request)
+            assert excinfo.value.status_code == 401
+            assert server.login_attempts.get('203.0.113.5')
+            return await server.login(server.AdminLogin(username='admin', password='secret'), request)
+
+        result = asyncio.run(run())
+        assert result['username'] == 'admin'
+        assert result['token']
+        assert server.login_attempts.get('203.0.113.5') is None
+
+    def test_forwarded_for_is_ignored(self):
+        """Test a client can't pick its own key by sending X-Forwarded-For"""
+        spoofed = make_request({'X-Forwarded-For': '1.2.3.4, 203.0.113.9', 'X-Real-IP': '203.0.113.9'})
+        assert server.client_ip(spoofed) == '203.0.113.9'
+        assert server.client_ip(make_request({'X-Forwarded-For': '1.2.3.4'})) == '10.0.0.2'
+
+
+class TestPasswordHashPool:
+    """Test the bcrypt pool refuses work once saturated"""
+
+    def test_saturated_pool(self, monkeypatch):
+        """Test calls past workers + queue get a 429 instead of waiting"""
+        monkeypatch.setattr(server, 'PASSWORD_HASH_WORKERS', 1)
+        monkeypatch.setattr(server, 'PASSWORD_HASH_QUEUE', 1)
+        executor = ThreadPoolExecutor(max_workers=1)
+        monkeypatch.setattr(server, 'password_hash_executor', executor)
+        release = threading.Event()
+
+        async def run():
+            busy = [asyncio.create_task(server.run_password_hash(release.wait, 5)) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            with pytest.raises(HTTPException) as excinfo:
+                await server.run_password_hash(release.wait, 5)
+            release.set()
+            await asyncio.gather(*busy)
+            return excinfo.value
+
+        try:
+            error = asyncio.run(run())
+        finally:
+            release.set()
+            executor.shutdown()
+        assert error.status_code == 429
+        assert error.headers['Retry-After'] == '1'
+        assert server.password_hash_pending == 0
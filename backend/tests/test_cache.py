@@ -0,0 +1,61 @@
+"""
+Unit tests for the in-process LRU/TTL cache (no server required)
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from cache import TTLCache
+
+
+class TestTTLCache:
+    """Test eviction, expiry and counters"""
+
+    def test_hits_and_misses(self):
+        """Test lookups are counted"""
+        cache = TTLCache(maxsize=2, ttl=60)
+        assert cache.get('a') is None
+        cache.set('a', 1)
+        assert cache.get('a') == 1
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+
+    def test_least_recently_used_is_evicted(self):
+        """Test the oldest unused entry goes first"""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert len(cache) == 2
+
+    def test_entries_expire(self):
+        """Test entries vanish after the TTL or an earlier explicit deadline"""
+        cache = TTLCache(maxsize=4, ttl=0.05)
+        cache.set('a', 1)
+        cache.set('b', 2, expires_at=time.monotonic() - 1)
+        assert cache.get('b') is None
+        time.sleep(0.06)
+        assert cache.get('a') is None
+        assert len(cache) == 0
+
+    def test_pop(self):
+        """Test invalidation removes the entry"""
+        cache = TTLCache()
+        cache.set('a', 1)
+        cache.pop('a')
+        cache.pop('missing')
+        assert cache.get('a') is None
+
+    def test_discard_where(self):
+        """Test entries can be dropped by value"""
+        cache = TTLCache()
+        cache.set('t1', {'username': 'a'})
+        cache.set('t2', {'username': 'b'})
+        assert cache.discard_where(lambda admin: admin['username'] == 'a') == 1
+        assert cache.get('t1') is None
+        assert cache.get('t2') == {'username': 'b'}
@@ -0,0 +1,153 @@
+"""
+Unit tests for the image derivative engine (no server required)
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from derivatives import DerivativeEngine, DerivativeSpec, encoder_available, read_capture_time, render_derivatives
+
+
+@pytest.fixture
+def source_image(tmp_path):
+    path = tmp_path / "original.jpg"
+    Image.new('RGB', (1200, 800), color='red').save(path, 'JPEG')
+    return path
+
+
+@pytest.fixture
+def specs(tmp_path):
+    (tmp_path / "thumbnails").mkdir()
+    (tmp_path / "previews").mkdir()
+    return [
+        DerivativeSpec('thumbnail', str(tmp_path / "thumbnails"), 300, 85),
+        DerivativeSpec('preview', str(tmp_path / "previews"), 400, 75),
+    ]
+
+
+class TestRenderDerivatives:
+    """Test single-decode multi-size generation"""
+
+    def test_all_sizes_written(self, tmp_path, source_image, specs):
+        """Test every spec is written and fits its box"""
+        render_derivatives(str(source_image), "abc", specs)
+        with Image.open(tmp_path / "thumbnails" / "abc.jpg") as img:
+            assert img.size == (300, 200)
+        with Image.open(tmp_path / "previews" / "abc.jpg") as img:
+            assert img.size == (400, 267)
+
+    def test_progressive(self, tmp_path, source_image):
+        """Test specs asking for progressive JPEGs get them"""
+        (tmp_path / "display").mkdir()
+        render_derivatives(str(source_image), "abc", [DerivativeSpec('display', str(tmp_path / "display"), 1000, 82, progressive=True)])
+        with Image.open(tmp_path / "display" / "abc.jpg") as img:
+            assert img.size == (1000, 667)
+            assert img.info.get('progressive')
+
+    def test_extra_formats(self, tmp_path, source_image):
+        """Test each requested format is written at the same size"""
+        formats = ('jpeg', 'webp')
+        render_derivatives(str(source_image), "abc", [DerivativeSpec('thumbnail', str(tmp_path), 300, 85, formats=formats)])
+        for ext, fmt in (("jpg", "JPEG"), ("webp", "WEBP")):
+            with Image.open(tmp_path / f"abc.{ext}") as img:
+                assert img.format == fmt
+                assert img.size == (300, 200)
+
+    def test_encoder_available(self):
+        """Test JPEG is always writable and unknown formats are not"""
+        assert encoder_available('jpeg')
+        assert not encoder_available('nonsense')
+
+    def test_exact_width_rungs(self, tmp_path, source_image, specs):
+        """Test srcset rungs are scaled to their width and skipped past the original's"""
+        rungs = [DerivativeSpec(f'w{w}', str(tmp_path), w, 80, exact_width=True) for w in (240, 2400)]
+        result = render_derivatives(str(source_image), "abc", specs + rungs)
+        assert result.sizes == {'thumbnail': (300, 200), 'preview': (400, 267), 'w240': (240, 160)}
+        with Image.open(tmp_path / "abc.jpg") as img:
+            assert img.size == (240, 160)
+
+    def test_exif_orientation_applied(self, tmp_path, specs):
+        """Test a sideways-stored photo comes out upright, sized on its viewed axes"""
+        source = tmp_path / "rotated.jpg"
+        img = Image.new('RGB', (1200, 800), color='red')
+        img.paste((0, 0, 255), (0, 0, 600, 800))  # left half blue; upright (rotated 90° cw) it's the top half
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        img.save(source, 'JPEG', exif=exif)
+        result = render_derivatives(str(source), "abc", specs)
+        assert result.sizes == {'thumbnail': (200, 300), 'preview': (267, 400)}
+        with Image.open(tmp_path / "thumbnails" / "abc.jpg") as thumb:
+            assert thumb.size == (200, 300)
+            assert thumb.getexif().get(0x0112) is None
+            top, bottom = thumb.getpixel((100, 20)), thumb.getpixel((100, 280))
+        assert top[2] > 200 and top[0] < 50
+        assert bottom[0] > 200 and bottom[2] < 50
+
+    def test_small_image_not_upscaled(self, tmp_path, specs):
+        """Test images smaller than the target keep their size"""
+        source = tmp_path / "small.png"
+        Image.new('RGBA', (120, 80)).save(source, 'PNG')
+        render_derivatives(str(source), "small", specs)
+        with Image.open(tmp_path / "previews" / "small.jpg") as img:
+            assert img.size == (120, 80)
+            assert img.mode == 'RGB'
+
+
+class TestReadCaptureTime:
+    """Test EXIF capture time extraction"""
+
+    def test_date_time_original(self, tmp_path):
+        """Test DateTimeOriginal is returned as an ISO string"""
+        path = tmp_path / "exif.jpg"
+        exif = Image.Exif()
+        exif[0x8769] = {0x9003: '2024:06:01 14:03:22'}
+        Image.new('RGB', (10, 10)).save(path, 'JPEG', exif=exif)
+        assert read_capture_time(str(path)) == '2024-06-01T14:03:22'
+
+    def test_missing_exif(self, source_image):
+        """Test images without EXIF give None"""
+        assert read_capture_time(str(source_image)) is None
+
+    def test_not_an_image(self, tmp_path):
+        """Test unreadable files give None rather than raising"""
+        path = tmp_path / "notes.txt"
+        path.write_text("hello")
+        assert read_capture_time(str(path)) is None
+
+
+class TestDerivativeEngine:
+    """Test derivative generation in the process pool"""
+
+    def test_run_in_pool(self, tmp_path, source_image, specs):
+        """Test jobs run in the pool and are counted"""
+        engine = DerivativeEngine(max_workers=1, queue_size=2)
+
+        async def run():
+            await asyncio.gather(
+                engine.run(render_derivatives, str(source_image), "one", specs),
+                engine.run(render_derivatives, str(source_image), "two", specs),
+            )
+        try:
+            asyncio.run(run())
+        finally:
+            engine.shutdown()
+
+        assert (tmp_path / "thumbnails" / "two.jpg").exists()
+        stats = engine.stats()
+        assert stats['completed'] == 2
+        assert stats['failed'] == 0
+        assert stats['queue_depth'] == 0
+
+    def test_failed_job_is_counted(self, tmp_path, specs):
+        """Test a missing source raises and is recorded as a failure"""
+        engine = DerivativeEngine(max_workers=1)
+        try:
+            with pytest.raises(FileNotFoundError):
+                asyncio.run(engine.run(render_derivatives, str(tmp_path / "missing.jpg"), "x", specs))
+        finally:
+            engine.shutdown()
+        assert engine.stats()['failed'] == 1
@@ -0,0 +1,156 @@
+"""
+Unit tests for range-aware file responses (no server required)
+"""
+import email
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from httpfiles import accel_redirect_response, accepted_media_types, file_response, iter_file_range, parse_range, parse_ranges
+
+DATA = os.urandom(10000)
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "film.mp4"
+    path.write_bytes(DATA)
+
+    async def serve(request: Request):
+        return file_response(request.headers, path, read_size=4096)
+
+    return TestClient(Starlette(routes=[Route("/film", serve)]))
+
+
+class TestParseRanges:
+    """Test Range header parsing"""
+
+    def test_forms(self):
+        """Test closed, open-ended and suffix ranges"""
+        assert parse_ranges("bytes=0-99", 1000) == [(0, 100)]
+        assert parse_ranges("bytes=900-", 1000) == [(900, 1000)]
+        assert parse_ranges("bytes=-100", 1000) == [(900, 1000)]
+        assert parse_ranges("bytes=990-2000", 1000) == [(990, 1000)]
+
+    def test_multiple_are_sorted_and_merged(self):
+        """Test overlapping and adjacent ranges are coalesced"""
+        assert parse_ranges("bytes=500-599, 0-9, 5-19, 20-29", 1000) == [(0, 30), (500, 600)]
+
+    def test_ignored(self):
+        """Test headers that mean 'send everything'"""
+        assert parse_ranges(None, 1000) is None
+        assert parse_ranges("items=0-1", 1000) is None
+        assert parse_ranges("bytes=abc", 1000) is None
+        assert parse_ranges("bytes=50-10", 1000) is None
+        assert parse_ranges("bytes=" + ",".join(f"{i * 2}-{i * 2}" for i in range(20)), 1000) is None
+
+    def test_unsatisfiable(self):
+        """Test ranges past the end raise 416"""
+        with pytest.raises(HTTPException) as excinfo:
+            parse_ranges("bytes=1000-", 1000)
+        assert excinfo.value.status_code == 416
+        assert excinfo.value.headers["Content-Range"] == "bytes */1000"
+
+    def test_single_range_only(self):
+        """Test parse_range gives up on several ranges"""
+        assert parse_range("bytes=0-9", 1000) == (0, 10)
+        assert parse_range("bytes=0-9,20-29", 1000) is None
+
+
+class TestAcceptedMediaTypes:
+    """Test Accept header parsing"""
+
+    def test_explicit_types_only(self):
+        """Test wildcards and q=0 entries don't count"""
+        accept = "image/avif,image/webp;q=0.9,image/apng;q=0,image/*,*/*;q=0.8"
+        assert accepted_media_types(accept) == {"image/avif", "image/webp"}
+        assert accepted_media_types(None) == set()
+
+
+class TestIterFileRange:
+    """Test aligned reads"""
+
+    def test_reads_align_to_blocks(self, tmp_path):
+        """Test only the first read is short when a range starts mid-block"""
+        path = tmp_path / "data"
+        path.write_bytes(DATA)
+        chunks = list(iter_file_range(str(path), 1000, 9000, read_size=4096))
+        assert b"".join(chunks) == DATA[1000:9000]
+        assert [len(c) for c in chunks] == [3096, 4096, 808]
+
+
+class TestFileResponse:
+    """Test responses to plain, ranged and conditional requests"""
+
+    def test_full_body(self, client):
+        """Test a plain GET gets the whole file and advertises ranges"""
+        response = client.get("/film")
+        assert response.status_code == 200
+        assert response.content == DATA
+        assert response.headers["accept-ranges"] == "bytes"
+        assert response.headers["content-type"] == "video/mp4"
+
+    def test_single_range(self, client):
+        """Test one range gets a 206 with Content-Range"""
+        response = client.get("/film", headers={"Range": "bytes=100-199"})
+        assert response.status_code == 206
+        assert response.content == DATA[100:200]
+        assert response.headers["content-range"] == f"bytes 100-199/{len(DATA)}"
+
+    def test_multiple_ranges(self, client):
+        """Test several ranges come back as multipart/byteranges"""
+        response = client.get("/film", headers={"Range": "bytes=0-9,5000-5099"})
+        assert response.status_code == 206
+        assert int(response.headers["content-length"]) == len(response.content)
+        message = email.message_from_bytes(
+            f"Content-Type: {response.headers['content-type']}\r\n\r\n".encode() + response.content
+        )
+        parts = [(part["Content-Range"], part.get_payload(decode=True)) for part in message.get_payload()]
+        assert parts == [
+            (f"bytes 0-9/{len(DATA)}", DATA[0:10]),
+            (f"bytes 5000-5099/{len(DATA)}", DATA[5000:5100]),
+        ]
+
+    def test_if_range(self, client):
+        """Test a stale If-Range validator gets the whole file"""
+        etag = client.get("/film").headers["etag"]
+        assert client.get("/film", headers={"Range": "bytes=0-9", "If-Range": etag}).status_code == 206
+        response = client.get("/film", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+        assert response.status_code == 200
+        assert response.content == DATA
+
+    def test_not_modified(self, client):
+        """Test revalidation with either validator gets a 304"""
+        first = client.get("/film")
+        assert client.get("/film", headers={"If-None-Match": first.headers["etag"]}).status_code == 304
+        assert client.get("/film", headers={"If-Modified-Since": first.headers["last-modified"]}).status_code == 304
+        assert client.get("/film", headers={"If-None-Match": '"other"'}).status_code == 200
+
+    def test_unsatisfiable_range(self, client):
+        """Test a range past the end gets a 416"""
+        response = client.get("/film", headers={"Range": f"bytes={len(DATA)}-"})
+        assert response.status_code == 416
+
+
+class TestAccelRedirect:
+    """Test handing files to nginx"""
+
+    def test_headers(self):
+        """Test the redirect carries the headers nginx passes through"""
+        response = accel_redirect_response(
+            "/_protected/files/a%20b.mp4", filename="a b.mp4",
+            content_disposition='attachment; filename="a b.mp4"', extra_headers={"Cache-Control": "no-cache"}
+        )
+        assert response.headers["x-accel-redirect"] == "/_protected/files/a%20b.mp4"
+        assert response.headers["content-type"] == "video/mp4"
+        assert response.headers["content-disposition"] == 'attachment; filename="a b.mp4"'
+        assert response.headers["cache-control"] == "no-cache"
+        assert response.body == b""
@@ -0,0 +1,187 @@
+"""
+Tests for the background job queue.
+
+These need a real MongoDB (MONGO_URL, default localhost) and are skipped
+without one. They use their own throwaway database, never DB_NAME's.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'gallery_unit_tests')
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp())
+os.environ.setdefault('FILES_DIR', tempfile.mkdtemp())
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import server
+
+
+@pytest.fixture
+def jobs_db(monkeypatch):
+    """Run each test on a fresh database, on its own event loop"""
+    loop = asyncio.new_event_loop()
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], serverSelectionTimeoutMS=1000)
+    try:
+        loop.run_until_complete(client.admin.command('ping'))
+    except Exception:
+        client.close()
+        loop.close()
+        pytest.skip("MongoDB not reachable")
+    db = client[f"gallery_test_jobs_{uuid.uuid4().hex[:8]}"]
+    monkeypatch.setattr(server, 'db', db)
+    loop.run_until_complete(server.ensure_indexes())
+    yield loop.run_until_complete
+    loop.run_until_complete(client.drop_database(db.name))
+    client.close()
+    loop.close()
+
+
+async def failing_job(job):
+    raise RuntimeError("boom")
+
+
+def utcnow():
+    # Motor hands back naive UTC datetimes
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class TestClaimJob:
+    """Test claiming and leasing"""
+
+    def test_claims_oldest_runnable(self, jobs_db):
+        """Test a claim takes the oldest due job, leases it and counts the attempt"""
+        async def run():
+            later = await server.enqueue_job('derivatives', {'file_id': 'later'})
+            await server.db.jobs.update_one({'id': later}, {'$set': {'run_after': datetime.now(timezone.utc) + timedelta(hours=1)}})
+            first = await server.enqueue_job('derivatives', {'file_id': 'a'})
+            await server.enqueue_job('derivatives', {'file_id': 'b'})
+            return first, await server.claim_job()
+
+        first, job = jobs_db(run())
+        assert job['id'] == first
+        assert job['status'] == 'running'
+        assert job['attempts'] == 1
+        assert job['locked_until'] > utcnow() + timedelta(seconds=server.JOB_LEASE_SECONDS - 60)
+
+    def test_nothing_due(self, jobs_db):
+        """Test running jobs with a live lease and future retries aren't claimed"""
+        async def run():
+            await server.enqueue_job('derivatives', {'file_id': 'a'})
+            await server.claim_job()
+            return await server.claim_job()
+
+        assert jobs_db(run()) is None
+
+    def test_expired_lease_is_reclaimed(self, jobs_db):
+        """Test a job whose worker died is claimed again once its lease runs out"""
+        async def run():
+            job_id = await server.enqueue_job('derivatives', {'file_id': 'a'})
+            await server.claim_job()
+            await server.db.jobs.update_one({'id': job_id}, {'$set': {'locked_until': datetime.now(timezone.utc) - timedelta(seconds=1)}})
+            return job_id, await server.claim_job()
+
+        job_id, job = jobs_db(run())
+        assert job['id'] == job_id
+        assert job['attempts'] == 2
+
+
+class TestRunJob:
+    """Test completion, retries and giving up"""
+
+    @pytest.fixture(autouse=True)
+    def handlers(self, monkeypatch):
+        monkeypatch.setitem(server.JOB_HANDLERS, 'fail', failing_job)
+
+    def test_failure_is_retried_with_backoff(self, jobs_db):
+        """Test a failed attempt goes back to the queue, due after the backoff"""
+        async def run():
+            job_id = await server.enqueue_job('fail', {})
+            await server.run_job(await server.claim_job())
+            assert await server.claim_job() is None  # not due again until the backoff passes
+            return await server.db.jobs.find_one({'id': job_id}, {'_id': 0})
+
+        job = jobs_db(run())
+        assert job['status'] == 'queued'
+        assert job['attempts'] == 1
+        assert job['last_error'] == 'boom'
+        assert job['locked_until'] is None
+        delay = (job['run_after'] - utcnow()).total_seconds()
+        assert server.JOB_RETRY_BASE_SECONDS - 5 < delay <= server.JOB_RETRY_BASE_SECONDS
+
+    def test_gives_up_after_max_attempts(self, jobs_db):
+        """Test the last failed attempt marks the job failed for good"""
+        async def run():
+            job_id = await server.enqueue_job('fail', {})
+            await server.db.jobs.update_one({'id': job_id}, {'$set': {'attempts': server.JOB_MAX_ATTEMPTS - 1}})
+            await server.run_job(await server.claim_job())
+            return await server.db.jobs.find_one({'id': job_id}, {'_id': 0})
+
+        job = jobs_db(run())
+        assert job['status'] == 'failed'
+        assert job['attempts'] == server.JOB_MAX_ATTEMPTS
+        assert job['finished_at'] > utcnow() - timedelta(minutes=1)
+
+    def test_failed_jobs_expire(self, jobs_db):
+        """Test failed jobs are only kept for the retention period"""
+        indexes = jobs_db(server.db.jobs.index_information())
+        assert indexes['finished_at_ttl']['expireAfterSeconds'] == server.JOB_FAILED_RETENTION_DAYS * 86400
+
+    def test_success_removes_job(self, jobs_db, monkeypatch):
+        """Test a job whose handler returns is deleted"""
+        async def succeed(job):
+            pass
+        monkeypatch.setitem(server.JOB_HANDLERS, 'ok', succeed)
+
+        async def run():
+            job_id = await server.enqueue_job('ok', {})
+            await server.run_job(await server.claim_job())
+            return await server.db.jobs.find_one({'id': job_id}, {'_id': 0})
+
+        assert jobs_db(run()) is None
+
+
+class TestJobKeys:
+    """Test the same work isn't queued twice"""
+
+    def test_duplicate_key_is_skipped_until_done(self, jobs_db, monkeypatch):
+        """Test a key can be queued again once its job has finished"""
+        async def succeed(job):
+            pass
+        monkeypatch.setitem(server.JOB_HANDLERS, 'ok', succeed)
+
+        async def run():
+            first = await server.enqueue_job('ok', {}, key='ok:1')
+            duplicate = await server.enqueue_job('ok', {}, key='ok:1')
+            await server.run_job(await server.claim_job())
+            again = await server.enqueue_job('ok', {}, key='ok:1')
+            return first, duplicate, again
+
+        first, duplicate, again = jobs_db(run())
+        assert first and again
+        assert duplicate is None
+
+    def test_queue_missing_derivatives_in_batches(self, jobs_db):
+        """Test every image lacking derivatives gets one job, even across runs and batches"""
+        async def run():
+            await server.db.files.insert_many([
+                {'id': f'img{i}', 'file_type': 'image', 'derivative_status': 'ready'} for i in range(5)
+            ] + [{'id': 'video', 'file_type': 'video'}])
+            await server.enqueue_derivatives('img0')
+            queued = await server.queue_missing_derivatives(batch_size=2)
+            await server.db.files.update_many({}, {'$set': {'derivative_status': 'ready'}})
+            queued_again = await server.queue_missing_derivatives(batch_size=2)
+            jobs = await server.db.jobs.find({}, {'_id': 0, 'payload': 1}).to_list(None)
+            return queued, queued_again, sorted(job['payload']['file_id'] for job in jobs)
+
+        queued, queued_again, file_ids = jobs_db(run())
+        assert queued == 4
+        assert queued_again == 0
+        assert file_ids == [f'img{i}' for i in range(5)]
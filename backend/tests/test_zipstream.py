@@ -0,0 +1,121 @@
+"""
+Unit tests for the streaming ZIP writer (no server required)
+"""
+import io
+import os
+import sys
+import zipfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import zipstream
+from zipstream import ZipLayout, file_crc32, members_from_paths, stream_zip, unique_arcnames
+
+
+@pytest.fixture
+def sample_files(tmp_path):
+    files = []
+    for name, data in [("a.jpg", os.urandom(5000)), ("b.mp4", b"x" * 70000), ("empty.txt", b"")]:
+        path = tmp_path / name
+        path.write_bytes(data)
+        files.append((path, data))
+    return files
+
+
+def build(members, chunk_size=1024):
+    return b"".join(stream_zip(members, chunk_size=chunk_size))
+
+
+class TestStreamZip:
+    """Test archives produced by stream_zip open with the standard library"""
+
+    def test_roundtrip(self, sample_files):
+        """Test every member is present with correct content and CRC"""
+        members = members_from_paths([(path, f"Ceremony/{path.name}", None) for path, _ in sample_files])
+        archive = zipfile.ZipFile(io.BytesIO(build(members)))
+        assert archive.testzip() is None
+        for path, data in sample_files:
+            assert archive.read(f"Ceremony/{path.name}") == data
+
+    def test_missing_files_skipped(self, tmp_path, sample_files):
+        """Test files missing on disk are left out"""
+        entries = [(path, path.name, None) for path, _ in sample_files] + [(tmp_path / "gone.jpg", "gone.jpg", None)]
+        members = members_from_paths(entries)
+        assert len(members) == len(sample_files)
+
+    def test_unicode_names(self, sample_files):
+        """Test non-ASCII names are stored as UTF-8"""
+        path, data = sample_files[0]
+        members = members_from_paths([(path, "Première danse.jpg", None)])
+        archive = zipfile.ZipFile(io.BytesIO(build(members)))
+        assert archive.read("Première danse.jpg") == data
+
+    def test_zip64_records(self, sample_files, monkeypatch):
+        """Test ZIP64 sizes, offsets and end records are readable"""
+        monkeypatch.setattr(zipstream, "ZIP64_LIMIT", 4000)
+        monkeypatch.setattr(zipstream, "ZIP64_COUNT_LIMIT", 2)
+        members = members_from_paths([(path, path.name, None) for path, _ in sample_files])
+        archive = zipfile.ZipFile(io.BytesIO(build(members)))
+        assert archive.testzip() is None
+        assert [info.file_size for info in archive.infolist()] == [5000, 70000, 0]
+
+
+class TestUniqueArcnames:
+    """Test colliding member names are renamed"""
+
+    def test_duplicates_numbered(self):
+        """Test repeats get ' (n)' before the extension, case-insensitively"""
+        names = ["IMG_1.jpg", "img_1.JPG", "IMG_1.jpg", "Reception/IMG_1.jpg", "README"]
+        assert unique_arcnames(names) == [
+            "IMG_1.jpg", "img_1 (1).JPG", "IMG_1 (2).jpg", "Reception/IMG_1.jpg", "README"
+        ]
+
+    def test_dot_in_folder_only(self):
+        """Test a dot in the folder part is not treated as the extension"""
+        assert unique_arcnames(["v1.2/notes", "v1.2/notes"]) == ["v1.2/notes", "v1.2/notes (1)"]
+
+
+class TestZipLayout:
+    """Test precomputed length and byte-range serving"""
+
+    def test_size_matches_stream(self, sample_files):
+        """Test the planned size equals the streamed archive length"""
+        members = members_from_paths([(path, path.name, None) for path, _ in sample_files])
+        assert ZipLayout(members).size == len(build(members))
+
+    def test_ranges_match_full_archive(self, sample_files):
+        """Test arbitrary ranges equal the same slice of the full archive"""
+        members = members_from_paths([(path, path.name, None) for path, _ in sample_files])
+        full = build(members)
+        for start, stop in [(0, 10), (20, 6000), (5100, 5200), (70000, len(full)), (len(full) - 22, len(full))]:
+            layout = ZipLayout(members)
+            assert b"".join(layout.iter_range(start, stop, chunk_size=777)) == full[start:stop]
+
+    def test_resume_uses_known_crcs(self, sample_files):
+        """Test a resumed range doesn't need to compute CRCs that are already known"""
+        entries = [(path, path.name, file_crc32(str(path))) for path, _ in sample_files]
+        layout = ZipLayout(members_from_paths(entries))
+        tail = b"".join(layout.iter_range(layout.size - 100))
+        assert len(tail) == 100
+        assert layout.computed_crcs == {}
+
+    def test_crcs_computed_while_streaming(self, sample_files):
+        """Test missing CRCs are reported after a full download"""
+        layout = ZipLayout(members_from_paths([(path, path.name, None) for path, _ in sample_files]))
+        b"".join(layout.iter_range())
+        assert layout.computed_crcs == {str(path): file_crc32(str(path)) for path, _ in sample_files}
+
+    def test_crcs_reported_as_computed(self, sample_files):
+        """Test each computed CRC reaches on_crc before the download ends"""
+        reported = {}
+        layout = ZipLayout(members_from_paths([(path, path.name, None) for path, _ in sample_files]), on_crc=reported.__setitem__)
+        stream = layout.iter_range()
+        first_path = str(sample_files[0][0])
+        while first_path not in reported:
+            next(stream)
+        assert len(reported) == 1
+        assert reported[first_path] == file_crc32(first_path)
+        b"".join(stream)
+        assert reported == layout.computed_crcs
@@ -0,0 +1,30 @@
+"""
+Standalone background job worker.
+
+Usage (from the backend directory, with the same environment as the API):
+
+    python -m worker
+
+Set RUN_JOB_WORKER=false on the API when running this separately, so image
+processing happens outside the process serving gallery requests.
+"""
+import asyncio
+
+from server import client, derivative_engine, job_worker_loop, logger
+
+
+async def main():
+    derivative_engine.start()
+    logger.info("Job worker started")
+    try:
+        await job_worker_loop()
+    finally:
+        derivative_engine.shutdown()
+        client.close()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
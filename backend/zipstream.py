@@ -0,0 +1,283 @@
+"""
+Streaming ZIP archives for folder and gallery downloads.
+
+Members are stored (no compression - photos and videos don't shrink) and
+each one is followed by a data descriptor carrying its CRC, so the archive
+is produced in a single pass while the files are read from disk: the first
+bytes go out immediately and nothing is written to scratch space. ZIP64
+records are used automatically for members over 4GB, archives with more
+than 65535 entries, or offsets past 4GB.
+
+Because nothing is compressed, the position of every byte follows from the
+member names and sizes alone. ZipLayout uses that to report the exact
+archive length up front and to serve any byte range by seeking straight
+into the right member file.
+"""
+import bisect
+import os
+import struct
+import time
+import zlib
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+ZIP_CHUNK_SIZE = 4 * 1024 * 1024  # 4MB reads keep syscalls low on large videos
+
+# Thresholds at which ZIP64 records are needed; the classic fields then hold the markers
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP64_COUNT_MARKER = 0xFFFF
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+MADE_BY_UNIX = 3 << 8
+UNIX_FILE_ATTRS = 0o100644 << 16
+
+
+class ZipMember(NamedTuple):
+    path: str      # file on disk
+    arcname: str   # name inside the archive
+    size: int
+    mtime: float
+    crc32: Optional[int] = None  # computed while streaming if not known
+
+
+def _dos_datetime(mtime: float):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1  # 1980-01-01 00:00
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+def _local_header(member: ZipMember, name: bytes) -> bytes:
+    zip64 = member.size >= ZIP64_LIMIT
+    dos_time, dos_date = _dos_datetime(member.mtime)
+    extra = b''
+    size_field = 0
+    if zip64:
+        # Sizes follow in the descriptor; the zip64 extra marks them as 8 bytes wide
+        extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+        size_field = ZIP64_MARKER
+    return struct.pack(
+        '<IHHHHHIIIHH',
+        0x04034b50,
+        VERSION_ZIP64 if zip64 else VERSION_DEFAULT,
+        FLAG_DATA_DESCRIPTOR | FLAG_UTF8,
+        0,  # stored
+        dos_time, dos_date,
+        0, size_field, size_field,
+        len(name), len(extra)
+    ) + name + extra
+
+
+def _data_descriptor(member: ZipMember, crc: int) -> bytes:
+    if member.size >= ZIP64_LIMIT:
+        return struct.pack('<IIQQ', 0x08074b50, crc, member.size, member.size)
+    return struct.pack('<IIII', 0x08074b50, crc, member.size, member.size)
+
+
+def _central_header(member: ZipMember, name: bytes, crc: int, offset: int) -> bytes:
+    dos_time, dos_date = _dos_datetime(member.mtime)
+    extra_fields = []
+    size_field = member.size
+    offset_field = offset
+    if member.size >= ZIP64_LIMIT:
+        extra_fields += [member.size, member.size]
+        size_field = ZIP64_MARKER
+    if offset >= ZIP64_LIMIT:
+        extra_fields.append(offset)
+        offset_field = ZIP64_MARKER
+    extra = b''
+    if extra_fields:
+        extra = struct.pack(f'<HH{len(extra_fields)}Q', 0x0001, 8 * len(extra_fields), *extra_fields)
+    version = VERSION_ZIP64 if extra_fields else VERSION_DEFAULT
+    return struct.pack(
+        '<IHHHHHHIIIHHHHHII',
+        0x02014b50,
+        MADE_BY_UNIX | version,
+        version,
+        FLAG_DATA_DESCRIPTOR | FLAG_UTF8,
+        0,
+        dos_time, dos_date,
+        crc, size_field, size_field,
+        len(name), len(extra), 0,
+        0, 0, UNIX_FILE_ATTRS,
+        offset_field
+    ) + name + extra
+
+
+def _end_records(count: int, cd_offset: int, cd_size: int) -> bytes:
+    records = b''
+    count_field = ZIP64_COUNT_MARKER if count >= ZIP64_COUNT_LIMIT else count
+    if count >= ZIP64_COUNT_LIMIT or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        zip64_end_offset = cd_offset + cd_size
+        records += struct.pack(
+            '<IQHHIIQQQQ',
+            0x06064b50, 44,
+            MADE_BY_UNIX | VERSION_ZIP64, VERSION_ZIP64,
+            0, 0,
+            count, count, cd_size, cd_offset
+        )
+        records += struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1)
+    records += struct.pack(
+        '<IHHHHIIH',
+        0x06054b50, 0, 0,
+        count_field, count_field,
+        ZIP64_MARKER if cd_size >= ZIP64_LIMIT else cd_size,
+        ZIP64_MARKER if cd_offset >= ZIP64_LIMIT else cd_offset,
+        0
+    )
+    return records
+
+
+def file_crc32(path: str, chunk_size: int = ZIP_CHUNK_SIZE) -> int:
+    crc = 0
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+class ZipLayout:
+    """Byte-exact plan of a stored ZIP archive.
+
+    The archive is a sequence of segments: for each member its local header,
+    its file data and its data descriptor, then the central directory and
+    end records. Only descriptors and the central directory depend on CRCs;
+    a CRC missing from the member is computed while the member is streamed
+    in full, or by reading the file when a range starts past its data.
+    Newly computed CRCs are kept in ``computed_crcs`` (keyed by path) and
+    each is passed to ``on_crc(path, crc)`` as soon as it's known, so the
+    caller can persist them even if the download is cut short.
+    """
+
+    HEADER, DATA, DESCRIPTOR, CENTRAL, END = range(5)
+
+    def __init__(self, members: Iterable[ZipMember], on_crc: Optional[Callable[[str, int], None]] = None):
+        self.members = list(members)
+        self.names = [m.arcname.encode('utf-8') for m in self.members]
+        self.computed_crcs: Dict[str, int] = {}
+        self.on_crc = on_crc
+        self._headers = []
+        self._offsets = []
+        self._segments = []  # (start, length, kind, member index)
+        offset = 0
+        for i, member in enumerate(self.members):
+            header = _local_header(member, self.names[i])
+            descriptor_length = 24 if member.size >= ZIP64_LIMIT else 16
+            self._headers.append(header)
+            self._offsets.append(offset)
+            for kind, length in ((self.HEADER, len(header)), (self.DATA, member.size), (self.DESCRIPTOR, descriptor_length)):
+                if length:
+                    self._segments.append((offset, length, kind, i))
+                offset += length
+        self.cd_offset = offset
+        self.cd_size = sum(
+            len(_central_header(m, self.names[i], 0, self._offsets[i])) for i, m in enumerate(self.members)
+        )
+        self._end = _end_records(len(self.members), self.cd_offset, self.cd_size)
+        if self.cd_size:
+            self._segments.append((self.cd_offset, self.cd_size, self.CENTRAL, None))
+        self._segments.append((self.cd_offset + self.cd_size, len(self._end), self.END, None))
+        self._starts = [segment[0] for segment in self._segments]
+        self.size = self.cd_offset + self.cd_size + len(self._end)
+
+    def _crc(self, i: int) -> int:
+        member = self.members[i]
+        if member.crc32 is not None:
+            return member.crc32
+        if member.path not in self.computed_crcs:
+            self._computed(member.path, file_crc32(member.path))
+        return self.computed_crcs[member.path]
+
+    def _computed(self, path: str, crc: int):
+        self.computed_crcs[path] = crc
+        if self.on_crc:
+            self.on_crc(path, crc)
+
+    def _central_directory(self) -> bytes:
+        return b''.join(
+            _central_header(m, self.names[i], self._crc(i), self._offsets[i]) for i, m in enumerate(self.members)
+        )
+
+    def _read_data(self, i: int, skip: int, length: int, chunk_size: int) -> Iterator[bytes]:
+        member = self.members[i]
+        # Reading a member from its first byte to its last lets us compute a missing CRC for free
+        track_crc = member.crc32 is None and skip == 0 and length == member.size
+        crc = 0
+        remaining = length
+        with open(member.path, 'rb') as f:
+            f.seek(skip)
+            while remaining:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise IOError(f"{member.path} is shorter than expected")
+                if track_crc:
+                    crc = zlib.crc32(chunk, crc)
+                remaining -= len(chunk)
+                yield chunk
+        if track_crc and member.path not in self.computed_crcs:
+            self._computed(member.path, crc)
+
+    def iter_range(self, start: int = 0, stop: Optional[int] = None, chunk_size: int = ZIP_CHUNK_SIZE) -> Iterator[bytes]:
+        """Yield archive bytes ``[start, stop)``. Plain generator doing blocking reads."""
+        stop = self.size if stop is None else min(stop, self.size)
+        index = max(0, bisect.bisect_right(self._starts, start) - 1)
+        for seg_start, length, kind, i in self._segments[index:]:
+            if seg_start >= stop:
+                break
+            skip = max(0, start - seg_start)
+            take = min(length, stop - seg_start) - skip
+            if take <= 0:
+                continue
+            if kind == self.DATA:
+                yield from self._read_data(i, skip, take, chunk_size)
+                continue
+            if kind == self.HEADER:
+                data = self._headers[i]
+            elif kind == self.DESCRIPTOR:
+                data = _data_descriptor(self.members[i], self._crc(i))
+            elif kind == self.CENTRAL:
+                data = self._central_directory()
+            else:
+                data = self._end
+            yield data[skip:skip + take]
+
+
+def stream_zip(members: Iterable[ZipMember], chunk_size: int = ZIP_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield a complete ZIP archive of ``members``, reading each file in ``chunk_size`` pieces."""
+    return ZipLayout(members).iter_range(0, None, chunk_size)
+
+
+def unique_arcnames(names: Iterable[str]) -> List[str]:
+    """Rename duplicates to 'name (1).ext', 'name (2).ext'... (case-insensitive, like most unzippers)."""
+    seen = set()
+    result = []
+    for name in names:
+        candidate = name
+        stem, dot, ext = name.rpartition('.')
+        if not stem or '/' in ext:
+            stem, dot, ext = name, '', ''
+        n = 1
+        while candidate.casefold() in seen:
+            candidate = f"{stem} ({n}){dot}{ext}"
+            n += 1
+        seen.add(candidate.casefold())
+        result.append(candidate)
+    return result
+
+
+def members_from_paths(entries: Iterable[tuple]) -> List[ZipMember]:
+    """Build members from ``(path, arcname, crc32)`` entries, skipping files missing on disk."""
+    members = []
+    for path, arcname, crc in entries:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        members.append(ZipMember(str(path), arcname, st.st_size, st.st_mtime, crc))
+    return members
@@ -0,0 +1,233 @@
+"""
+Image derivative generation (thumbnails, previews, lightbox display images).
+
+Decoding and resizing full-size camera files is CPU bound, so it runs in a
+process pool instead of on the API event loop. Everything submitted to the
+pool is a plain module-level function so it can be pickled; keep this module
+free of any server/database imports so worker processes start quickly.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from PIL import ExifTags, Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_WORKERS = int(os.environ.get('DERIVATIVE_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+DERIVATIVE_QUEUE_SIZE = int(os.environ.get('DERIVATIVE_QUEUE_SIZE', DERIVATIVE_WORKERS * 4))
+
+# Output formats: JPEG is always written; the others are extra, smaller copies for browsers that accept them
+FORMAT_EXTENSIONS = {'jpeg': 'jpg', 'webp': 'webp', 'avif': 'avif'}
+FORMAT_MEDIA_TYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp', 'avif': 'image/avif'}
+
+def encoder_available(fmt: str) -> bool:
+    """Whether this Pillow build can write ``fmt`` (AVIF needs Pillow 11.2+ built with libavif)."""
+    if fmt == 'jpeg':
+        return True
+    try:
+        return features.check_module(fmt)
+    except ValueError:  # Pillow doesn't know the format at all
+        return False
+
+def derivative_filename(file_id: str, fmt: str = 'jpeg') -> str:
+    return f"{file_id}.{FORMAT_EXTENSIONS[fmt]}"
+
+class DerivativeSpec(NamedTuple):
+    """One output size: written to ``directory/<file_id>.<ext>`` for each of ``formats``,
+    fitting in max_size x max_size.
+
+    With ``exact_width`` the image is instead scaled to exactly max_size wide
+    (a srcset rung), and skipped when the original is narrower than that.
+    """
+    name: str
+    directory: str
+    max_size: int
+    quality: int
+    progressive: bool = False  # worth it for large images: they render coarse-to-fine while loading
+    formats: Tuple[str, ...] = ('jpeg',)
+    exact_width: bool = False
+
+class RenderResult(NamedTuple):
+    seconds: float
+    sizes: Dict[str, Tuple[int, int]]  # (width, height) of each spec written, by name
+
+def target_size(size: Tuple[int, int], spec: DerivativeSpec) -> Optional[Tuple[int, int]]:
+    """The (width, height) ``spec`` makes of an image ``size``, or None if it isn't written. Never upscales."""
+    width, height = size
+    if spec.exact_width:
+        if width < spec.max_size:
+            return None
+        scale = spec.max_size / width
+    else:
+        scale = min(1.0, spec.max_size / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+# ==================== WORKER FUNCTIONS (run in child processes) ====================
+
+def render_derivatives(source: str, file_id: str, specs: List[DerivativeSpec]) -> RenderResult:
+    """Decode ``source`` once and write every derivative in ``specs``.
+
+    JPEGs are decoded with ``draft()`` so libjpeg scales by 1/2, 1/4 or 1/8
+    during decoding when the largest target allows it, and each smaller size
+    is resized from the previous (already small) result rather than from the
+    full-resolution original.
+
+    Outputs are rotated upright per the EXIF Orientation tag (which isn't
+    copied to them), so sizes are always of the image as it's viewed.
+    """
+    started = time.perf_counter()
+    sizes = {}
+    with Image.open(source) as img:
+        orientation = img.getexif().get(ExifTags.Base.Orientation, 1)
+        rotated = orientation in (5, 6, 7, 8)  # stored on its side: width and height swap
+        upright = img.size[::-1] if rotated else img.size
+        targets = [(spec, target_size(upright, spec)) for spec in specs]
+        # Every target keeps the original's aspect ratio, so widest first is largest first
+        targets = sorted([t for t in targets if t[1]], key=lambda t: t[1][0], reverse=True)
+        if not targets:
+            return RenderResult(time.perf_counter() - started, sizes)
+        if img.format == 'JPEG':
+            largest = targets[0][1]
+            img.draft('RGB', largest[::-1] if rotated else largest)
+        current = ImageOps.exif_transpose(img) if orientation != 1 else img
+        if current.mode in ('RGBA', 'P'):
+            current = current.convert('RGB')
+        for spec, size in targets:
+            if current.size != size:
+                current = current.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+            for fmt in spec.formats:
+                save_derivative(current, os.path.join(spec.directory, derivative_filename(file_id, fmt)), fmt, spec)
+            sizes[spec.name] = size
+    return RenderResult(time.perf_counter() - started, sizes)
+
+def save_derivative(img: Image.Image, path: str, fmt: str, spec: DerivativeSpec):
+    if fmt == 'jpeg':
+        img.save(path, 'JPEG', quality=spec.quality, progressive=spec.progressive, optimize=spec.progressive)
+        return
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')  # e.g. CMYK JPEGs, which WebP/AVIF can't hold
+    if fmt == 'webp':
+        img.save(path, 'WEBP', quality=spec.quality, method=4)
+    elif fmt == 'avif':
+        img.save(path, 'AVIF', quality=spec.quality, speed=8)
+    else:
+        raise ValueError(f"Unsupported derivative format {fmt}")
+
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003
+EXIF_DATETIME = 0x0132
+
+def read_capture_time(source: str) -> Optional[str]:
+    """The EXIF capture time of an image as an ISO string (camera local time), or None.
+
+    Only the file's headers are parsed, so this is cheap enough to call inline.
+    """
+    try:
+        with Image.open(source) as img:
+            exif = img.getexif()
+            value = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+        return datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S').isoformat()
+    except Exception:
+        return None
+
+# ==================== ENGINE ====================
+
+class DerivativeEngine:
+    """Runs derivative jobs in a bounded process pool and keeps timing stats.
+
+    At most ``queue_size`` jobs are handed to the pool at once; further callers
+    wait for a free slot, so a bulk upload applies backpressure instead of
+    piling unbounded work (and open file handles) into the executor.
+    """
+
+    def __init__(self, max_workers: int = DERIVATIVE_WORKERS, queue_size: int = DERIVATIVE_QUEUE_SIZE):
+        self.max_workers = max(1, max_workers)
+        self.queue_size = max(self.max_workers, queue_size)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_run_seconds = 0.0
+        self.total_wait_seconds = 0.0
+        self.last_run_seconds = 0.0
+        self.max_run_seconds = 0.0
+
+    def start(self):
+        if self._executor is None:
+            # spawn, not fork: the API process has Mongo and event loop threads running
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+            logger.info(f"Derivative engine started with {self.max_workers} workers")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn, *args):
+        """Run ``fn(*args)`` in the pool and return its result, which must have a ``seconds``
+        field holding the job's run time (like RenderResult)."""
+        self.start()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.queue_size)
+        loop = asyncio.get_running_loop()
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.submitted += 1
+        executor = self._executor
+        try:
+            result = await loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory on a corrupt file); replace the pool once
+            self.failed += 1
+            if self._executor is executor:
+                logger.error("Derivative worker pool crashed, restarting it")
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self.start()
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.submitted -= 1
+            self._slots.release()
+        total_seconds = time.perf_counter() - queued_at
+        run_seconds = result.seconds
+        self.completed += 1
+        self.last_run_seconds = run_seconds
+        self.max_run_seconds = max(self.max_run_seconds, run_seconds)
+        self.total_run_seconds += run_seconds
+        self.total_wait_seconds += max(0.0, total_seconds - run_seconds)
+        return result
+
+    def stats(self) -> dict:
+        """Queue depth and per-job timing, for the admin stats endpoint."""
+        done = self.completed or 1
+        return {
+            'workers': self.max_workers,
+            'queue_size': self.queue_size,
+            'queue_depth': self.waiting + max(0, self.submitted - self.max_workers),
+            'in_progress': min(self.submitted, self.max_workers),
+            'completed': self.completed,
+            'failed': self.failed,
+            'avg_run_ms': round(self.total_run_seconds / done * 1000, 1),
+            'avg_wait_ms': round(self.total_wait_seconds / done * 1000, 1),
+            'last_run_ms': round(self.last_run_seconds * 1000, 1),
+            'max_run_ms': round(self.max_run_seconds * 1000, 1),
+        }
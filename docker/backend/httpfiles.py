@@ -0,0 +1,241 @@
+"""
+Range-aware, conditional file responses.
+
+Starlette's FileResponse (as pinned) always sends the whole file, so a
+seek in a long video restarts the transfer and iOS Safari refuses to play
+videos whose server ignores Range. file_response answers:
+
+- If-None-Match / If-Modified-Since with 304, from a stat() alone;
+- Range with 206 Partial Content, one range as a plain body and several
+  as multipart/byteranges;
+- If-Range by sending the whole file when the validator no longer matches.
+
+Files are read in large blocks aligned to READ_SIZE, so a range starting
+mid-block costs one short read and every read after it is a full block.
+
+Behind nginx, accel_redirect_response hands the bytes to nginx instead
+(X-Accel-Redirect): it then does ranges, validators and sendfile itself.
+"""
+import mimetypes
+import os
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Iterator, List, Mapping, Optional, Tuple
+
+from starlette.exceptions import HTTPException
+from starlette.responses import Response, StreamingResponse
+
+READ_SIZE = 1024 * 1024  # a multiple of every common filesystem block size
+MAX_RANGES = 16  # more than this (usually a scan for abuse) gets the whole body, which RFC 9110 allows
+
+
+def file_etag(st: os.stat_result) -> str:
+    # Stored files are only ever written whole, so mtime and size identify the content
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def parse_ranges(range_header: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """Parse a 'bytes=' Range header into sorted, merged ``[start, stop)`` pairs.
+
+    None means send the whole body: no header, another unit, a malformed
+    spec or too many ranges. Raises 416 when no range overlaps the body.
+    """
+    if not range_header or not range_header.startswith('bytes='):
+        return None
+    ranges = []
+    for spec in range_header[6:].split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+        first, dash, last = spec.partition('-')
+        if not dash:
+            return None
+        try:
+            if first:
+                start, stop = int(first), size
+                if last:
+                    stop = int(last) + 1
+                    if stop <= start:
+                        return None
+            else:
+                start, stop = max(0, size - int(last)), size
+        except ValueError:
+            return None
+        if start < size and stop > start:
+            ranges.append((start, min(stop, size)))
+    if not ranges:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={'Content-Range': f'bytes */{size}'})
+    if len(ranges) > MAX_RANGES:
+        return None
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, stop in ranges[1:]:
+        if start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Like parse_ranges for bodies that can only be served one range at a time;
+    several ranges get the whole body."""
+    ranges = parse_ranges(range_header, size)
+    if ranges is None or len(ranges) > 1:
+        return None
+    return ranges[0]
+
+
+def if_range_matches(headers: Mapping[str, str], etag: str, last_modified: Optional[str] = None) -> bool:
+    """True when Range should be honoured: no If-Range, or it names the current representation."""
+    if_range = headers.get('if-range')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    return last_modified is not None and if_range == last_modified
+
+
+def is_not_modified(headers: Mapping[str, str], etag: str, mtime: float) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since (the former wins when both are sent)."""
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags
+    if_modified_since = headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def accepted_media_types(accept: Optional[str]) -> set:
+    """Media types an Accept header names explicitly with a non-zero q.
+
+    Wildcards are left out on purpose: every browser sends */*, so only an
+    explicit image/webp or image/avif says a newer format is understood.
+    """
+    accepted = set()
+    for item in (accept or '').split(','):
+        media_type, *params = [part.strip() for part in item.split(';')]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if media_type and '*' not in media_type and q > 0:
+            accepted.add(media_type.lower())
+    return accepted
+
+
+def iter_file_range(path: str, start: int, stop: int, read_size: int = READ_SIZE) -> Iterator[bytes]:
+    """Yield bytes ``[start, stop)`` of ``path``. Plain generator doing blocking reads."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        position = start
+        while position < stop:
+            # Read up to the next block boundary, so later reads stay aligned
+            chunk = f.read(min(read_size - position % read_size, stop - position))
+            if not chunk:
+                raise IOError(f"{path} is shorter than expected")
+            position += len(chunk)
+            yield chunk
+
+
+def _iter_multipart(path: str, parts: List[Tuple[bytes, int, int]], boundary: str, read_size: int) -> Iterator[bytes]:
+    for head, start, stop in parts:
+        yield head
+        yield from iter_file_range(path, start, stop, read_size)
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+
+def file_response(
+    headers: Mapping[str, str],
+    path,
+    media_type: Optional[str] = None,
+    filename: Optional[str] = None,
+    content_disposition: Optional[str] = None,
+    extra_headers: Optional[Mapping[str, str]] = None,
+    stat_result: Optional[os.stat_result] = None,
+    read_size: int = READ_SIZE,
+) -> Response:
+    """Serve ``path`` honouring conditional and Range request ``headers``.
+
+    ``media_type`` defaults to a guess from ``filename`` (or the path).
+    Raises 404 if the file is missing and 416 for unsatisfiable ranges.
+    """
+    path = str(path)
+    if stat_result is None:
+        try:
+            stat_result = os.stat(path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found")
+    size = stat_result.st_size
+    etag = file_etag(stat_result)
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    if media_type is None:
+        media_type = mimetypes.guess_type(filename or path)[0] or 'application/octet-stream'
+
+    response_headers = {'Accept-Ranges': 'bytes', 'ETag': etag, 'Last-Modified': last_modified}
+    response_headers.update(extra_headers or {})
+    if is_not_modified(headers, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=response_headers)
+    if content_disposition:
+        response_headers['Content-Disposition'] = content_disposition
+
+    ranges = parse_ranges(headers.get('range'), size) if if_range_matches(headers, etag, last_modified) else None
+    if not ranges:
+        response_headers['Content-Length'] = str(size)
+        body = iter_file_range(path, 0, size, read_size)
+        return StreamingResponse(body, media_type=media_type, headers=response_headers)
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        response_headers['Content-Length'] = str(stop - start)
+        response_headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        body = iter_file_range(path, start, stop, read_size)
+        return StreamingResponse(body, status_code=206, media_type=media_type, headers=response_headers)
+
+    boundary = uuid.uuid4().hex
+    parts = [
+        (
+            f'--{boundary}\r\nContent-Type: {media_type}\r\nContent-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n'.encode(),
+            start, stop
+        )
+        for start, stop in ranges
+    ]
+    length = sum(len(head) + (stop - start) + 2 for head, start, stop in parts) + len(boundary) + 6
+    response_headers['Content-Length'] = str(length)
+    return StreamingResponse(
+        _iter_multipart(path, parts, boundary, read_size),
+        status_code=206,
+        media_type=f'multipart/byteranges; boundary={boundary}',
+        headers=response_headers
+    )
+
+
+def accel_redirect_response(
+    uri: str,
+    media_type: Optional[str] = None,
+    filename: Optional[str] = None,
+    content_disposition: Optional[str] = None,
+    extra_headers: Optional[Mapping[str, str]] = None,
+) -> Response:
+    """Tell nginx to serve the file at internal location ``uri``.
+
+    nginx keeps Content-Type, Content-Disposition, Cache-Control and
+    Expires from this response and adds its own length and validators.
+    """
+    if media_type is None:
+        media_type = mimetypes.guess_type(filename or uri)[0] or 'application/octet-stream'
+    headers = {'X-Accel-Redirect': uri}
+    headers.update(extra_headers or {})
+    if content_disposition:
+        headers['Content-Disposition'] = content_disposition
+    return Response(media_type=media_type, headers=headers)
@@ -0,0 +1,159 @@
+"""
+Maintenance commands for the gallery database.
+
+Usage (from the backend directory, with the same environment as the API):
+
+    python manage.py ensure-indexes   # create any missing indexes
+    python manage.py explain          # report hot queries that would scan a whole collection
+    python manage.py reconcile-counters   # recompute folder file/byte counters from scratch
+    python manage.py reconcile-paths      # recompute folder ancestors from parent links
+    python manage.py backfill-activity-dates   # add logged_at to old activity logs so they expire
+    python manage.py backfill-activity-tokens  # add search_tokens to old activity logs so search finds them
+    python manage.py rebuild-activity-rollups  # recount activity_daily from the retained logs
+    python manage.py backfill-capture-times    # add captured_at (EXIF, else upload time) to old files
+    python manage.py backfill-crcs             # add crc32 to old files so ZIP downloads resume without rereading them
+    python manage.py queue-missing-derivatives # render sizes (e.g. display) that old images don't have yet
+    python manage.py bench-folder-listing   # count Mongo round trips per folder listing
+"""
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+import server
+from server import client, backfill_activity_log_dates, backfill_activity_log_tokens, backfill_capture_times, backfill_file_crcs, ensure_indexes, find_collection_scans, queue_missing_derivatives, rebuild_activity_rollups, reconcile_folder_counters, reconcile_folder_paths
+
+
+async def cmd_ensure_indexes(args):
+    created = await ensure_indexes()
+    print(f"Created {len(created)} index(es)" + (": " + ", ".join(created) if created else ""))
+
+
+async def cmd_explain(args):
+    scans = await find_collection_scans()
+    if not scans:
+        print("No collection scans found")
+    for scan in scans:
+        print(f"COLLSCAN {scan}")
+
+
+async def cmd_reconcile_counters(args):
+    updated = await reconcile_folder_counters()
+    print(f"Corrected counters on {updated} folder(s)")
+
+
+async def cmd_reconcile_paths(args):
+    updated = await reconcile_folder_paths()
+    print(f"Corrected ancestors on {updated} folder(s)")
+
+
+async def cmd_backfill_activity_dates(args):
+    updated = await backfill_activity_log_dates()
+    print(f"Set logged_at on {updated} activity log entries")
+
+
+async def cmd_backfill_activity_tokens(args):
+    updated = await backfill_activity_log_tokens()
+    print(f"Set search_tokens on {updated} activity log entries")
+
+
+async def cmd_rebuild_activity_rollups(args):
+    rows = await rebuild_activity_rollups()
+    print(f"Rebuilt {rows} activity rollup row(s)")
+
+
+async def cmd_backfill_capture_times(args):
+    updated = await backfill_capture_times()
+    print(f"Set captured_at on {updated} file(s)")
+
+
+async def cmd_backfill_crcs(args):
+    updated = await backfill_file_crcs()
+    print(f"Set crc32 on {updated} file(s)")
+
+
+async def cmd_queue_missing_derivatives(args):
+    queued = await queue_missing_derivatives()
+    print(f"Queued derivatives for {queued} image(s); the job worker renders them")
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts commands sent to MongoDB, i.e. round trips"""
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+async def cmd_bench_folder_listing(args):
+    """Time folder listings against a scratch database at growing folder counts"""
+    counter = CommandCounter()
+    bench_client = AsyncIOMotorClient(os.environ['MONGO_URL'], event_listeners=[counter])
+    bench_db_name = f"{os.environ['DB_NAME']}_bench"
+    server.db = bench_client[bench_db_name]
+    try:
+        print(f"{'folders':>8} {'round trips':>12} {'ms':>8}")
+        for n in (10, 100, 300, 1000):
+            await bench_client.drop_database(bench_db_name)
+            now = datetime.now(timezone.utc).isoformat()
+            root_id = str(uuid.uuid4())
+            folders = [{'id': root_id, 'name': 'root', 'parent_id': None, 'created_at': now}]
+            folders += [{'id': str(uuid.uuid4()), 'name': f"Couple {i}", 'parent_id': root_id, 'created_at': now} for i in range(n)]
+            await server.db.folders.insert_many(folders)
+            await server.db.files.insert_many([
+                {'id': str(uuid.uuid4()), 'name': f"{i}.jpg", 'folder_id': f['id'], 'file_type': 'image', 'size': 1, 'created_at': now}
+                for f in folders[1:] for i in range(3)
+            ])
+            await server.ensure_indexes()
+            await server.reconcile_folder_counters()
+            counter.count = 0
+            started = time.perf_counter()
+            listing = await server.get_folders(parent_id=root_id, admin={})
+            elapsed = (time.perf_counter() - started) * 1000
+            assert len(listing) == n and all(f.file_count == 3 for f in listing)
+            print(f"{n:>8} {counter.count:>12} {elapsed:>8.1f}")
+    finally:
+        await bench_client.drop_database(bench_db_name)
+        bench_client.close()
+
+
+COMMANDS = {
+    'ensure-indexes': cmd_ensure_indexes,
+    'explain': cmd_explain,
+    'reconcile-counters': cmd_reconcile_counters,
+    'reconcile-paths': cmd_reconcile_paths,
+    'backfill-activity-dates': cmd_backfill_activity_dates,
+    'backfill-activity-tokens': cmd_backfill_activity_tokens,
+    'rebuild-activity-rollups': cmd_rebuild_activity_rollups,
+    'backfill-capture-times': cmd_backfill_capture_times,
+    'backfill-crcs': cmd_backfill_crcs,
+    'queue-missing-derivatives': cmd_queue_missing_derivatives,
+    'bench-folder-listing': cmd_bench_folder_listing,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gallery maintenance commands")
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    args = parser.parse_args()
+    try:
+        asyncio.run(COMMANDS[args.command](args))
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
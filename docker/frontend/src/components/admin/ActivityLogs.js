@@ -46,6 +46,7 @@ export function ActivityLogs() {
   const { token } = useAuth();
   const [logs, setLogs] = useState([]);
   const [total, setTotal] = useState(0);
+  const [totalIsEstimate, setTotalIsEstimate] = useState(false);
   const [page, setPage] = useState(0);
   const [loading, setLoading] = useState(true);
   const [showClearConfirm, setShowClearConfirm] = useState(false);
@@ -74,6 +75,7 @@ export function ActivityLogs() {
         const data = await res.json();
         setLogs(data.logs);
         setTotal(data.total);
+        setTotalIsEstimate(Boolean(data.total_is_estimate));
       }
     } catch (e) {
       toast.error('Failed to fetch activity logs');
@@ -244,7 +246,7 @@ export function ActivityLogs() {
             {totalPages > 1 && (
               <div className="flex items-center justify-between p-4 border-t border-[#333]">
                 <span className="text-gray-400 text-sm">
-                  Showing {page * limit + 1} - {Math.min((page + 1) * limit, total)} of {total}
+                  Showing {page * limit + 1} - {Math.min((page + 1) * limit, total)} of {total}{totalIsEstimate ? '+' : ''}
                 </span>
                 <div className="flex gap-2">
                   <Button
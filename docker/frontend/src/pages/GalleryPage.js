@@ -9,9 +9,13 @@ import {
 } from 'lucide-react';
 import { Button } from '@/components/ui/button';
 import { PrintOrderCart, PrintProductSelector } from '@/components/PrintOrderCart';
+import { usePendingDerivatives } from '@/hooks/use-pending-derivatives';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+// Files arrive in pages; more are fetched as the guest scrolls towards the end
+const FILES_PAGE_SIZE = 60;
+const FILES_PAGE_MAX = 1000; // the most the API returns per page
 const LOGO_URL = "https://customer-assets.emergentagent.com/job_6e5757e7-0b45-46c5-8f03-c1858510b49f/artifacts/fq31etoy_cropped-new-logo-2022-black-with-bevel-1.png";
 
 // Extract couple names from folder name (e.g., "Lisa & Tara 21.01.26" → "Lisa & Tara")
@@ -26,6 +30,19 @@ const extractCoupleNames = (folderName) => {
   return withoutDate || folderName;
 };
 
+// srcset attribute from the widths the backend rendered (empty until they're ready)
+const srcSetFor = (file) =>
+  file.srcset?.length ? file.srcset.map((rung) => `${BACKEND_URL}${rung.url} ${rung.width}w`).join(', ') : undefined;
+
+// The lightbox fits images in 90vw x 90vh, so tall images are limited by height
+const lightboxImageSizes = (file) => {
+  const rung = file.srcset?.[0];
+  return rung ? `min(90vw, ${Math.ceil(90 * rung.width / rung.height)}vh)` : undefined;
+};
+
+// Rendered width of a .gallery-grid cell: 3 columns in the 1280px container, then 2, then 1 on phones
+const GRID_IMAGE_SIZES = '(min-width: 1280px) 400px, (min-width: 1136px) 33vw, (min-width: 616px) 50vw, 100vw';
+
 export default function GalleryPage() {
   const { token } = useParams();
   const [searchParams, setSearchParams] = useSearchParams();
@@ -34,6 +51,11 @@ export default function GalleryPage() {
   const [gallery, setGallery] = useState(null);
   const [folders, setFolders] = useState([]);
   const [files, setFiles] = useState([]);
+  const [folderTotals, setFolderTotals] = useState(null); // counts for the whole folder, not just loaded pages
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const loadMoreRef = useRef(null);
+  const filesRequestRef = useRef(0);
   const [path, setPath] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
@@ -61,8 +83,7 @@ export default function GalleryPage() {
   const [showBackToTop, setShowBackToTop] = useState(false);
 
   useEffect(() => {
-    fetchGallery();
-    fetchPrintProducts();
+    updateCartCount();
     
     // Show back to top button when scrolled down
     const handleScroll = () => {
@@ -77,10 +98,14 @@ export default function GalleryPage() {
   };
 
   useEffect(() => {
-    if (gallery) {
-      fetchContent();
-    }
-  }, [gallery, currentFolderId]);
+    fetchContent();
+  }, [token, currentFolderId]);
+
+  usePendingDerivatives(files, setFiles, (ids) => {
+    const params = new URLSearchParams({ ids });
+    if (currentFolderId) params.set('folder_id', currentFolderId);
+    return fetch(`${API}/gallery/${token}/files/status?${params}`);
+  });
 
   const handleUpload = async (e) => {
     const files = e.target.files;
@@ -117,33 +142,6 @@ export default function GalleryPage() {
     e.target.value = '';
   };
 
-  const fetchGallery = async () => {
-    try {
-      const res = await fetch(`${API}/gallery/${token}`);
-      if (!res.ok) throw new Error('Gallery not found');
-      const data = await res.json();
-      setGallery(data);
-    } catch (e) {
-      setError(e.message);
-    } finally {
-      setLoading(false);
-    }
-  };
-
-  const fetchPrintProducts = async () => {
-    try {
-      const res = await fetch(`${API}/print-products?active_only=true`);
-      if (res.ok) {
-        const data = await res.json();
-        setPrintProducts(data.filter(p => p.price > 0));
-      }
-    } catch (e) {
-      console.error('Failed to fetch print products');
-    }
-    // Update cart count from localStorage
-    updateCartCount();
-  };
-
   const updateCartCount = () => {
     const saved = localStorage.getItem(`print_cart_${token}`);
     if (saved) {
@@ -194,37 +192,105 @@ export default function GalleryPage() {
     toast.success(`Added ${product.name} to cart`);
   };
 
+  // Gallery details, breadcrumbs, subfolders, the first page of files and print
+  // products all come from one request
   const fetchContent = async () => {
+    const request = ++filesRequestRef.current;
+    const params = new URLSearchParams();
+    if (currentFolderId) params.set('folder_id', currentFolderId);
+    if (!gallery) params.set('log_view', 'true');
     try {
-      const foldersUrl = currentFolderId 
-        ? `${API}/gallery/${token}/folders?parent_id=${currentFolderId}`
-        : `${API}/gallery/${token}/folders`;
-      const foldersRes = await fetch(foldersUrl);
-      if (foldersRes.ok) {
-        setFolders(await foldersRes.json());
+      const res = await fetch(`${API}/gallery/${token}/view?${params}`);
+      if (filesRequestRef.current !== request) return;
+      if (!res.ok) {
+        if (currentFolderId) {
+          // Folder was removed or isn't part of this share - show the gallery root instead
+          setSearchParams({});
+          return;
+        }
+        throw new Error('Gallery not found');
       }
-
-      const filesUrl = currentFolderId
-        ? `${API}/gallery/${token}/files?folder_id=${currentFolderId}`
-        : `${API}/gallery/${token}/files`;
-      const filesRes = await fetch(filesUrl);
-      if (filesRes.ok) {
-        setFiles(await filesRes.json());
+      const data = await res.json();
+      if (filesRequestRef.current !== request) return;
+      setGallery(data.gallery);
+      setFolders(data.folders);
+      setFolderTotals(data.folder);
+      setFiles(data.files);
+      setNextCursor(data.next_cursor);
+      setPath(data.path);
+      setPrintProducts(data.print_products.filter(p => p.price > 0));
+      setLoading(false);
+    } catch (e) {
+      console.error('Failed to fetch content:', e);
+      if (!gallery) {
+        setError(e.message);
+        setLoading(false);
       }
+    }
+  };
 
-      if (currentFolderId) {
-        const pathRes = await fetch(`${API}/gallery/${token}/path?folder_id=${currentFolderId}`);
-        if (pathRes.ok) {
-          setPath(await pathRes.json());
-        }
-      } else {
-        setPath([]);
+  const filesPageUrl = (cursor, limit = FILES_PAGE_SIZE) => {
+    const params = new URLSearchParams({ limit });
+    if (currentFolderId) params.set('folder_id', currentFolderId);
+    if (cursor) params.set('cursor', cursor);
+    return `${API}/gallery/${token}/files?${params}`;
+  };
+
+  const loadMoreFiles = async () => {
+    if (!nextCursor || loadingMore) return;
+    const request = filesRequestRef.current;
+    setLoadingMore(true);
+    try {
+      const res = await fetch(filesPageUrl(nextCursor));
+      // Drop the page if the listing was reloaded (e.g. another folder) meanwhile
+      if (res.ok && filesRequestRef.current === request) {
+        const data = await res.json();
+        setFiles(prev => [...prev, ...data.files]);
+        setNextCursor(data.next_cursor);
       }
     } catch (e) {
-      console.error('Failed to fetch content:', e);
+      console.error('Failed to fetch more files:', e);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  // Fetch every page not loaded yet, for actions on the whole folder. Returns all files,
+  // or null if the listing was reloaded meanwhile.
+  const loadAllFiles = async () => {
+    const request = filesRequestRef.current;
+    let all = files;
+    let cursor = nextCursor;
+    if (!cursor) return all;
+    setLoadingMore(true);
+    try {
+      while (cursor) {
+        const res = await fetch(filesPageUrl(cursor, FILES_PAGE_MAX));
+        if (!res.ok) throw new Error('Failed to load photos');
+        const data = await res.json();
+        if (filesRequestRef.current !== request) return null;
+        all = [...all, ...data.files];
+        cursor = data.next_cursor;
+      }
+      setFiles(all);
+      setNextCursor(null);
+      return all;
+    } finally {
+      setLoadingMore(false);
     }
   };
 
+  useEffect(() => {
+    const sentinel = loadMoreRef.current;
+    if (!sentinel || !nextCursor) return;
+    const observer = new IntersectionObserver(
+      (entries) => { if (entries[0].isIntersecting) loadMoreFiles(); },
+      { rootMargin: '800px' }
+    );
+    observer.observe(sentinel);
+    return () => observer.disconnect();
+  }, [nextCursor, loadingMore, currentFolderId]);
+
   const navigateToFolder = (folderId) => {
     if (folderId) {
       setSearchParams({ folder: folderId });
@@ -248,12 +314,17 @@ export default function GalleryPage() {
     setSelectedFiles(newSelected);
   };
 
-  const selectAllFiles = () => {
-    const imageFiles = files.filter(f => f.file_type === 'image');
-    if (selectedFiles.size === imageFiles.length) {
+  const selectAllFiles = async () => {
+    if (selectedFiles.size === imageCount) {
       setSelectedFiles(new Set());
-    } else {
-      setSelectedFiles(new Set(imageFiles.map(f => f.id)));
+      return;
+    }
+    try {
+      const all = await loadAllFiles();
+      if (all) setSelectedFiles(new Set(all.filter(f => f.file_type === 'image').map(f => f.id)));
+    } catch (e) {
+      console.error('Failed to select all:', e);
+      toast.error('Failed to load all photos');
     }
   };
 
@@ -303,14 +374,13 @@ export default function GalleryPage() {
 
   // Download all files
   const downloadAllFiles = () => {
-    const imageFiles = files.filter(f => f.file_type === 'image');
-    if (imageFiles.length === 0) { toast.error('No photos to download'); return; }
+    if (imageCount === 0 && folders.length === 0) { toast.error('No photos to download'); return; }
     toast.info('Preparing ZIP download...');
-    // Use public ZIP endpoint
+    // Use public ZIP endpoint - one archive including all subfolders
     const folderId = currentFolderId || gallery?.folder_id;
     const url = folderId 
-      ? `${BACKEND_URL}/api/gallery/${token}/download-zip?folder_id=${folderId}`
-      : `${BACKEND_URL}/api/gallery/${token}/download-zip`;
+      ? `${BACKEND_URL}/api/gallery/${token}/download-zip?folder_id=${folderId}&recursive=true`
+      : `${BACKEND_URL}/api/gallery/${token}/download-zip?recursive=true`;
     window.location.href = url;
   };
 
@@ -328,6 +398,9 @@ export default function GalleryPage() {
 
   const imageFiles = files.filter(f => f.file_type === 'image');
   const videoFiles = files.filter(f => f.file_type === 'video');
+  // Files arrive a page at a time, so counts come from the folder's totals
+  const imageCount = folderTotals?.image_count ?? imageFiles.length;
+  const videoCount = folderTotals?.video_count ?? videoFiles.length;
 
   const openLightbox = (index) => {
     if (!selectionMode) {
@@ -341,6 +414,8 @@ export default function GalleryPage() {
   };
   
   const nextImage = () => {
+    // Keep the lightbox ahead of the grid: fetch the next page before reaching the end
+    if (lightboxIndex >= imageFiles.length - 5) loadMoreFiles();
     if (lightboxIndex < imageFiles.length - 1) {
       setLightboxIndex(lightboxIndex + 1);
     } else if (slideshowPlaying) {
@@ -562,7 +637,7 @@ export default function GalleryPage() {
         )}
 
         {/* Upload section when no images but can edit */}
-        {imageFiles.length === 0 && canEdit && (
+        {imageCount === 0 && canEdit && (
           <section className="mb-12">
             <div className="bg-[#ad946d]/10 border-2 border-dashed border-[#ad946d]/30 rounded-lg p-8 text-center">
               <Upload className="w-12 h-12 text-[#ad946d] mx-auto mb-4" />
@@ -590,12 +665,12 @@ export default function GalleryPage() {
         )}
 
         {/* Images */}
-        {imageFiles.length > 0 && (
+        {imageCount > 0 && (
           <section className="mb-12">
             <div className="flex flex-wrap items-center justify-between gap-4 mb-4">
               <h2 className="text-lg font-semibold text-gray-900 flex items-center gap-2">
                 <ImageIcon className="w-5 h-5 text-[#ad946d]" />
-                Photos ({imageFiles.length})
+                Photos ({imageCount})
               </h2>
               
               {/* Action Buttons */}
@@ -676,7 +751,7 @@ export default function GalleryPage() {
                       className="border-gray-300 text-gray-700 hover:bg-gray-100"
                       data-testid="select-all-btn"
                     >
-                      {selectedFiles.size === imageFiles.length ? (
+                      {selectedFiles.size === imageCount ? (
                         <>
                           <Square className="w-4 h-4 mr-1" />
                           Deselect All
@@ -684,7 +759,7 @@ export default function GalleryPage() {
                       ) : (
                         <>
                           <CheckSquare className="w-4 h-4 mr-1" />
-                          Select All ({imageFiles.length})
+                          Select All ({imageCount})
                         </>
                       )}
                     </Button>
@@ -745,18 +820,26 @@ export default function GalleryPage() {
                   key={file.id}
                   initial={{ opacity: 0, scale: 0.95 }}
                   animate={{ opacity: 1, scale: 1 }}
-                  transition={{ delay: index * 0.03 }}
+                  transition={{ delay: Math.min(index % FILES_PAGE_SIZE, 20) * 0.03 }}
                   className={`image-card cursor-pointer group relative ${
                     selectedFiles.has(file.id) ? 'ring-4 ring-[#ad946d]' : ''
                   }`}
                   onClick={() => selectionMode ? toggleSelectFile(file.id) : openLightbox(index)}
                   data-testid={`image-${file.id}`}
                 >
-                  <img
-                    src={`${BACKEND_URL}${file.thumbnail_url}`}
-                    alt={file.name}
-                    loading="lazy"
-                  />
+                  {file.derivative_status === 'pending' ? (
+                    <div className="w-full h-full flex items-center justify-center" data-testid={`pending-${file.id}`}>
+                      <ImageIcon className="w-8 h-8 text-gray-400 animate-pulse" />
+                    </div>
+                  ) : (
+                    <img
+                      src={`${BACKEND_URL}${file.thumbnail_url}`}
+                      srcSet={srcSetFor(file)}
+                      sizes={GRID_IMAGE_SIZES}
+                      alt={file.name}
+                      loading="lazy"
+                    />
+                  )}
                   
                   {/* Selection checkbox */}
                   {selectionMode && (
@@ -804,11 +887,11 @@ export default function GalleryPage() {
         )}
 
         {/* Videos */}
-        {videoFiles.length > 0 && (
+        {videoCount > 0 && (
           <section>
             <h2 className="text-lg font-semibold text-gray-900 mb-4 flex items-center gap-2">
               <Film className="w-5 h-5 text-[#ad946d]" />
-              Videos ({videoFiles.length})
+              Videos ({videoCount})
             </h2>
             <div className="grid grid-cols-1 md:grid-cols-2 gap-6">
               {videoFiles.map((file, index) => (
@@ -845,6 +928,13 @@ export default function GalleryPage() {
           </section>
         )}
 
+        {/* Loads the next page of files as it scrolls into view */}
+        {nextCursor && (
+          <div ref={loadMoreRef} className="py-8 text-center text-sm text-gray-400" data-testid="load-more-files">
+            {loadingMore ? 'Loading more photos...' : ''}
+          </div>
+        )}
+
         {/* Empty state */}
         {folders.length === 0 && files.length === 0 && (
           <div className="text-center py-20">
@@ -897,7 +987,9 @@ export default function GalleryPage() {
           >
             <div className="lightbox-content" onClick={(e) => e.stopPropagation()}>
               <img
-                src={`${BACKEND_URL}/api/files/${imageFiles[lightboxIndex].id}/download`}
+                src={`${BACKEND_URL}${imageFiles[lightboxIndex].display_url}`}
+                srcSet={srcSetFor(imageFiles[lightboxIndex])}
+                sizes={lightboxImageSizes(imageFiles[lightboxIndex])}
                 alt={imageFiles[lightboxIndex].name}
               />
             </div>
@@ -961,7 +1053,7 @@ export default function GalleryPage() {
                 <ChevronLeft className="w-6 h-6" />
               </button>
             )}
-            {(lightboxIndex < imageFiles.length - 1 || slideshowPlaying) && (
+            {(lightboxIndex < imageCount - 1 || slideshowPlaying) && (
               <button
                 onClick={(e) => { e.stopPropagation(); nextImage(); }}
                 className="absolute right-4 top-1/2 -translate-y-1/2 bg-white/10 hover:bg-white/20 text-white p-3 rounded-full backdrop-blur-sm transition-colors"
@@ -973,7 +1065,7 @@ export default function GalleryPage() {
 
             {/* Counter */}
             <div className="absolute bottom-4 left-1/2 -translate-x-1/2 bg-black/50 text-white px-4 py-2 rounded-full text-sm backdrop-blur-sm">
-              {lightboxIndex + 1} / {imageFiles.length}
+              {lightboxIndex + 1} / {imageCount}
             </div>
           </motion.div>
         )}
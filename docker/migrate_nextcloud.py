@@ -3,25 +3,27 @@
 Nextcloud to Couples Gallery Migration Script
 Copies folders and files from Nextcloud to the new gallery system.
 
+Runs next to the API (it imports server.py for the database and the folder/file
+bookkeeping), so folders get their lineage and counters as they are created and
+images are queued for the API's job worker to render thumbnails and previews.
+
 Usage: docker exec -it gallery-api python /app/migrate_nextcloud.py /source/weddings
 """
 
 import os
 import sys
-import shutil
 import uuid
+import zlib
 from datetime import datetime, timezone
 from pathlib import Path
-from motor.motor_asyncio import AsyncIOMotorClient
-from PIL import Image
 import asyncio
 
-# Configuration
-MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://mongodb:27017')
-DB_NAME = os.environ.get('DB_NAME', 'couples_gallery')
-FILES_DIR = Path(os.environ.get('FILES_DIR', '/app/files'))
-THUMBNAILS_DIR = Path('/app/data/thumbnails')
-PREVIEWS_DIR = Path('/app/data/previews')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from server import (
+    FILES_DIR, adjust_folder_counters, client, db, empty_folder_counters, enqueue_derivatives, folder_lineage, read_capture_time
+)
+
+COPY_CHUNK_SIZE = 1024 * 1024
 
 # Image extensions
 IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.heif', '.bmp', '.tiff'}
@@ -44,34 +46,29 @@ def get_file_type(filename):
         return 'video'
     return 'other'
 
-def generate_thumbnail(file_path: Path, file_id: str):
-    """Generate thumbnail for image files"""
-    try:
-        with Image.open(file_path) as img:
-            img.thumbnail((300, 300), Image.Resampling.LANCZOS)
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-            thumb_path = THUMBNAILS_DIR / f"{file_id}.jpg"
-            img.save(thumb_path, 'JPEG', quality=85)
-            return True
-    except Exception as e:
-        return False
+def copy_with_crc(source: Path, dest: Path) -> int:
+    """Copy source to dest, returning the CRC-32 that ZIP downloads need up front"""
+    crc = 0
+    with open(source, 'rb') as src, open(dest, 'wb') as dst:
+        while chunk := src.read(COPY_CHUNK_SIZE):
+            dst.write(chunk)
+            crc = zlib.crc32(chunk, crc)
+    os.utime(dest, (source.stat().st_atime, source.stat().st_mtime))
+    return crc
 
-def generate_preview(file_path: Path, file_id: str, max_size: int = 1500):
-    """Generate preview for image files"""
-    try:
-        with Image.open(file_path) as img:
-            ratio = min(max_size / img.width, max_size / img.height)
-            if ratio < 1:
-                new_size = (int(img.width * ratio), int(img.height * ratio))
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-            preview_path = PREVIEWS_DIR / f"{file_id}.jpg"
-            img.save(preview_path, 'JPEG', quality=90)
-            return True
-    except Exception as e:
-        return False
+async def create_folder(name: str, parent_id):
+    folder_id = str(uuid.uuid4())
+    await db.folders.insert_one({
+        'id': folder_id,
+        'name': name,
+        'parent_id': parent_id,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        **await folder_lineage(parent_id),
+        **empty_folder_counters()
+    })
+    if parent_id:
+        await adjust_folder_counters(parent_id, subfolders=1)
+    return folder_id
 
 async def migrate(source_path: str, dry_run: bool = False):
     """Main migration function"""
@@ -89,10 +86,6 @@ async def migrate(source_path: str, dry_run: bool = False):
     print(f"Mode: {'DRY RUN (no changes)' if dry_run else 'LIVE'}")
     print(f"{'='*60}\n")
     
-    # Connect to MongoDB
-    client = AsyncIOMotorClient(MONGO_URL)
-    db = client[DB_NAME]
-    
     # Get list of couple folders
     couple_folders = [f for f in source.iterdir() if f.is_dir()]
     print(f"Found {len(couple_folders)} couple folders to migrate\n")
@@ -110,17 +103,12 @@ async def migrate(source_path: str, dry_run: bool = False):
         # Create main couple folder
         couple_id = str(uuid.uuid4())
         if not dry_run:
-            await db.folders.insert_one({
-                'id': couple_id,
-                'name': couple_name,
-                'parent_id': None,
-                'created_at': datetime.now(timezone.utc).isoformat()
-            })
+            couple_id = await create_folder(couple_name, None)
         stats['folders_created'] += 1
         print(f"  ✓ Created folder: {couple_name}")
         
         # Process subfolders and files
-        await process_directory(db, couple_folder, couple_id, dry_run, indent=2)
+        await process_directory(couple_folder, couple_id, dry_run, indent=2)
     
     # Print summary
     print(f"\n{'='*60}")
@@ -140,14 +128,14 @@ async def migrate(source_path: str, dry_run: bool = False):
     
     client.close()
 
-async def process_directory(db, source_dir: Path, parent_id: str, dry_run: bool, indent: int = 0):
+async def process_directory(source_dir: Path, parent_id: str, dry_run: bool, indent: int = 0):
     """Process a directory - create subfolders and copy files"""
     prefix = "  " * indent
     
     # Process files in this directory
     files = [f for f in source_dir.iterdir() if f.is_file()]
     for file_path in files:
-        await copy_file(db, file_path, parent_id, dry_run, prefix)
+        await copy_file(file_path, parent_id, dry_run, prefix)
     
     # Process subdirectories
     subdirs = [d for d in source_dir.iterdir() if d.is_dir()]
@@ -157,19 +145,14 @@ async def process_directory(db, source_dir: Path, parent_id: str, dry_run: bool,
         # Create subfolder
         subfolder_id = str(uuid.uuid4())
         if not dry_run:
-            await db.folders.insert_one({
-                'id': subfolder_id,
-                'name': subdir_name,
-                'parent_id': parent_id,
-                'created_at': datetime.now(timezone.utc).isoformat()
-            })
+            subfolder_id = await create_folder(subdir_name, parent_id)
         stats['folders_created'] += 1
         print(f"{prefix}  ✓ Subfolder: {subdir_name}")
         
         # Recursively process
-        await process_directory(db, subdir, subfolder_id, dry_run, indent + 1)
+        await process_directory(subdir, subfolder_id, dry_run, indent + 1)
 
-async def copy_file(db, source_file: Path, folder_id: str, dry_run: bool, prefix: str):
+async def copy_file(source_file: Path, folder_id: str, dry_run: bool, prefix: str):
     """Copy a single file and register in database"""
     filename = source_file.name
     
@@ -189,23 +172,30 @@ async def copy_file(db, source_file: Path, folder_id: str, dry_run: bool, prefix
         
         if not dry_run:
             # Copy file
-            shutil.copy2(source_file, dest_path)
-            
-            # Generate thumbnails for images
-            if file_type == 'image':
-                generate_thumbnail(dest_path, file_id)
-                generate_preview(dest_path, file_id)
+            crc = await asyncio.to_thread(copy_with_crc, source_file, dest_path)
             
-            # Register in database
-            await db.files.insert_one({
+            # Register in database, the way an upload would
+            created_at = datetime.now(timezone.utc).isoformat()
+            captured_at = read_capture_time(str(dest_path)) if file_type == 'image' else None
+            file_doc = {
                 'id': file_id,
                 'name': filename,
                 'folder_id': folder_id,
                 'stored_name': stored_name,
                 'file_type': file_type,
                 'size': file_size,
-                'created_at': datetime.now(timezone.utc).isoformat()
-            })
+                'crc32': crc,
+                'created_at': created_at,
+                'captured_at': captured_at or created_at
+            }
+            if file_type == 'image':
+                file_doc['derivative_status'] = 'pending'
+            await db.files.insert_one(file_doc)
+            await adjust_folder_counters(folder_id, files=1, size=file_size)
+            
+            # Thumbnails, previews etc. are rendered by the API's job worker
+            if file_type == 'image':
+                await enqueue_derivatives(file_id)
         
         stats['files_copied'] += 1
         stats['bytes_copied'] += file_size
@@ -1,4 +1,4 @@
-import { useState, useEffect, useCallback } from 'react';
+import { useState, useEffect, useCallback, useRef } from 'react';
 import { useNavigate, useSearchParams } from 'react-router-dom';
 import { useDropzone } from 'react-dropzone';
 import { toast } from 'sonner';
@@ -36,6 +36,7 @@ import {
 } from '@/components/ui/alert-dialog';
 import { Progress } from '@/components/ui/progress';
 import { useAuth } from '@/context/AuthContext';
+import { usePendingDerivatives } from '@/hooks/use-pending-derivatives';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -55,6 +56,7 @@ export default function FolderManager({ onStatsChange }) {
   
   const [folders, setFolders] = useState([]);
   const [files, setFiles] = useState([]);
+  const filesRequestRef = useRef(0);
   const [path, setPath] = useState([]);
   const [loading, setLoading] = useState(true);
   
@@ -82,7 +84,12 @@ export default function FolderManager({ onStatsChange }) {
     fetchContent();
   }, [currentFolderId]);
 
+  usePendingDerivatives(files, setFiles, (ids) =>
+    fetch(`${API}/files/status?folder_id=${currentFolderId}&ids=${ids}`, { headers })
+  );
+
   const fetchContent = async () => {
+    const request = ++filesRequestRef.current;
     setLoading(true);
     try {
       // Fetch folders
@@ -98,7 +105,9 @@ export default function FolderManager({ onStatsChange }) {
       if (currentFolderId) {
         const filesRes = await fetch(`${API}/files?folder_id=${currentFolderId}`, { headers });
         if (filesRes.ok) {
-          setFiles(await filesRes.json());
+          const data = await filesRes.json();
+          setFiles(data.files);
+          fetchRemainingFiles(currentFolderId, data.next_cursor, request);
         }
 
         // Fetch path
@@ -118,6 +127,21 @@ export default function FolderManager({ onStatsChange }) {
     }
   };
 
+  // Show the first page straight away and append the rest as it arrives
+  const fetchRemainingFiles = async (folderId, cursor, request) => {
+    try {
+      while (cursor && filesRequestRef.current === request) {
+        const res = await fetch(`${API}/files?folder_id=${folderId}&cursor=${encodeURIComponent(cursor)}`, { headers });
+        if (!res.ok || filesRequestRef.current !== request) return;
+        const data = await res.json();
+        setFiles(prev => [...prev, ...data.files]);
+        cursor = data.next_cursor;
+      }
+    } catch (e) {
+      console.error('Failed to fetch files:', e);
+    }
+  };
+
   const navigateToFolder = (folderId) => {
     if (folderId) {
       setSearchParams({ folder: folderId });
@@ -672,17 +696,23 @@ export default function FolderManager({ onStatsChange }) {
                         }
                       }}
                     >
-                      <img
-                        src={`${BACKEND_URL}${file.thumbnail_url}`}
-                        alt={file.name}
-                        className="w-full h-full object-cover"
-                        loading="lazy"
-                        onError={(e) => {
-                          e.target.style.display = 'none';
-                          e.target.parentElement.classList.add('flex', 'items-center', 'justify-center');
-                          e.target.parentElement.innerHTML = '<span class="text-gray-500">Loading...</span>';
-                        }}
-                      />
+                      {file.derivative_status === 'pending' ? (
+                        <div className="w-full h-full flex items-center justify-center" data-testid={`pending-${file.id}`}>
+                          <span className="text-gray-500 animate-pulse">Processing...</span>
+                        </div>
+                      ) : (
+                        <img
+                          src={`${BACKEND_URL}${file.thumbnail_url}`}
+                          alt={file.name}
+                          className="w-full h-full object-cover"
+                          loading="lazy"
+                          onError={(e) => {
+                            e.target.style.display = 'none';
+                            e.target.parentElement.classList.add('flex', 'items-center', 'justify-center');
+                            e.target.parentElement.innerHTML = '<span class="text-gray-500">No preview</span>';
+                          }}
+                        />
+                      )}
                       {!selectionMode && (
                         <div className="absolute inset-0 bg-black/50 opacity-0 group-hover:opacity-100 transition-opacity flex items-center justify-center gap-2">
                           <button
@@ -899,7 +929,7 @@ export default function FolderManager({ onStatsChange }) {
           >
             <div className="relative max-w-[90vw] max-h-[90vh]" onClick={(e) => e.stopPropagation()}>
               <img
-                src={`${BACKEND_URL}${previewFile.preview_url || previewFile.thumbnail_url}`}
+                src={`${BACKEND_URL}${previewFile.display_url || previewFile.preview_url || previewFile.thumbnail_url}`}
                 alt={previewFile.name}
                 className="max-w-full max-h-[85vh] object-contain rounded"
               />
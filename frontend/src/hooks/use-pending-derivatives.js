@@ -0,0 +1,43 @@
+import { useEffect, useRef } from 'react';
+
+// How often files whose thumbnails are still being rendered are checked again
+const PENDING_POLL_MS = 3000;
+const PENDING_POLL_MAX_IDS = 100; // per request, keeping the URL short; the rest follow as these finish
+
+// Uploads return before their thumbnails exist. While any of `files` is still 'pending',
+// poll `fetchStatus(ids)` (a fetch of a .../files/status?ids= endpoint) and merge the fresh
+// entries into `setFiles`; their URLs carry the new ?v= version once rendered.
+export function usePendingDerivatives(files, setFiles, fetchStatus) {
+  const fetchStatusRef = useRef(fetchStatus);
+  fetchStatusRef.current = fetchStatus;
+
+  const pendingIds = files
+    .filter((f) => f.derivative_status === 'pending')
+    .slice(0, PENDING_POLL_MAX_IDS)
+    .map((f) => f.id)
+    .join(',');
+
+  useEffect(() => {
+    if (!pendingIds) return;
+    let cancelled = false;
+    const poll = async () => {
+      try {
+        const res = await fetchStatusRef.current(pendingIds);
+        if (!res.ok || cancelled) return;
+        const data = await res.json();
+        const updated = new Map(
+          data.files.filter((f) => f.derivative_status !== 'pending').map((f) => [f.id, f])
+        );
+        if (!updated.size || cancelled) return;
+        setFiles((prev) => prev.map((f) => (updated.has(f.id) ? { ...f, ...updated.get(f.id) } : f)));
+      } catch (e) {
+        console.error('Failed to check thumbnails:', e);
+      }
+    };
+    const interval = setInterval(poll, PENDING_POLL_MS);
+    return () => {
+      cancelled = true;
+      clearInterval(interval);
+    };
+  }, [pendingIds]);
+}